@@ -3,11 +3,24 @@ import csv
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
 import time
+
+# Total cores shared by all concurrent targets, split evenly between them
+CPU_BUDGET = os.cpu_count() or 1
+NUM_THREADS = 1
+# Extra command-line flags forwarded to every DrugReAlign.py run
+EXTRA_ARGS = []
+
+# Environment for a child run: its share of the core budget for docking
+def worker_env():
+    env = dict(os.environ)
+    env['DRUGREALIGN_CPU_BUDGET'] = str(max(1, CPU_BUDGET // NUM_THREADS))
+    return env
+
 # Function to run DrugReAlign.py for each PDB entry
 def run_drugrealign(pdb_name):
     try:
         # Run the DrugReAlign.py script with the PDB name as an argument
-        subprocess.run(['python', 'DrugReAlign.py', '--pdb_id' ,pdb_name], check=True)
+        subprocess.run(['python', 'DrugReAlign.py', '--pdb_id' ,pdb_name] + EXTRA_ARGS, check=True, env=worker_env())
         print(f"Successfully processed {pdb_name}")
     except subprocess.CalledProcessError as e:
         print(f"Error processing {pdb_name}: {e}")
@@ -16,35 +29,116 @@ def run_drugrealign(pdb_name):
 def run_custom_data(config_file):
     try:
         # Run the DrugReAlign-Custom Data.py script with the config file as an argument
-        subprocess.run(['python', 'DrugReAlign-Custom Data.py', config_file], check=True)
+        subprocess.run(['python', 'DrugReAlign-Custom Data.py', config_file], check=True, env=worker_env())
         print(f"Successfully processed {config_file}")
     except subprocess.CalledProcessError as e:
         print(f"Error processing {config_file}: {e}")
 
-# Function to process a CSV file and run DrugReAlign.py in parallel
-def process_drugrealign_csv(csv_file, num_threads=4):
+# Read the PDB IDs from the first column of a CSV file
+def read_pdb_list(csv_file):
     pdb_list = []
-    # Read the CSV file to extract PDB names
     with open(csv_file, 'r') as f:
         reader = csv.reader(f)
         for row in reader:
-            pdb_list.append(row[0])  # Assume the first column contains PDB names
+            if row:
+                pdb_list.append(row[0].strip())  # Assume the first column contains PDB names
+    return pdb_list
 
+# Function to process a CSV file and run DrugReAlign.py in parallel
+def process_drugrealign_csv(csv_file, num_threads=4):
+    pdb_list = read_pdb_list(csv_file)
+
+    global NUM_THREADS
+    NUM_THREADS = max(1, min(num_threads, len(pdb_list)))
     # Run DrugReAlign.py using multithreading
     with ThreadPoolExecutor(max_workers=num_threads) as executor:
         executor.map(run_drugrealign, pdb_list)
 
+# Run targets through the in-process stage pipeline: one interpreter for all targets, every
+# stage with its own worker pool, targets streaming from stage to stage. Caches (PLIP, ligands,
+# receptors, LLM answers) and the state ledger are shared by the whole batch.
+def run_pipeline(targets, build, num_threads=4, llm_replay=False, resume=True, token_budget=None,
+                 save_prompts=False, trace_path=None, tracer=None, progress=None):
+    from config.LLMClient import LLMStage
+    from config.LLMCache import LLMCache
+    from config.StateLedger import StateLedger
+    from config.Tracer import Tracer
+    from config.ProgressView import make_progress
+
+    # Every stage run is timed and counted; the per-stage table is printed at the end
+    tracer = tracer or Tracer()
+    llm_stage = LLMStage(api_key=None, base_url=None, model="gpt-4o", max_concurrency=num_threads,
+                         cache=LLMCache(replay_only=llm_replay))
+    # The ledger records every finished stage, so a rerun after a crash resumes each
+    # target at its first incomplete stage; without resume all stages run again
+    ledger = StateLedger() if resume else None
+    pipeline = build(llm_stage, workers={'llm': num_threads}, cpu_budget=CPU_BUDGET, ledger=ledger,
+                     token_budget=token_budget, save_prompts=save_prompts, tracer=tracer)
+    # One display for the whole batch: a bar per stage counting targets, or one line per event without a terminal
+    view = make_progress([stage.name for stage in pipeline.stages], len(targets), mode=progress)
+    pipeline.on_event = view
+    try:
+        with view:
+            results = pipeline.run(targets)
+    finally:
+        pipeline.close()
+        llm_stage.close()
+    for target in targets:
+        target = results[target.pdb_id]
+        if target.error:
+            print(f"Error processing {target.pdb_id}: {target.error}")
+        else:
+            print(f"Successfully processed {target.pdb_id}")
+    print(tracer.format_summary())
+    if trace_path:
+        tracer.write(trace_path)
+        print(f"Trace written to {trace_path}")
+    if ledger is not None:
+        for stage, status, count, duration in ledger.summary():
+            print(f"{stage:<10} {status:<7} {count:>5} targets {duration or 0:>10.1f} s")
+        ledger.close()
+    return results
+
+# Function to process a CSV file of PDB IDs with the in-process stage pipeline
+def process_drugrealign_pipeline(csv_file, num_threads=4, llm_replay=False, resume=True, token_budget=None,
+                                 save_prompts=False, trace_path=None, progress=None):
+    from config.PipelineStages import Target, build_pipeline, prefetch_targets
+    from config.Tracer import Tracer
+
+    pdb_list = read_pdb_list(csv_file)
+    tracer = Tracer()
+    # Fetch every PDB, FASTA and summary (pooled HTTP, or the local mirror/archive) before compute starts
+    prefetch_targets(pdb_list, tracer=tracer)
+    return run_pipeline([Target(pdb_id) for pdb_id in pdb_list], build_pipeline, num_threads, llm_replay, resume,
+                        token_budget, save_prompts, trace_path, tracer, progress)
+
+# Function to process custom data (a folder of configs, uploaded PDBs and FASTA queries, or a
+# manifest) with the same in-process stage pipeline as PDB IDs
+def process_custom_pipeline(path, num_threads=4, llm_replay=False, resume=True, token_budget=None,
+                            save_prompts=False, trace_path=None, progress=None):
+    from config.CustomTargets import load_targets, build_custom_pipeline, resolve_similar
+
+    targets = load_targets(path)
+    if not targets:
+        print(f"No custom targets found in {path}")
+        return {}
+    # Similar PDB entries of all queries in one batch, when a local sequence index is built
+    resolve_similar(targets)
+    return run_pipeline(targets, build_custom_pipeline, num_threads, llm_replay, resume, token_budget,
+                        save_prompts, trace_path, progress=progress)
+
 # Function to process a folder containing config files and run DrugReAlign-Custom Data.py in parallel
 def process_custom_data_folder(config_folder, num_threads=4):
-    # List all .config files in the specified folder
-    config_files = [os.path.join(config_folder, f) for f in os.listdir(config_folder) if f.endswith('.config')]
+    # List all config files in the specified folder
+    config_files = [os.path.join(config_folder, f) for f in sorted(os.listdir(config_folder))
+                    if f.endswith(('.yaml', '.yml', '.config'))]
     
+    global NUM_THREADS
+    NUM_THREADS = max(1, min(num_threads, len(config_files)))
     # Run DrugReAlign-Custom Data.py using multithreading
     with ThreadPoolExecutor(max_workers=num_threads) as executor:
         executor.map(run_custom_data, config_files)
 
-# Main function to handle command-line arguments and choose the appropriate task
-
 # Main function to handle command-line arguments and choose the appropriate task
 if __name__ == '__main__':
     import argparse
@@ -53,10 +147,31 @@ if __name__ == '__main__':
     parser.add_argument('--mode', default='Normal',choices=['Normal', 'Custom'],
                         help="Select mode: 'DrugReAlign' for CSV input, 'Custom' for config folder input")
     parser.add_argument('--csv', default='./batch_input/DrugReAlign/input.csv', help="CSV file for DrugReAlign.py")
-    parser.add_argument('--config_folder',default='./batch_input/DrugReAlign-Custom Data', help="Folder containing config files for DrugReAlign-Custom Data.py")
+    parser.add_argument('--config_folder',default='./batch_input/DrugReAlign-Custom Data',
+                        help="Custom mode: folder of config files, uploaded .pdb files and .fasta queries, or a manifest (.yaml/.csv)")
     parser.add_argument('--threads', type=int, default=12, help="Number of threads to use")
+    parser.add_argument('--engine', default='pipeline', choices=['pipeline', 'subprocess'],
+                        help="Run all targets in one in-process pipeline, or one DrugReAlign.py / DrugReAlign-Custom Data.py subprocess per target")
+    parser.add_argument('--no_resume', action='store_true', help="Pipeline engine: ignore the stage ledger and rerun every stage")
+    parser.add_argument('--llm_replay', action='store_true', help="Only use cached LLM answers, never call the API")
+    parser.add_argument('--token_budget', type=int, default=None, help="Compact every prompt to at most this many tokens")
+    parser.add_argument('--progress', default=None, choices=['live', 'lines', 'json'],
+                        help="Progress display: live bars (default on a terminal), or one line / JSON object per event")
+    parser.add_argument('--save_prompts', action='store_true', help="Also write every prompt to data/question/ for audit")
+    parser.add_argument('--trace', default=None,
+                        help="Pipeline engine: write per-stage timings and counters, .jsonl (one span per line) or .json (Chrome trace)")
+    parser.add_argument('--cpus', type=int, default=CPU_BUDGET, help="Total CPU cores shared by all targets for docking")
 
     args = parser.parse_args()
+    CPU_BUDGET = args.cpus
+    if args.llm_replay:
+        EXTRA_ARGS.append('--llm_replay')
+    # Line-per-event progress by default, since concurrent children share one terminal or log file
+    EXTRA_ARGS += ['--progress', args.progress or 'lines']
+    if args.save_prompts:
+        EXTRA_ARGS.append('--save_prompts')
+    if args.token_budget:
+        EXTRA_ARGS += ['--token_budget', str(args.token_budget)]
 
     # Handle DrugReAlign mode, which processes CSV input
     if args.mode == 'Normal':
@@ -64,7 +179,11 @@ if __name__ == '__main__':
             # Start the timer
             start_time = time.time()
             
-            process_drugrealign_csv(args.csv, args.threads)
+            if args.engine == 'pipeline':
+                process_drugrealign_pipeline(args.csv, args.threads, args.llm_replay, not args.no_resume, args.token_budget,
+                                             args.save_prompts, args.trace, args.progress)
+            else:
+                process_drugrealign_csv(args.csv, args.threads)
             
             # End the timer and print elapsed time
             end_time = time.time()
@@ -79,7 +198,11 @@ if __name__ == '__main__':
             # Start the timer
             start_time = time.time()
             
-            process_custom_data_folder(args.config_folder, args.threads)
+            if args.engine == 'pipeline':
+                process_custom_pipeline(args.config_folder, args.threads, args.llm_replay, not args.no_resume,
+                                        args.token_budget, args.save_prompts, args.trace, args.progress)
+            else:
+                process_custom_data_folder(args.config_folder, args.threads)
             
             # End the timer and print elapsed time
             end_time = time.time()
@@ -0,0 +1,159 @@
+# Local stand-in for the RCSB and PubChem endpoints the pipeline calls, serving the bundled
+# config/pdb files and a small table of approved drugs.
+#
+# Run from the repository root:
+#   python -m benchmark.fixture_server [--port 8765] [--latency 0.05]
+# and point the pipeline at it:
+#   DRUGREALIGN_RCSB_FILES_URL=http://127.0.0.1:8765 DRUGREALIGN_RCSB_URL=http://127.0.0.1:8765 \
+#   DRUGREALIGN_RCSB_SEARCH_URL=http://127.0.0.1:8765 DRUGREALIGN_RCSB_GRAPHQL_URL=http://127.0.0.1:8765/graphql \
+#   DRUGREALIGN_PUBCHEM_URL=http://127.0.0.1:8765/rest/pug python batch_process.py ...
+#
+# Routes: /download/<id>.pdb, /fasta/entry/<id>, POST /rcsbsearch/v2/query (returns the first
+# bundled entry) and POST /graphql (entry metadata from the PDB header). PubChem: POST /rest/pug/compound/name/cids/JSON and
+# POST /rest/pug/compound/cid/property/IsomericSMILES/JSON for the names in FIXTURE_COMPOUNDS.
+import os
+import re
+import gzip
+import json
+import time
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config.StructureSource import fasta_from_pdb, summary_from_pdb
+
+
+# Drugs the stand-ins know: name -> (PubChem CID, isomeric SMILES)
+FIXTURE_COMPOUNDS = {
+    'Aspirin': (2244, 'CC(=O)OC1=CC=CC=C1C(=O)O'),
+    'Ibuprofen': (3672, 'CC(C)CC1=CC=C(C=C1)C(C)C(=O)O'),
+    'Paracetamol': (1983, 'CC(=O)NC1=CC=C(C=C1)O'),
+    'Caffeine': (2519, 'CN1C=NC2=C1C(=O)N(C(=O)N2C)C'),
+    'Metformin': (4091, 'CN(C)C(=N)N=C(N)N'),
+    'Celecoxib': (2662, 'CC1=CC=C(C=C1)C2=CC(=NN2C3=CC=C(C=C3)S(=O)(=O)N)C(F)(F)F'),
+    'Imatinib': (5291, 'CC1=C(C=C(C=C1)NC(=O)C2=CC=C(C=C2)CN3CCN(CC3)C)NC4=NC=CC(=N4)C5=CN=CC=C5'),
+    'Methotrexate': (126941, 'CN(CC1=CN=C2C(=N1)C(=NC(=N2)N)N)C3=CC=C(C=C3)C(=O)NC(CCC(=O)O)C(=O)O'),
+}
+
+
+def pubchem_response(path, form):
+    # (status, body) for the two PubChem PUG REST calls CompoundCache makes
+    if path.endswith('/compound/name/cids/JSON'):
+        names = {name.lower(): cid for name, (cid, _) in FIXTURE_COMPOUNDS.items()}
+        cid = names.get(form.get('name', [''])[0].strip().lower())
+        if cid is None:
+            return 404, {'Fault': {'Code': 'PUGREST.NotFound', 'Message': 'No CID found'}}
+        return 200, {'IdentifierList': {'CID': [cid]}}
+    if path.endswith('/compound/cid/property/IsomericSMILES/JSON'):
+        smiles = {cid: value for cid, value in FIXTURE_COMPOUNDS.values()}
+        cids = [int(cid) for cid in form.get('cid', [''])[0].split(',') if cid]
+        return 200, {'PropertyTable': {'Properties': [{'CID': cid, 'IsomericSMILES': smiles[cid]}
+                                                      for cid in cids if cid in smiles]}}
+    return 404, {'Fault': {'Code': 'PUGREST.BadRequest'}}
+
+
+def pdb_to_graphql_entry(pdb_id, pdb_text):
+    # The RCSB GraphQL entry shape MetadataIndex asks for
+    summary = summary_from_pdb(pdb_id, pdb_text)
+    organisms = [{'scientific_name': name} for name in summary['Organism(s)'].split(', ') if name != 'Not found']
+    hosts = [{'scientific_name': name} for name in summary['Expression System'].split(', ') if name != 'Not found']
+    return {'rcsb_id': pdb_id.upper(), 'struct': {'title': summary['Title']},
+            'struct_keywords': {'pdbx_keywords': summary['Classification']},
+            'polymer_entities': [{'rcsb_entity_source_organism': organisms, 'rcsb_entity_host_organism': hosts}]}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pdb_dir = './config/pdb'
+    latency = 0.0
+    counter = {'requests': 0}
+    counter_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def load_pdb(self, pdb_id):
+        path = os.path.join(self.pdb_dir, f'{pdb_id.lower()}.pdb')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read()
+
+    def send_body(self, status, body, content_type='text/plain'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def count(self):
+        with self.counter_lock:
+            self.counter['requests'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def do_GET(self):
+        self.count()
+        routes = [
+            (r'^/download/(\w{4})\.pdb$', lambda pdb_id, text: text),
+            (r'^/fasta/entry/(\w{4})$', fasta_from_pdb),
+        ]
+        for pattern, render in routes:
+            match = re.match(pattern, self.path)
+            if match:
+                text = self.load_pdb(match.group(1))
+                if text is None:
+                    self.send_body(404, 'Not found')
+                else:
+                    self.send_body(200, render(match.group(1), text))
+                return
+        self.send_body(404, 'Not found')
+
+    def do_POST(self):
+        self.count()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.path.startswith('/rest/pug/'):
+            status, result = pubchem_response(self.path, parse_qs(body.decode('utf-8')))
+            self.send_body(status, json.dumps(result), 'application/json')
+            return
+        if self.path.startswith('/graphql'):
+            ids = json.loads(body)['variables']['ids']
+            entries = [pdb_to_graphql_entry(pdb_id, text) if text is not None else None
+                       for pdb_id, text in ((pdb_id, self.load_pdb(pdb_id)) for pdb_id in ids)]
+            self.send_body(200, json.dumps({'data': {'entries': entries}}), 'application/json')
+            return
+        if not self.path.startswith('/rcsbsearch/v2/query'):
+            self.send_body(404, 'Not found')
+            return
+        entries = sorted(name[:-4].upper() for name in os.listdir(self.pdb_dir) if name.endswith('.pdb'))
+        result = {'result_set': [{'identifier': entry, 'score': 1.0} for entry in entries[:1]]}
+        self.send_body(200, json.dumps(result), 'application/json')
+
+
+def start_server(port=0, pdb_dir='./config/pdb', latency=0.0):
+    """Start the stand-in on a background thread; returns (server, base_url)."""
+    handler = type('Handler', (FixtureHandler,), {'pdb_dir': pdb_dir, 'latency': latency,
+                                                  'counter': {'requests': 0}})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve bundled PDB files and fixture drugs as a local RCSB/PubChem stand-in")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pdb_dir', default='./config/pdb')
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+    server, url = start_server(args.port, args.pdb_dir, args.latency)
+    print(f'Serving {args.pdb_dir} at {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
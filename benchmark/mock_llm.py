@@ -0,0 +1,86 @@
+# OpenAI-compatible stand-in that answers every chat completion with a canned drug list.
+#
+# Run from the repository root:
+#   python -m benchmark.mock_llm [--port 8766] [--latency 1.0]
+# and point the pipeline at it:
+#   OPENAI_BASE_URL=http://127.0.0.1:8766/v1 OPENAI_API_KEY=benchmark python batch_process.py ...
+#
+# The answer names five drugs of benchmark.fixture_server.FIXTURE_COMPOUNDS, chosen from a hash of
+# the prompt, so a prompt always gets the same answer and every drug resolves on the PubChem stand-in.
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from benchmark.fixture_server import FIXTURE_COMPOUNDS
+
+
+def canned_answer(prompt, count=5):
+    names = sorted(FIXTURE_COMPOUNDS)
+    offset = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16) % len(names)
+    chosen = [names[(offset + index) % len(names)] for index in range(count)]
+    drugs = [{'ranking': str(rank), 'name': name, 'explanation': f'{name} is a benchmark fixture answer.'}
+             for rank, name in enumerate(chosen, start=1)]
+    return json.dumps({'drugs': drugs}, indent=2)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    counter = {'requests': 0}
+    counter_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        with self.counter_lock:
+            self.counter['requests'] += 1
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = ''.join(message.get('content', '') for message in body.get('messages', []))
+        content = canned_answer(prompt)
+        # Roughly four characters per token, like the usage OpenAI reports
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        self.send_json(200, {
+            'id': 'chatcmpl-benchmark', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'gpt-4o'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+
+def start_server(port=0, latency=0.0):
+    """Start the stand-in on a background thread; returns (server, base_url) with base_url ending in /v1."""
+    handler = type('Handler', (MockLLMHandler,), {'latency': latency, 'counter': {'requests': 0}})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve canned drug answers as an OpenAI-compatible stand-in")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every completion")
+    args = parser.parse_args()
+    server, url = start_server(args.port, args.latency)
+    print(f'Serving canned completions at {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
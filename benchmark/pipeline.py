@@ -0,0 +1,206 @@
+# Benchmark the full DrugReAlign pipeline offline: bundled receptors, local RCSB/PubChem and OpenAI stand-ins.
+#
+# Run from the repository root:
+#   python -m benchmark.pipeline [--batch_sizes 1,4,9] [--workers 1,2,4] [--stop_after template]
+#                                [--baseline result/benchmark/pipeline_old.json] [--output result/benchmark/pipeline.json]
+#
+# Every configuration runs in a fresh child process and working directory (cold caches, no state
+# ledger), so peak RSS and timings are not skewed by earlier runs. The report holds targets/hour,
+# per-stage p50/p95 latency, CPU time and counters, peak RSS and request counts; with --baseline
+# the throughput and per-stage p95 are compared with an earlier report.
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from benchmark.fixture_server import start_server as start_fixture_server
+from benchmark.mock_llm import start_server as start_llm_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Stage pools sized by --workers
+POOLS = ('download', 'summary', 'plip', 'plip_sites', 'template', 'llm', 'ligands', 'receptor', 'dock', 'combine',
+         'visualize', 'plip_visualize')
+
+
+def peak_rss_mb(who):
+    import resource
+    usage = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+def run_child(spec_path, result_path):
+    """One configuration, inside the child process: prefetch, then stream the batch through the pipeline."""
+    from config.LLMClient import LLMStage
+    from config.PipelineStages import Target, build_pipeline, prefetch_targets
+    from config.Tracer import Tracer
+    import resource
+
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    workers = spec['workers']
+    tracer = Tracer()
+    start = time.perf_counter()
+    prefetch_targets(spec['pdb_ids'], tracer=tracer)
+    llm_stage = LLMStage(model='gpt-4o', max_concurrency=workers, cache=None)
+    pipeline = build_pipeline(llm_stage, workers={name: workers for name in POOLS}, tracer=tracer)
+    if spec.get('stop_after'):
+        names = [stage.name for stage in pipeline.stages]
+        pipeline.stages = pipeline.stages[:names.index(spec['stop_after']) + 1]
+    with pipeline:
+        results = pipeline.run([Target(pdb_id, exhaustiveness=spec['exhaustiveness']) for pdb_id in spec['pdb_ids']])
+    llm_stage.close()
+    seconds = time.perf_counter() - start
+
+    stages = {row['stage']: {key: value for key, value in row.items() if key != 'stage'} for row in tracer.summary()}
+    errors = {pdb_id: target.error for pdb_id, target in results.items() if target.error}
+    result = {'seconds': seconds, 'targets': len(results), 'completed': len(results) - len(errors), 'errors': errors,
+              'stages': stages, 'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF),
+              'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, default=str)
+
+
+def run_configuration(pdb_ids, workers, args, env):
+    work_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        # Relative paths (./config/template.txt, ./data, ./result) resolve inside the scratch directory
+        os.symlink(os.path.join(REPO_ROOT, 'config'), os.path.join(work_dir, 'config'))
+        spec_path = os.path.join(work_dir, 'spec.json')
+        result_path = os.path.join(work_dir, 'result.json')
+        with open(spec_path, 'w', encoding='utf-8') as f:
+            json.dump({'pdb_ids': pdb_ids, 'workers': workers, 'stop_after': args.stop_after,
+                       'exhaustiveness': args.exhaustiveness}, f)
+        process = subprocess.run([sys.executable, '-m', 'benchmark.pipeline', '--child', spec_path, result_path],
+                                 cwd=work_dir, env=env, timeout=args.timeout,
+                                 stdout=None if args.verbose else subprocess.DEVNULL)
+        if process.returncode != 0 or not os.path.exists(result_path):
+            return {'error': f'child exited with {process.returncode}'}
+        with open(result_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        if args.keep:
+            print(f'Kept {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(report, baseline, threshold):
+    """Throughput and per-stage p95 against a baseline report, matched by batch size and workers."""
+    previous = {(run['batch_size'], run['workers']): run for run in baseline.get('runs', []) if 'seconds' in run}
+    rows = []
+    for run in report['runs']:
+        old = previous.get((run['batch_size'], run['workers']))
+        if old is None or 'seconds' not in run:
+            continue
+        checks = [('targets_per_hour', old['targets_per_hour'], run['targets_per_hour'], True)]
+        for stage, values in run['stages'].items():
+            if stage in old['stages'] and values['runs']:
+                checks.append((f'{stage} p95_s', old['stages'][stage]['p95_s'], values['p95_s'], False))
+        for metric, before, after, higher_is_better in checks:
+            change = (after - before) / before if before else 0.0
+            regression = change < -threshold if higher_is_better else change > threshold
+            rows.append({'batch_size': run['batch_size'], 'workers': run['workers'], 'metric': metric,
+                         'baseline': before, 'current': after, 'change': change, 'regression': regression})
+    return rows
+
+
+def git_label():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DrugReAlign pipeline against local stand-ins")
+    parser.add_argument('--child', nargs=2, metavar=('SPEC', 'RESULT'), help=argparse.SUPPRESS)
+    parser.add_argument('--pdb_dir', default='./config/pdb', help="Folder with the receptors to serve and process")
+    parser.add_argument('--batch_sizes', default='1,4,9', help="Comma-separated numbers of targets per run")
+    parser.add_argument('--workers', default='1,2,4', help="Comma-separated pool sizes applied to every stage")
+    parser.add_argument('--repeats', type=int, default=1, help="Runs per configuration")
+    parser.add_argument('--stop_after', default=None, help="Only run the stages up to and including this one")
+    parser.add_argument('--exhaustiveness', type=int, default=1, help="Vina exhaustiveness of the docking stage")
+    parser.add_argument('--rcsb_latency', type=float, default=0.05, help="Seconds added to every RCSB/PubChem response")
+    parser.add_argument('--llm_latency', type=float, default=1.0, help="Seconds added to every chat completion")
+    parser.add_argument('--timeout', type=float, default=3600, help="Seconds after which a run is abandoned")
+    parser.add_argument('--baseline', default=None, help="Earlier report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change reported as a regression")
+    parser.add_argument('--label', default=None, help="Name of this version in the report (default: git describe)")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch directories")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline output")
+    parser.add_argument('--output', default='./result/benchmark/pipeline.json', help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    fixture_server, fixture_url = start_fixture_server(pdb_dir=args.pdb_dir, latency=args.rcsb_latency)
+    llm_server, llm_url = start_llm_server(latency=args.llm_latency)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])),
+               DRUGREALIGN_RCSB_FILES_URL=fixture_url, DRUGREALIGN_RCSB_URL=fixture_url,
+               DRUGREALIGN_RCSB_SEARCH_URL=fixture_url, DRUGREALIGN_RCSB_GRAPHQL_URL=f'{fixture_url}/graphql',
+               DRUGREALIGN_PUBCHEM_URL=f'{fixture_url}/rest/pug', DRUGREALIGN_STRUCTURE_SOURCES='remote',
+               OPENAI_BASE_URL=llm_url, OPENAI_API_KEY='benchmark')
+    for name in ('DRUGREALIGN_OFFLINE', 'DRUGREALIGN_CPU_BUDGET'):
+        env.pop(name, None)
+
+    available = sorted(name[:-4].upper() for name in os.listdir(args.pdb_dir) if name.endswith('.pdb'))
+    report = {'label': args.label or git_label(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+              'settings': {'rcsb_latency': args.rcsb_latency, 'llm_latency': args.llm_latency,
+                           'exhaustiveness': args.exhaustiveness, 'stop_after': args.stop_after},
+              'runs': []}
+    try:
+        for batch_size in [int(value) for value in args.batch_sizes.split(',')]:
+            if batch_size > len(available):
+                print(f'Batch size {batch_size} exceeds the {len(available)} bundled receptors; using {len(available)}')
+                batch_size = len(available)
+            for workers in [int(value) for value in args.workers.split(',')]:
+                for repeat in range(args.repeats):
+                    requests_before = (fixture_server.RequestHandlerClass.counter['requests'],
+                                       llm_server.RequestHandlerClass.counter['requests'])
+                    entry = {'batch_size': batch_size, 'workers': workers, 'repeat': repeat}
+                    entry.update(run_configuration(available[:batch_size], workers, args, env))
+                    entry['requests'] = {
+                        'fixture': fixture_server.RequestHandlerClass.counter['requests'] - requests_before[0],
+                        'llm': llm_server.RequestHandlerClass.counter['requests'] - requests_before[1]}
+                    if 'seconds' in entry:
+                        entry['targets_per_hour'] = entry['completed'] / entry['seconds'] * 3600 if entry['seconds'] else 0.0
+                        print(f"batch {batch_size:>3} workers {workers:>2}: {entry['completed']}/{entry['targets']} targets "
+                              f"in {entry['seconds']:.1f} s, {entry['targets_per_hour']:.0f} targets/h, "
+                              f"peak RSS {entry['peak_rss_mb']:.0f} MB")
+                        for stage, values in entry['stages'].items():
+                            print(f"    {stage:<10} p50 {values['p50_s']:>8.2f} s  p95 {values['p95_s']:>8.2f} s  "
+                                  f"failed {values['failed']}")
+                    else:
+                        print(f"batch {batch_size:>3} workers {workers:>2}: {entry['error']}")
+                    report['runs'].append(entry)
+    finally:
+        fixture_server.shutdown()
+        llm_server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['baseline'] = baseline.get('label')
+        report['comparison'] = compare(report, baseline, args.threshold)
+        for row in report['comparison']:
+            flag = 'REGRESSION' if row['regression'] else ''
+            print(f"batch {row['batch_size']:>3} workers {row['workers']:>2} {row['metric']:<24} "
+                  f"{row['baseline']:>10.2f} -> {row['current']:>10.2f} ({row['change']:+.1%}) {flag}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f'Report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
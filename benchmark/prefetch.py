@@ -0,0 +1,62 @@
+# Benchmark RCSB bulk prefetch against the local stand-in: one-by-one downloads vs pooled concurrent prefetch.
+#
+# Run from the repository root:
+#   python -m benchmark.prefetch [--latency 0.05] [--workers 8] [--output result/benchmark/prefetch.json]
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from config.RCSBFetcher import RCSBFetcher
+from config.MetadataIndex import MetadataIndex
+from benchmark.fixture_server import start_server
+
+
+def run(fetcher, pdb_ids, work_dir, workers, graphql_url):
+    save_root = os.path.join(work_dir, f'data_{workers}')
+    metadata_index = MetadataIndex(db_path=os.path.join(save_root, 'pdb_metadata.sqlite'), graphql_url=graphql_url,
+                                   fetcher=fetcher)
+    start = time.perf_counter()
+    status = fetcher.prefetch(pdb_ids, save_root=save_root, metadata_index=metadata_index)
+    elapsed = time.perf_counter() - start
+    result = {'workers': workers, 'seconds': elapsed, 'targets_per_second': len(pdb_ids) / elapsed if elapsed else None,
+              'complete': sum(status.values())}
+    metadata_index.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled RCSB prefetch")
+    parser.add_argument('--pdb_dir', default='./config/pdb', help="Folder with the .pdb files to serve")
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated server latency per request in seconds")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent requests for the pooled run")
+    parser.add_argument('--output', default='./result/benchmark/prefetch.json', help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    server, url = start_server(pdb_dir=args.pdb_dir, latency=args.latency)
+    pdb_ids = sorted(name[:-4].upper() for name in os.listdir(args.pdb_dir) if name.endswith('.pdb'))
+    work_dir = tempfile.mkdtemp(prefix='prefetch_')
+    report = []
+    try:
+        for workers in (1, args.workers):
+            fetcher = RCSBFetcher(files_url=url, www_url=url, search_url=url, workers=workers)
+            entry = run(fetcher, pdb_ids, work_dir, workers, f'{url}/graphql')
+            fetcher.close()
+            report.append(entry)
+            print(json.dumps(entry))
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = {'targets': len(pdb_ids), 'requests': server.RequestHandlerClass.counter['requests'],
+               'latency': args.latency, 'speedup': report[0]['seconds'] / report[-1]['seconds']}
+    print(json.dumps(summary))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'runs': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Benchmark receptor PDBQT preparation: in-process OpenBabel backend vs MGLTools.
+#
+# Run from the repository root:
+#   python -m benchmark.receptor_prep [--mgltools] [--output result/benchmark/receptor_prep.json]
+#
+# The bundled config/pdb/*.pdbqt files were produced with prepare_receptor4.py and serve as the
+# MGLTools reference when MGLTools is not installed; with --mgltools it is also timed live.
+import os
+import json
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from config.PDBConverter import PDBConverter
+
+
+def read_pdbqt_atoms(pdbqt_path):
+    atoms = {}
+    with open(pdbqt_path, 'r') as file:
+        for line in file:
+            if not line.startswith(('ATOM', 'HETATM')):
+                continue
+            key = (line[21], line[22:27].strip(), line[17:20].strip(), line[12:16].strip())
+            atoms[key] = {
+                'coord': (float(line[30:38]), float(line[38:46]), float(line[46:54])),
+                'charge': float(line[70:76]),
+                'type': line[77:79].strip(),
+            }
+    return atoms
+
+
+def compare(candidate_path, reference_path):
+    candidate = read_pdbqt_atoms(candidate_path)
+    reference = read_pdbqt_atoms(reference_path)
+    shared = [key for key in reference if key in candidate]
+    heavy = [key for key in shared if reference[key]['type'] not in ('H', 'HD', 'HS')]
+    result = {
+        'atoms': len(candidate),
+        'reference_atoms': len(reference),
+        'polar_h': sum(atom['type'] == 'HD' for atom in candidate.values()),
+        'reference_polar_h': sum(atom['type'] == 'HD' for atom in reference.values()),
+        'matched_heavy_fraction': len(heavy) / max(1, sum(a['type'] not in ('H', 'HD', 'HS') for a in reference.values())),
+    }
+    if heavy:
+        coords = np.array([candidate[key]['coord'] for key in heavy]) - np.array([reference[key]['coord'] for key in heavy])
+        charges = np.array([candidate[key]['charge'] - reference[key]['charge'] for key in heavy])
+        result['type_agreement'] = float(np.mean([candidate[key]['type'] == reference[key]['type'] for key in heavy]))
+        result['max_coord_deviation'] = float(np.abs(coords).max())
+        result['charge_mae'] = float(np.abs(charges).mean())
+    return result
+
+
+def time_backend(pdb_path, backend, output_dir, repeat):
+    output_path = os.path.join(output_dir, f'{backend}_{os.path.basename(pdb_path)}qt')
+    timings = []
+    for _ in range(repeat):
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        start = time.perf_counter()
+        PDBConverter(pdbqt_path=output_path, pdb_path=pdb_path, backend=backend).convert_pdb_to_pdbqt()
+        timings.append(time.perf_counter() - start)
+    return output_path, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark receptor PDBQT preparation backends")
+    parser.add_argument('--pdb_dir', default='./config/pdb', help="Folder with receptor .pdb files and reference .pdbqt files")
+    parser.add_argument('--mgltools', action='store_true', help="Also time the MGLTools backend live")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per receptor, the fastest is reported")
+    parser.add_argument('--output', default='./result/benchmark/receptor_prep.json', help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='receptor_prep_')
+    report = []
+    try:
+        for pdb_path in sorted(glob.glob(os.path.join(args.pdb_dir, '*.pdb'))):
+            # MGLTools writes its temp file next to the input, so work on a private copy
+            local_pdb = shutil.copy(pdb_path, work_dir)
+            entry = {'receptor': os.path.basename(pdb_path)}
+            openbabel_path, entry['openbabel_seconds'] = time_backend(local_pdb, 'openbabel', work_dir, args.repeat)
+            reference_path = pdb_path + 'qt'
+            if args.mgltools:
+                reference_path, entry['mgltools_seconds'] = time_backend(local_pdb, 'mgltools', work_dir, args.repeat)
+            if os.path.exists(reference_path):
+                entry.update(compare(openbabel_path, reference_path))
+            report.append(entry)
+            print(json.dumps(entry))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total = sum(entry['openbabel_seconds'] for entry in report)
+    summary = {'receptors': len(report), 'openbabel_receptors_per_second': len(report) / total if total else None}
+    if args.mgltools:
+        mgl_total = sum(entry['mgltools_seconds'] for entry in report)
+        summary['mgltools_receptors_per_second'] = len(report) / mgl_total if mgl_total else None
+    print(json.dumps(summary))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'receptors': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='w', encoding=None, newline=None):
+    """Write to a temp file next to ``path`` and rename it into place on success.
+
+    Readers, and the ``os.path.exists`` checks that skip finished work, never
+    see a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    if 'b' in mode:
+        file = open(temp_path, mode)
+    else:
+        file = open(temp_path, mode, encoding=encoding, newline=newline)
+    try:
+        with file:
+            yield file
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,139 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+PUBCHEM_BASE_URL = 'https://pubchem.ncbi.nlm.nih.gov/rest/pug'
+
+
+class CompoundCache:
+    """Persistent name -> CID/SMILES store in front of PubChem.
+
+    Names are keyed in normalised form, so "Imatinib" and " IMATINIB " share
+    one entry. Names PubChem does not know are cached as ``not_found`` too.
+    ``resolve`` looks up the misses of a whole list: names are mapped to CIDs
+    concurrently, one request per name (PUG REST has no multi-name lookup),
+    and the SMILES of all CIDs are then fetched in batched property requests.
+    In ``offline`` mode only the cache is consulted.
+    """
+
+    def __init__(self, db_path='./data/compound_cache.sqlite', base_url=None, offline=None,
+                 workers=4, timeout=30, batch_size=100):
+        self.db_path = db_path
+        self.base_url = (base_url or os.environ.get('DRUGREALIGN_PUBCHEM_URL') or PUBCHEM_BASE_URL).rstrip('/')
+        if offline is None:
+            offline = os.environ.get('DRUGREALIGN_OFFLINE', '') not in ('', '0')
+        self.offline = offline
+        self.workers = workers
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS compounds ('
+                              'name_key TEXT PRIMARY KEY, name TEXT, cid INTEGER, smiles TEXT, '
+                              'status TEXT NOT NULL, updated REAL NOT NULL)')
+
+    @staticmethod
+    def normalize_name(name):
+        return re.sub(r'\s+', ' ', name).strip().lower()
+
+    def lookup(self, names):
+        keys = {self.normalize_name(name) for name in names}
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.conn.execute('SELECT cid, smiles, status FROM compounds WHERE name_key = ?',
+                                        (key,)).fetchone()
+                if row:
+                    found[key] = row
+        return found
+
+    def store(self, entries):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO compounds VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(self.normalize_name(name), name, cid, smiles, status, now)
+                                   for name, cid, smiles, status in entries])
+
+    def fetch_cid(self, name):
+        # POST keeps names with slashes or brackets out of the URL path
+        response = requests.post(f'{self.base_url}/compound/name/cids/JSON', data={'name': name},
+                                 timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        cids = response.json().get('IdentifierList', {}).get('CID', [])
+        return cids[0] if cids else None
+
+    def fetch_smiles(self, cids):
+        smiles = {}
+        for start in range(0, len(cids), self.batch_size):
+            chunk = cids[start:start + self.batch_size]
+            response = requests.post(f'{self.base_url}/compound/cid/property/IsomericSMILES/JSON',
+                                     data={'cid': ','.join(str(cid) for cid in chunk)}, timeout=self.timeout)
+            response.raise_for_status()
+            for record in response.json().get('PropertyTable', {}).get('Properties', []):
+                # Newer PubChem releases report the isomeric form under "SMILES"
+                smiles[record['CID']] = record.get('IsomericSMILES') or record.get('SMILES')
+        return smiles
+
+    def resolve(self, names):
+        """Return {name: SMILES | 'Not Found' | 'Error'} for every name."""
+        cached = self.lookup(names)
+        missing = list({self.normalize_name(name): name for name in names
+                        if self.normalize_name(name) not in cached}.values())
+        # Normalised keys, so every spelling of a failed name is reported the same way
+        errors = set()
+        if missing and not self.offline:
+            cids = {}
+
+            def fetch(name):
+                try:
+                    cids[name] = self.fetch_cid(name)
+                except Exception as e:
+                    logging.error(f"Error resolving {name} on PubChem: {e}")
+                    errors.add(self.normalize_name(name))
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(fetch, missing))
+            found_cids = sorted({cid for cid in cids.values() if cid is not None})
+            try:
+                smiles = self.fetch_smiles(found_cids) if found_cids else {}
+            except Exception as e:
+                logging.error(f"Error fetching SMILES from PubChem: {e}")
+                smiles = None
+                errors.update(self.normalize_name(name) for name, cid in cids.items() if cid is not None)
+            entries = []
+            for name, cid in cids.items():
+                if cid is None:
+                    entries.append((name, None, None, 'not_found'))
+                elif smiles is not None and smiles.get(cid):
+                    entries.append((name, cid, smiles[cid], 'found'))
+            self.store(entries)
+            cached = self.lookup(names)
+
+        result = {}
+        for name in names:
+            row = cached.get(self.normalize_name(name))
+            if row and row[2] == 'found':
+                result[name] = row[1]
+            elif self.normalize_name(name) in errors:
+                result[name] = 'Error'
+            else:
+                result[name] = 'Not Found'
+        return result
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    cache = CompoundCache()
+    print(cache.resolve(['Imatinib', 'olaparib', 'Methotrexate', 'not a real drug']))
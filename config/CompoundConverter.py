@@ -1,68 +1,60 @@
-import pubchempy as pcp
 import os
-import multiprocessing
-from rdkit import Chem
-from rdkit.Chem import AllChem
 from openbabel import pybel
 import logging
+from config.CompoundCache import CompoundCache
+from config.ConformerPool import ConformerPool
+from config.LigandStore import LigandStore, link_or_copy, parent_smiles
 
 class CompoundConverter:
-    def __init__(self, output_dir='./lig_pdbqt'):
+    def __init__(self, output_dir='./lig_pdbqt', compound_cache=None, conformer_pool=None, ligand_store=None):
         self.output_dir = output_dir
+        self.compound_cache = compound_cache or CompoundCache()
+        self.conformer_pool = conformer_pool or ConformerPool()
+        self.ligand_store = ligand_store or LigandStore()
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         logging.basicConfig(filename='conversion_errors.log', level=logging.ERROR)
 
     def get_smiles(self, name):
-        try:
-            compound = pcp.get_compounds(name, 'name')
-            return compound[0].isomeric_smiles if compound else 'Not Found'
-        except Exception as e:
-            logging.error(f"Error processing {name}: {e}")
-            return 'Error'
-
-    def smiles_to_3D_worker(self, smiles, output_path):
-        try:
-            mol = Chem.MolFromSmiles(smiles)
-            mol = Chem.AddHs(mol)
-            AllChem.EmbedMolecule(mol, AllChem.ETKDG())
-            AllChem.UFFOptimizeMolecule(mol)
-            mol_block = Chem.MolToMolBlock(mol)
-            ob_conversion = pybel.ob.OBConversion()
-            ob_conversion.SetInAndOutFormats("sdf", "pdbqt")
-            ob_mol = pybel.readstring("sdf", mol_block)
-            ob_mol.addh()
-            ob_mol.make3D(forcefield="mmff94", steps=50)  # Adjust forcefield and steps to avoid crashes
-            ob_conversion.WriteFile(ob_mol.OBMol, output_path)
-            return True
-        except Exception as e:
-            logging.error(f"Error converting SMILES to PDBQT: {e}")
-            return False
+        return self.compound_cache.resolve([name])[name]
 
     def smiles_to_3D(self, smiles, output_path):
-        try:
-            process = multiprocessing.Process(target=self.smiles_to_3D_worker, args=(smiles, output_path))
-            process.start()
-            process.join()
-            if process.exitcode != 0:
-                raise RuntimeError("Subprocess ended with a non-zero exit code")
-                return False
-            return True
-        except Exception as e:
-            logging.error(f"Error converting SMILES to PDBQT in subprocess: {e}")
-            return False
+        success, error = self.conformer_pool.run([(smiles, output_path)])[0]
+        return success
+
     def process(self, compound_name):
-        if '/' in compound_name:
-            compound_name = compound_name.replace('/', '_')
-        smiles = self.get_smiles(compound_name)
-        if smiles == 'Not Found' or smiles == 'Error':
-            print(f"SMILES not found for {compound_name}")
-            return
-        output_path = os.path.join(self.output_dir, f"{compound_name}.pdbqt")
-        sign=True
-        if not os.path.exists(output_path):
-            sign=self.smiles_to_3D(smiles, output_path)
-        return sign
+        return self.process_many([compound_name])[compound_name]
+
+    def process_many(self, compound_names):
+        # Prepare a whole candidate list in one round of parallel conformer work.
+        # Ligands are built once per canonical structure in the ligand store and
+        # exposed under every drug name as data/drug_pdbqt/<name>.pdbqt
+        names = [name.replace('/', '_') for name in compound_names]
+        smiles = self.compound_cache.resolve(names)
+        signs, jobs, pending = {}, {}, []
+        for original, name in zip(compound_names, names):
+            output_path = os.path.join(self.output_dir, f"{name}.pdbqt")
+            if smiles[name] in ('Not Found', 'Error'):
+                print(f"SMILES not found for {name}")
+                signs[original] = None
+                continue
+            key = self.ligand_store.register(name, smiles[name])
+            if os.path.exists(output_path):
+                signs[original] = True
+                continue
+            store_path = self.ligand_store.ligand_path(key)
+            if not os.path.exists(store_path):
+                # The conformer is built for the parent compound, without counter-ions
+                jobs.setdefault(key, (parent_smiles(smiles[name]), store_path))
+            pending.append((original, key, store_path, output_path))
+        keys = list(jobs)
+        built = dict(zip(keys, self.conformer_pool.run([jobs[key] for key in keys])))
+        for original, key, store_path, output_path in pending:
+            success = built[key][0] if key in built else True
+            if success:
+                link_or_copy(store_path, output_path)
+            signs[original] = success
+        return signs
 
     def pdb_to_pdbqt(self, pdb_path):
         try:
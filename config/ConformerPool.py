@@ -0,0 +1,118 @@
+import os
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from rdkit import Chem
+from rdkit.Chem import AllChem
+from openbabel import pybel
+
+
+def smiles_to_pdbqt(smiles, output_path):
+    """Embed, optimise and write one ligand. Returns (success, error message)."""
+    try:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            return False, f"RDKit could not parse SMILES {smiles}"
+        mol = Chem.AddHs(mol)
+        if AllChem.EmbedMolecule(mol, AllChem.ETKDG()) != 0:
+            return False, f"RDKit could not embed {smiles}"
+        AllChem.UFFOptimizeMolecule(mol)
+        mol_block = Chem.MolToMolBlock(mol)
+        ob_conversion = pybel.ob.OBConversion()
+        ob_conversion.SetInAndOutFormats("sdf", "pdbqt")
+        ob_mol = pybel.readstring("sdf", mol_block)
+        ob_mol.addh()
+        ob_mol.make3D(forcefield="mmff94", steps=50)  # Adjust forcefield and steps to avoid crashes
+        # Write next to the target and rename, so a crash never leaves a truncated ligand behind
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        fd, temp_path = tempfile.mkstemp(suffix='.pdbqt', dir=output_dir)
+        os.close(fd)
+        try:
+            if not ob_conversion.WriteFile(ob_mol.OBMol, temp_path):
+                return False, f"OpenBabel could not write {output_path}"
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+
+class ConformerPool:
+    """Long-lived worker processes that turn SMILES into ligand PDBQT files.
+
+    Workers keep RDKit and OpenBabel loaded between molecules. A molecule that
+    crashes its worker (RDKit/OpenBabel can segfault) breaks the pool; the pool
+    is then recycled and the unfinished molecules are retried one per process,
+    so only the offending molecule is reported as failed. Workers are spawned,
+    not forked, since the pool is used from the pipeline's stage threads, and
+    several threads may share one pool.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context)
+            return self.executor
+
+    def recycle(self, executor):
+        # Only the broken executor is replaced; another thread may already have recycled it
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_isolated(self, job):
+        with ProcessPoolExecutor(max_workers=1, mp_context=self.context) as executor:
+            try:
+                return executor.submit(smiles_to_pdbqt, *job).result()
+            except BrokenProcessPool:
+                return False, "worker crashed"
+
+    def run(self, jobs):
+        """Convert [(smiles, output_path), ...]; returns [(success, error), ...] in the same order."""
+        results = [None] * len(jobs)
+        if not jobs:
+            return results
+        executor = self.get_executor()
+        futures, crashed = {}, []
+        for index in range(len(jobs)):
+            try:
+                futures[executor.submit(smiles_to_pdbqt, *jobs[index])] = index
+            except (BrokenProcessPool, RuntimeError):
+                # Broken by another molecule, or shut down by another thread's recycle
+                crashed.append(index)
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except (BrokenProcessPool, CancelledError):
+                # Cancelled when another thread recycled the shared executor
+                crashed.append(index)
+            except Exception as e:
+                results[index] = (False, str(e))
+        if crashed:
+            self.recycle(executor)
+            for index in sorted(crashed):
+                results[index] = self.run_isolated(jobs[index])
+        for (smiles, _), (success, error) in zip(jobs, results):
+            if not success:
+                logging.error(f"Error converting SMILES {smiles} to PDBQT: {error}")
+        return results
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+            self.executor = None
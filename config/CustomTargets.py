@@ -0,0 +1,351 @@
+import os
+import csv
+import glob
+import hashlib
+import yaml  # PyYAML library for handling YAML files
+from Bio.PDB import PDBParser, is_aa, Polypeptide, PDBIO
+from config.AtomicFile import atomic_write
+from config.RCSBFetcher import get_fetcher
+from config.StructureSource import get_structure_source, offline_mode
+from config.MetadataIndex import SUMMARY_FIELDS, get_metadata_index
+from config.SequenceIndex import get_sequence_index
+from config.CompoundConverter import CompoundConverter
+from config.PDBConverter import PDBConverter
+from config.PDBQTCombiner import PDBQTCombiner
+from config.Docking import Docking
+from config.Pipeline import Stage
+from config.PipelineStages import Target, download_files, build_pipeline
+
+CONFIG_SUFFIXES = ('.yaml', '.yml', '.config')
+FASTA_SUFFIXES = ('.fasta', '.fa', '.faa')
+# Same threshold as the RCSB search; the coverage stands in for its e-value cutoff
+IDENTITY_CUTOFF = 0.9
+MIN_COVERAGE = 0.5
+# Residues that are not treated as a co-crystal ligand
+IONS_METALS = {'NA', 'K', 'MG', 'CA', 'ZN', 'FE', 'MN', 'CU', 'CO', 'NI', 'CL', 'SO4', 'PO4', 'IOD', 'BR', 'F', 'I'}
+
+
+# Function to load YAML configuration file
+def load_config(config_file):
+    with open(config_file, 'r') as file:
+        return yaml.safe_load(file)
+
+
+# Function to extract amino acid sequences from PDB file
+def get_amino_acid_sequence(pdb_path):
+    """
+    Extract amino acid sequences from a PDB file (represented in one-letter code).
+    Filters out small molecules, water, and ions.
+    """
+    parser = PDBParser(QUIET=True)
+    structure = parser.get_structure('PDB_structure', pdb_path)
+    sequences = []
+
+    for model in structure:
+        for chain in model:
+            ppb = Polypeptide.PPBuilder()
+            for poly_index in ppb.build_peptides(chain):
+                sequence = poly_index.get_sequence()
+                if sequence:
+                    sequences.append(str(sequence))
+
+    return sequences
+
+
+# Function to search for the best matching PDB structure using a protein sequence
+def search_pdb(sequence):
+    # The local index (python -m config.SequenceIndex) answers in milliseconds and without network
+    index = get_sequence_index()
+    if index is not None:
+        hits = index.search(sequence, top_k=1, identity_cutoff=IDENTITY_CUTOFF, min_coverage=MIN_COVERAGE)
+        return hits[0]['pdb_id'] if hits else None
+    if offline_mode():
+        print("No local sequence index; build one with python -m config.SequenceIndex")
+        return None
+    fetcher = get_fetcher()
+    url = f"{fetcher.search_url}/rcsbsearch/v2/query?json="
+    query = {
+        "query": {
+            "type": "terminal",
+            "service": "sequence",
+            "parameters": {
+                "evalue_cutoff": 1,
+                "identity_cutoff": IDENTITY_CUTOFF,
+                "target": "pdb_protein_sequence",
+                "value": sequence
+            }
+        },
+        "request_options": {
+            "scoring_strategy": "sequence"
+        },
+        "return_type": "entry"
+    }
+
+    response = fetcher.post(url, json=query)
+
+    if response is not None and response.status_code == 200:
+        data = response.json()
+        if "result_set" in data and data["result_set"]:
+            return data["result_set"][0]["identifier"]
+        return None
+    print(f"Error: {response.status_code if response is not None else 'no response'}")
+    return None
+
+
+# Find the best matching PDB structure from the PDB file
+def find_best_pdb_structure(pdb_path):
+    """
+    Extract the amino acid sequence from the PDB file and find the most similar PDB structure by sequence.
+    Returns (PDB ID or None, the sequence searched for).
+    """
+    sequences = get_amino_acid_sequence(pdb_path)
+
+    if not sequences:
+        print("No amino acid sequences found.")
+        return None, None
+    sequence = sequences[0]
+    best_pdb = search_pdb(sequence)
+
+    if best_pdb:
+        print(f"The most similar PDB structure is: {best_pdb}")
+    else:
+        print("No similar PDB structure found.")
+
+    return best_pdb, sequence
+
+
+# Extract ligands from PDB and optionally split into individual files
+def get_ligand_from_pdb(pdb, output_dir, split=True):
+    """``pdb`` is a file path or a PDB ID read through the structure sources.
+
+    Returns the path of the first ligand written to ``output_dir`` (split),
+    whether the structure has a ligand at all (not split), or False.
+    """
+    parser = PDBParser(QUIET=True)
+    handle = open(pdb, 'r') if os.path.exists(pdb) else get_structure_source().open(pdb)
+    if handle is None:
+        return False
+    with handle:
+        structure = parser.get_structure('PDB_structure', handle)
+
+    for model in structure:
+        for chain in model:
+            for residue in chain:
+                # Exclude standard amino acids, water, ions, and metals
+                if not is_aa(residue, standard=True) and residue.id[0] != 'W' and residue.resname not in IONS_METALS:
+                    if split:
+                        return save_ligand_as_pdb(residue, output_dir)
+                    return True
+    return False
+
+
+# Function to save ligand structure as a PDB file
+def save_ligand_as_pdb(ligand, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    io = PDBIO()
+    io.set_structure(ligand)
+    ligand_name = f"{ligand.resname}_{ligand.id[1]}_{ligand.get_parent().id}.pdb"
+    io.save(f"{output_dir}/{ligand_name}")
+    return f"{output_dir}/{ligand_name}"
+
+
+def summary_text(summary_info, name=None):
+    # Same "Key: value" lines as the summaries of indexed PDB entries
+    summary = {'PDB ID': name} if name and 'PDB ID' not in summary_info else {}
+    summary.update(summary_info)
+    ordered = [key for key in SUMMARY_FIELDS if key in summary] + [key for key in summary if key not in SUMMARY_FIELDS]
+    return ''.join(f'{key}: {summary[key]}\n' for key in ordered)
+
+
+class CustomTarget(Target):
+    """A target from custom data: an uploaded structure or a query sequence.
+
+    ``manual_upload`` docks into the uploaded file; ``sequence_search``
+    uses the most similar PDB entry. ``summary_info`` (when the config sets
+    ``use_summary``) replaces the summary of the similar entry in the prompt.
+    """
+
+    def __init__(self, name, mode, pdb_file_path=None, query_sequence=None, summary_info=None, **kwargs):
+        super().__init__(name, **kwargs)
+        if mode not in ('manual_upload', 'sequence_search'):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.mode = mode
+        self.query_sequence = query_sequence
+        self.similar_pdb = None
+        if mode == 'manual_upload':
+            self.pdb_path = pdb_file_path
+        if summary_info:
+            self.summary = summary_text(summary_info, name)
+
+
+def target_from_config(config, name=None, pdb_file_path=None):
+    """One CustomTarget from a config.yaml-style mapping."""
+    mode = config['mode']
+    settings = config.get(mode) or {}
+    summary_info = settings.get('summary_info') if settings.get('use_summary') else None
+    if mode == 'manual_upload':
+        pdb_file_path = pdb_file_path or settings['pdb_file_path']
+        name = name or config.get('name') or os.path.splitext(os.path.basename(pdb_file_path))[0]
+        return CustomTarget(name, mode, pdb_file_path=pdb_file_path, summary_info=summary_info)
+    sequence = ''.join(settings['query_sequence'].split()).upper()
+    name = name or config.get('name') or 'seq_' + hashlib.sha1(sequence.encode('utf-8')).hexdigest()[:8]
+    return CustomTarget(name, mode, query_sequence=sequence, summary_info=summary_info)
+
+
+def read_fasta_records(path):
+    records, header = [], None
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('>'):
+                header = line[1:].split()[0] if line[1:].strip() else f'seq{len(records) + 1}'
+                records.append([header, ''])
+            elif line and records:
+                records[-1][1] += line
+    return [(name, sequence) for name, sequence in records if sequence]
+
+
+def load_targets(path):
+    """All custom targets under ``path``.
+
+    ``path`` may be a config file (``mode: ...``), a YAML manifest with a
+    ``targets:`` list of such configs, a CSV manifest (columns ``mode``,
+    ``input`` - PDB path or sequence - and optionally ``name`` and the
+    summary fields), or a folder holding any of these plus uploaded
+    ``.pdb`` files and ``.fasta`` query sequences.
+    """
+    targets = []
+    if os.path.isdir(path):
+        for entry in sorted(glob.glob(os.path.join(path, '*'))):
+            suffix = os.path.splitext(entry)[1].lower()
+            if suffix in CONFIG_SUFFIXES + ('.csv',):
+                targets += load_targets(entry)
+            elif suffix == '.pdb':
+                targets.append(CustomTarget(os.path.splitext(os.path.basename(entry))[0], 'manual_upload',
+                                            pdb_file_path=entry))
+            elif suffix in FASTA_SUFFIXES:
+                targets += [target_from_config({'mode': 'sequence_search', 'sequence_search': {'query_sequence': sequence}},
+                                               name=name) for name, sequence in read_fasta_records(entry)]
+    elif path.lower().endswith('.csv'):
+        with open(path, 'r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                summary_info = {key: row[key] for key in SUMMARY_FIELDS if row.get(key)}
+                settings = {'use_summary': bool(summary_info), 'summary_info': summary_info}
+                if row['mode'] == 'manual_upload':
+                    settings['pdb_file_path'] = row['input']
+                else:
+                    settings['query_sequence'] = row['input']
+                targets.append(target_from_config({'mode': row['mode'], row['mode']: settings}, name=row.get('name') or None))
+    else:
+        config = load_config(path)
+        if not config:
+            print(f"Empty config file: {path}")
+        else:
+            for entry in config.get('targets', [config]) if isinstance(config, dict) else config:
+                targets.append(target_from_config(entry))
+    # Targets share output files by name, so repeated names get a suffix
+    seen = {}
+    for target in targets:
+        count = seen.get(target.pdb_id, 0)
+        seen[target.pdb_id] = count + 1
+        if count:
+            target.pdb_id = f'{target.pdb_id}_{count + 1}'
+            target.fasta_path = f'./data/fasta/{target.pdb_id}.fasta'
+            if target.mode == 'sequence_search':
+                target.pdb_path = f'./data/pdb/{target.pdb_id}.pdb'
+    return targets
+
+
+def resolve_similar(targets):
+    """Look up the most similar PDB entry of all targets in one batch on the local sequence index.
+
+    Without an index nothing is done, and ``stage_prepare`` searches per target.
+    """
+    index = get_sequence_index()
+    if index is None:
+        return
+    queries = {}
+    for target in targets:
+        # Uploads with their own summary need the similar entry only if they have no ligand, found out later
+        if target.similar_pdb is None and (target.mode == 'sequence_search' or target.summary is None):
+            sequence = target.query_sequence
+            if sequence is None and os.path.exists(target.pdb_path):
+                sequence = next(iter(get_amino_acid_sequence(target.pdb_path)), None)
+            if sequence:
+                queries[target.pdb_id] = sequence
+    hits = index.search_many(queries.values(), top_k=1, identity_cutoff=IDENTITY_CUTOFF, min_coverage=MIN_COVERAGE)
+    for target in targets:
+        if hits.get(queries.get(target.pdb_id)):
+            target.similar_pdb = hits[queries[target.pdb_id]][0]['pdb_id']
+
+
+def dock_reference_ligand(target):
+    """Give an uploaded structure without ligand a pocket: dock the ligand of the most similar entry into it.
+
+    The complex is written to data/complex/ and analysed by PLIP instead of the upload.
+    """
+    similar_pdb = target.similar_pdb or find_best_pdb_structure(target.pdb_path)[0]
+    if similar_pdb is None:
+        return
+    download_files(similar_pdb)
+    lig_path = get_ligand_from_pdb(similar_pdb, './data/temp/', split=True)
+    if not lig_path:
+        return
+    lig_path = CompoundConverter(output_dir='./data/drug_pdbqt').pdb_to_pdbqt(lig_path)
+    if not lig_path:
+        return
+    rec_path = PDBConverter(pdb_path=target.pdb_path, pdbqt_path=f'./data/rec_pdbqt/{target.pdb_id}.pdbqt').convert_pdb_to_pdbqt()
+    drug_name = os.path.splitext(os.path.basename(lig_path))[0]
+    score = Docking(protein=target.pdb_id, drug=drug_name, exhaustiveness=8).execute_docking()
+    print(f'score: {score}')
+    if score is not None and float(score) < 0:
+        complex_path = f'./data/complex/{target.pdb_id}.pdb'
+        os.makedirs(os.path.dirname(complex_path), exist_ok=True)
+        PDBQTCombiner(rec_path, f'./data/dock_result/{target.pdb_id}_{drug_name}.pdbqt').combine_pdbqt(complex_path)
+        target.interaction_path = complex_path
+
+
+def stage_prepare(target):
+    """Custom targets' stand-in for the download and summary stages: structure, FASTA and summary."""
+    if target.mode == 'sequence_search':
+        print(f"Using sequence search for: {target.query_sequence}")
+        target.similar_pdb = target.similar_pdb or search_pdb(target.query_sequence)
+        if target.similar_pdb is None:
+            raise RuntimeError(f"No PDB entry matches the query sequence of {target.pdb_id}")
+        target.pdb_path, _ = download_files(target.similar_pdb)
+        sequences = [target.query_sequence]
+    else:
+        print(f"Using manually uploaded PDB file: {target.pdb_path}")
+        if not os.path.exists(target.pdb_path):
+            raise RuntimeError(f"Uploaded PDB file {target.pdb_path} does not exist")
+        sequences = get_amino_acid_sequence(target.pdb_path)
+    with atomic_write(target.fasta_path) as file:
+        file.write(''.join(f'>{target.pdb_id}_{index}\n{sequence}\n' for index, sequence in enumerate(sequences, 1)))
+
+    if target.summary is None:
+        # No summary from the user: use the one of the most similar PDB entry
+        if target.similar_pdb is None:
+            target.similar_pdb, _ = find_best_pdb_structure(target.pdb_path)
+        if target.similar_pdb is not None:
+            metadata_index = get_metadata_index()
+            metadata_index.fetch([target.similar_pdb])
+            target.summary = metadata_index.summary_text(target.similar_pdb)
+
+    if target.mode == 'manual_upload' and not get_ligand_from_pdb(target.pdb_path, './data/temp/', split=False):
+        dock_reference_ligand(target)
+    return target
+
+
+def build_custom_pipeline(llm_stage, workers=None, **kwargs):
+    """The DrugReAlign stage chain with ``prepare`` in place of download and summary."""
+    pipeline = build_pipeline(llm_stage, workers=workers, **kwargs)
+    prepare = Stage('prepare', stage_prepare, 'network', (workers or {}).get('prepare'))
+    prepare.outputs = lambda t: [t.pdb_path, t.fasta_path] + ([t.interaction_path] if t.interaction_path else [])
+    pipeline.stages = [prepare] + [stage for stage in pipeline.stages if stage.name not in ('download', 'summary')]
+    return pipeline
+
+
+# Example: list the targets of the shipped batch folder
+if __name__ == '__main__':
+    for target in load_targets('./batch_input/DrugReAlign-Custom Data'):
+        print(target.pdb_id, target.mode, target.pdb_path if target.mode == 'manual_upload' else target.query_sequence)
@@ -1,6 +1,20 @@
 import numpy as np
 import os
+import glob
+import shutil
+import hashlib
+import tempfile
+import uuid
 from vina import Vina
+from config.LigandStore import LigandStore, link_or_copy
+
+# Residues that never define a binding pocket: waters, common ions and crystallisation additives
+NON_POCKET_HET = {'HOH', 'WAT', 'DOD', 'NA', 'K', 'MG', 'CA', 'ZN', 'FE', 'MN', 'CU', 'CO', 'NI', 'CL',
+                  'SO4', 'PO4', 'IOD', 'BR', 'F', 'I', 'GOL', 'EDO', 'PEG', 'ACT', 'DMS', 'FMT'}
+# Modified polymer residues written as HETATM, for files without SEQRES/MODRES records
+MODIFIED_RESIDUES = {'MSE', 'SEP', 'TPO', 'PTR', 'KCX', 'CSO', 'CSD', 'CME', 'MLY', 'M3L', 'HYP', 'LLP', 'PCA',
+                     'OCS', 'CSS', 'SCH', 'ALY', 'NEP', 'HIC', 'TYS', 'CGU', 'MLZ', 'FME'}
+
 def extract_first_energy_from_file(file_path):
     with open(file_path, 'r') as file:
         for line in file:
@@ -9,6 +23,14 @@ def extract_first_energy_from_file(file_path):
                 energy = float(line.split()[3])
                 return energy
     return None
+
+def file_sha1(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
 class Docking:
     def __init__(self, protein, drug, exhaustiveness=64):
         self.protein = protein
@@ -18,7 +40,8 @@ class Docking:
         self.protein_path = f'./data/rec_pdbqt/{self.protein}.pdbqt'
         self.output_path = f'./data/dock_result/{self.protein}_{self.drug}.pdbqt'
 
-    def calculate_docking_box(self, receptor_pdb_path):
+    @staticmethod
+    def calculate_docking_box(receptor_pdb_path):
         with open(receptor_pdb_path, 'r') as file:
             lines = file.readlines()
 
@@ -39,6 +62,76 @@ class Docking:
 
         return center, size
 
+    @staticmethod
+    def padded_box(coords, padding=8.0, min_size=20.0):
+        coords = np.asarray(coords, dtype=float)
+        min_coords = coords.min(axis=0)
+        max_coords = coords.max(axis=0)
+        center = (min_coords + max_coords) / 2
+        size = np.maximum(max_coords - min_coords + 2 * padding, min_size)
+        return center, size
+
+    @staticmethod
+    def calculate_ligand_boxes(pdb_path, padding=8.0, min_size=20.0):
+        # One box per co-crystal ligand, largest ligand first. Only the first model is read, and
+        # HETATM residues of the polymer (SEQRES/MODRES, e.g. selenomethionine) are not ligands
+        ligands, polymer = {}, set(MODIFIED_RESIDUES)
+        with open(pdb_path, 'r') as file:
+            for line in file:
+                if line.startswith('SEQRES'):
+                    polymer.update(line[19:].split())
+                    continue
+                if line.startswith('MODRES'):
+                    polymer.add(line[12:15].strip())
+                    continue
+                if line.startswith('ENDMDL'):
+                    break
+                if not line.startswith('HETATM'):
+                    continue
+                resname = line[17:20].strip()
+                if resname in NON_POCKET_HET or resname in polymer:
+                    continue
+                key = (resname, line[21], line[22:26].strip())
+                ligands.setdefault(key, []).append(
+                    (float(line[30:38]), float(line[38:46]), float(line[46:54])))
+        ranked = sorted(ligands.values(), key=len, reverse=True)
+        return [Docking.padded_box(coords, padding, min_size) for coords in ranked]
+
+    @staticmethod
+    def calculate_plip_boxes(pdb_path, padding=8.0, min_size=20.0):
+        # One box per PLIP binding site, the site with the most interactions first
+        from config.PDBInteractionExtractor import PDBInteractionExtractor
+        extractor = PDBInteractionExtractor(pdb_path=pdb_path, spatial_information_folder='./data/spatial_information/')
+        sites = extractor.retrieve_plip_interactions()
+        ranked = []
+        for interactions in sites.values():
+            coords = []
+            for rows in interactions.values():
+                features = list(rows[0])
+                for row in rows[1:]:
+                    for column in ('LIGCOO', 'PROTCOO'):
+                        if column in features:
+                            coords.append(row[features.index(column)])
+            if coords:
+                ranked.append(coords)
+        ranked.sort(key=len, reverse=True)
+        return [Docking.padded_box(coords, padding, min_size) for coords in ranked]
+
+    @staticmethod
+    def pocket_boxes(receptor_path, pdb_path=None, box_mode='protein', top_n=1, padding=8.0):
+        if box_mode not in ('protein', 'ligand', 'plip'):
+            raise ValueError(f"Unknown box mode: {box_mode}")
+        boxes = []
+        has_source = pdb_path is not None and os.path.exists(pdb_path)
+        if box_mode == 'plip' and has_source:
+            boxes = Docking.calculate_plip_boxes(pdb_path, padding)
+        if box_mode != 'protein' and not boxes and has_source:
+            boxes = Docking.calculate_ligand_boxes(pdb_path, padding)
+        if not boxes:
+            # Nothing to centre on, fall back to the whole receptor
+            boxes = [Docking.calculate_docking_box(receptor_path)]
+        return boxes[:max(1, top_n)]
+
     def run_dock(self, center, size):
         v = Vina()
         v.set_receptor(rigid_pdbqt_filename=self.protein_path)
@@ -63,3 +156,140 @@ class Docking:
             score=extract_first_energy_from_file(self.output_path)
             return score
 
+
+class DockingSession:
+    """Dock many ligands against one receptor, computing the Vina maps only once.
+
+    Maps are written under ``map_root`` keyed by the receptor file hash and the
+    box, so later runs and batch jobs on the same target load them from disk.
+    ``box_mode`` selects the search box: ``protein`` spans the whole receptor,
+    ``ligand`` centres on the co-crystal ligands and ``plip`` on the PLIP
+    binding sites of ``pdb_path``. With ``top_n`` > 1 every ligand is docked
+    into that many pockets and the best pose is kept. Poses are cached in the
+    ligand store by receptor, ligand structure, box and exhaustiveness, so
+    synonyms of one drug are docked only once.
+    """
+
+    def __init__(self, protein, exhaustiveness=64, center=None, size=None, spacing=0.375,
+                 map_root='./data/vina_maps', cpu=0, box_mode='protein', top_n=1,
+                 padding=8.0, pdb_path=None, boxes=None, ligand_store=None):
+        self.protein = protein
+        self.exhaustiveness = exhaustiveness
+        self.spacing = spacing
+        self.map_root = map_root
+        self.cpu = cpu
+        self.protein_path = f'./data/rec_pdbqt/{self.protein}.pdbqt'
+        self.ligand_store = ligand_store
+        self.receptor_hash = None
+        self.vinas = {}
+        if boxes is not None:
+            # Boxes handed over by a parent session, already reported there
+            self.boxes = boxes
+            return
+        if center is not None and size is not None:
+            boxes = [(center, size)]
+        else:
+            pdb_path = pdb_path or f'./data/pdb/{self.protein}.pdb'
+            boxes = Docking.pocket_boxes(self.protein_path, pdb_path, box_mode, top_n, padding)
+        self.boxes = [([float(c) for c in center], [float(s) for s in size]) for center, size in boxes]
+        for center, size in self.boxes:
+            print(f"Docking box for {self.protein} ({box_mode}): center {np.round(center, 2).tolist()}, "
+                  f"size {np.round(size, 2).tolist()}, volume {np.prod(size):.0f} A^3")
+
+    def map_prefix(self, index=0):
+        center, size = self.boxes[index]
+        box = ','.join(f'{v:.3f}' for v in center + size + [self.spacing])
+        box_key = hashlib.sha1(box.encode()).hexdigest()[:12]
+        receptor_key = self.receptor_key()[:16]
+        return os.path.join(self.map_root, f'{receptor_key}_{box_key}', 'receptor')
+
+    def receptor_key(self):
+        if self.receptor_hash is None:
+            self.receptor_hash = file_sha1(self.protein_path)
+        return self.receptor_hash
+
+    def result_cache_path(self, drug, drug_path):
+        # Poses are shared by every synonym of the ligand, keyed on its canonical structure
+        if self.ligand_store is None:
+            self.ligand_store = LigandStore()
+        ligand = self.ligand_store.key_for(drug) or file_sha1(drug_path)
+        docking_key = LigandStore.docking_key(self.receptor_key(), ligand, self.boxes, self.exhaustiveness)
+        return self.ligand_store.docking_path(docking_key)
+
+    def prepare(self, index=0):
+        if index in self.vinas:
+            return self.vinas[index]
+        center, size = self.boxes[index]
+        v = Vina(cpu=self.cpu)
+        prefix = self.map_prefix(index)
+        if glob.glob(f'{prefix}.*.map'):
+            v.load_maps(prefix)
+        else:
+            # No ligand is set yet, so Vina computes maps for every atom type
+            v.set_receptor(rigid_pdbqt_filename=self.protein_path)
+            v.compute_vina_maps(center=center, box_size=size, spacing=self.spacing)
+            self.write_maps(v, prefix)
+        self.vinas[index] = v
+        return v
+
+    def write_maps(self, v, prefix):
+        # Write into a scratch directory and rename it so readers never see half a map set
+        map_dir = os.path.dirname(prefix)
+        os.makedirs(self.map_root, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=self.map_root)
+        try:
+            v.write_maps(map_prefix_filename=os.path.join(temp_dir, 'receptor'))
+            os.rename(temp_dir, map_dir)
+        except OSError:
+            # Another job published the same maps first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def dock(self, drug):
+        output_path = f'./data/dock_result/{self.protein}_{drug}.pdbqt'
+        if os.path.exists(output_path):
+            return extract_first_energy_from_file(output_path)
+        drug_path = f'./data/drug_pdbqt/{drug}.pdbqt'
+        if not os.path.exists(drug_path):
+            return None
+        temp_path = None
+        try:
+            cache_path = self.result_cache_path(drug, drug_path)
+            if os.path.exists(cache_path):
+                link_or_copy(cache_path, output_path)
+                return extract_first_energy_from_file(output_path)
+            temp_path = f'{cache_path}.{uuid.uuid4().hex}.tmp'
+            best_score, best_index = None, None
+            for index in range(len(self.boxes)):
+                v = self.prepare(index)
+                v.set_ligand_from_file(drug_path)
+                v.dock(exhaustiveness=self.exhaustiveness)
+                score = v.energies()[0][0]
+                if best_score is None or score < best_score:
+                    best_score, best_index = score, index
+                    v.write_poses(pdbqt_filename=temp_path, overwrite=True)
+            os.replace(temp_path, cache_path)
+            link_or_copy(cache_path, output_path)
+            if len(self.boxes) > 1:
+                print(f"Best pocket for {self.protein}_{drug}: #{best_index + 1} ({best_score} kcal/mol)")
+            return best_score
+        except Exception as e:
+            # Raised, not returned as a score: a failed dock must never be stored as an affinity
+            print(f"Error during docking: {e}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def prepare_all(self):
+        # Make sure every pocket has maps on disk before workers start loading them
+        for index in range(len(self.boxes)):
+            self.prepare(index)
+
+    def dock_many(self, drugs):
+        """{drug: score}; None where the ligand is missing or docking failed."""
+        scores = {}
+        for drug in drugs:
+            try:
+                scores[drug] = self.dock(drug)
+            except Exception:
+                scores[drug] = None
+        return scores
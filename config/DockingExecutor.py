@@ -0,0 +1,110 @@
+import os
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from config.Docking import DockingSession
+from config.LigandStore import LigandStore
+from config.Tracer import count
+
+
+def cpu_budget_from_env(default=None):
+    # batch_process.py hands each target its share of the machine through this variable
+    budget = os.environ.get('DRUGREALIGN_CPU_BUDGET')
+    if budget:
+        return max(1, int(budget))
+    return default or os.cpu_count() or 1
+
+
+def _dock_worker(conn, protein, drug, boxes, exhaustiveness, cpu, spacing, map_root, store_paths):
+    try:
+        # Same maps and ligand store as the parent session, reopened in this process
+        ligand_store = LigandStore(*store_paths) if store_paths is not None else None
+        session = DockingSession(protein=protein, exhaustiveness=exhaustiveness, cpu=cpu, boxes=boxes,
+                                 spacing=spacing, map_root=map_root, ligand_store=ligand_store)
+        score = session.dock(drug)
+        conn.send({'drug': drug, 'score': score, 'status': 'ok' if score is not None else 'missing', 'error': None,
+                   'cpu': time.process_time()})
+    except Exception as e:
+        conn.send({'drug': drug, 'score': None, 'status': 'failed', 'error': str(e), 'cpu': time.process_time()})
+    finally:
+        conn.close()
+
+
+class DockingExecutor:
+    """Dock (receptor, ligand) jobs in parallel worker processes under a global core budget.
+
+    The budget is split between the number of concurrent jobs and Vina's own
+    ``cpu`` setting. Vina only uses as many threads as the exhaustiveness, so
+    spare cores go to more concurrent jobs instead. Every job runs in its own
+    process with a deadline; a job that overruns is terminated and reported as
+    ``timeout`` without holding up the others.
+    """
+
+    def __init__(self, cpu_budget=None, cpu_per_job=None, timeout=None, poll_interval=0.5):
+        self.cpu_budget = cpu_budget or cpu_budget_from_env()
+        self.cpu_per_job = cpu_per_job
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def plan(self, n_jobs, exhaustiveness):
+        cpu_per_job = self.cpu_per_job or max(1, min(exhaustiveness, self.cpu_budget // max(1, n_jobs)))
+        workers = max(1, min(n_jobs, self.cpu_budget // cpu_per_job))
+        return workers, cpu_per_job
+
+    def run(self, session, drugs):
+        """Dock ``drugs`` against the receptor of ``session`` and return one result dict per drug, in order."""
+        if not drugs:
+            return []
+        # Compute the maps once in the parent so workers only load them from disk
+        session.prepare_all()
+        workers, cpu_per_job = self.plan(len(drugs), session.exhaustiveness)
+        store = session.ligand_store
+        store_paths = (store.root, store.db_path) if store is not None else None
+        # Spawned, not forked: the executor is called from the pipeline's stage threads
+        ctx = multiprocessing.get_context('spawn')
+
+        results = [None] * len(drugs)
+        pending = list(enumerate(drugs))
+        running = {}
+        while pending or running:
+            while pending and len(running) < workers:
+                index, drug = pending.pop(0)
+                recv_conn, send_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_dock_worker,
+                                      args=(send_conn, session.protein, drug, session.boxes,
+                                            session.exhaustiveness, cpu_per_job, session.spacing,
+                                            session.map_root, store_paths),
+                                      daemon=True)
+                process.start()
+                send_conn.close()
+                running[recv_conn] = (index, drug, process, time.monotonic())
+
+            for conn in wait(list(running), timeout=self.poll_interval):
+                index, drug, process, started = running.pop(conn)
+                try:
+                    result = conn.recv()
+                except EOFError:
+                    # The worker died without reporting, e.g. a crash inside Vina
+                    result = {'drug': drug, 'score': None, 'status': 'failed',
+                              'error': 'worker exited unexpectedly'}
+                conn.close()
+                process.join()
+                result['elapsed'] = time.monotonic() - started
+                results[index] = result
+                # CPU time of the worker process, Vina's threads included
+                count('child_cpu_s', result.get('cpu', 0.0))
+
+            if self.timeout:
+                now = time.monotonic()
+                for conn, (index, drug, process, started) in list(running.items()):
+                    if now - started > self.timeout:
+                        process.terminate()
+                        process.join()
+                        conn.close()
+                        del running[conn]
+                        results[index] = {'drug': drug, 'score': None, 'status': 'timeout',
+                                          'error': f'docking exceeded {self.timeout}s',
+                                          'elapsed': now - started}
+        for result in results:
+            count(f"dock_{result['status']}")
+        return results
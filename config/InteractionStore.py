@@ -0,0 +1,150 @@
+import os
+import re
+import uuid
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+INTERACTION_TYPES = ("hydrophobic", "hbond", "pistacking")
+
+# IDs stay strings; inferred hive partitioning would read an all-digit ID back as an integer
+PARTITIONING = ds.partitioning(pa.schema([('pdb_id', pa.string())]), flavor='hive')
+
+# Columns pasted into the prompt, per interaction type
+PROMPT_COLUMNS = {
+    'hydrophobic': ['RESTYPE', 'RESCHAIN', 'RESCHAIN_LIG', 'DIST', 'LIGCOO', 'PROTCOO'],
+    'hbond': ['RESTYPE', 'RESCHAIN', 'RESTYPE_LIG', 'PROTCOO', 'LIGCOO', 'DIST_H-A', 'DIST_D-A', 'DON_ANGLE', 'DONORTYPE', 'ACCEPTORTYPE'],
+    'pistacking': ['RESTYPE', 'RESCHAIN', 'RESTYPE_LIG', 'CENTDIST', 'ANGLE', 'OFFSET', 'PROTCOO', 'LIGCOO']
+}
+
+# PLIP reports these as '%.2f' strings; they are stored as numbers and formatted back for the prompt
+NUMERIC_COLUMNS = ('DIST', 'DIST_H-A', 'DIST_D-A', 'DON_ANGLE', 'CENTDIST', 'ANGLE', 'OFFSET')
+COORD_COLUMNS = ('LIGCOO', 'PROTCOO')
+
+
+def render_tables(tables, columns=None):
+    """Prompt text of {interaction type: DataFrame}; numbers as '%.2f', runs of spaces collapsed."""
+    columns = columns or PROMPT_COLUMNS
+    text = ''
+    for key in INTERACTION_TYPES:
+        df = tables.get(key)
+        if key not in columns or df is None or len(df) == 0:
+            continue
+        df = df[[column for column in columns[key] if column in df.columns]].copy()
+        for column in NUMERIC_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].map(lambda x: '%.2f' % x)
+        text += re.sub(r' +', ' ', f'"""{key}""":\n{df.to_string(index=False)}\n')
+    return text
+
+
+class InteractionStore:
+    """PLIP interaction tables as Parquet, one file per interaction type and target.
+
+    Layout: ``{root}/type={type}/pdb_id={id}/part.parquet`` (hive
+    partitioning), with a ``SITE`` column naming the binding site. The
+    prompt text is rendered from the tables on demand, and ``scan`` reads
+    one type across all targets as a single DataFrame for analytics.
+    """
+
+    def __init__(self, root='./data/interactions'):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, pdb_id, interaction_type):
+        return os.path.join(self.root, f'type={interaction_type}', f'pdb_id={pdb_id}', 'part.parquet')
+
+    def paths(self, pdb_id):
+        return [self.path(pdb_id, t) for t in INTERACTION_TYPES if os.path.exists(self.path(pdb_id, t))]
+
+    def has(self, pdb_id):
+        return os.path.exists(os.path.join(self.root, 'type=hydrophobic', f'pdb_id={pdb_id}'))
+
+    def write(self, pdb_id, tables):
+        """tables: {interaction type: DataFrame}. Types without rows leave an empty partition."""
+        for interaction_type in INTERACTION_TYPES:
+            path = self.path(pdb_id, interaction_type)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            df = tables.get(interaction_type)
+            if df is None or len(df) == 0:
+                # Nothing of this type: an empty partition, so the target still counts as processed
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            df = df.copy()
+            for column in NUMERIC_COLUMNS:
+                if column in df.columns:
+                    df[column] = pd.to_numeric(df[column], errors='coerce')
+            for column in COORD_COLUMNS:
+                if column in df.columns:
+                    df[column] = df[column].map(list)
+            # Hidden name, so dataset scans never pick up a half-written file
+            temp_path = os.path.join(os.path.dirname(path), f'.part.{uuid.uuid4().hex}.tmp')
+            try:
+                df.to_parquet(temp_path, index=False)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def read(self, pdb_id, interaction_type, columns=None):
+        path = self.path(pdb_id, interaction_type)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=columns or [])
+        df = pd.read_parquet(path, columns=columns)
+        for column in COORD_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].map(tuple)
+        return df
+
+    def render(self, pdb_id, columns=None):
+        """The interaction section of the prompt, as PDBInteractionExtractor used to write it."""
+        columns = columns or PROMPT_COLUMNS
+        return render_tables({key: self.read(pdb_id, key) for key in INTERACTION_TYPES if key in columns}, columns)
+
+    def delete(self, pdb_id):
+        for interaction_type in INTERACTION_TYPES:
+            shutil.rmtree(os.path.dirname(self.path(pdb_id, interaction_type)), ignore_errors=True)
+
+    def scan(self, interaction_type, columns=None, pdb_ids=None):
+        """One interaction type across targets, with a ``pdb_id`` column; coordinates stay as lists."""
+        base = os.path.join(self.root, f'type={interaction_type}')
+        dataset = ds.dataset(base, format='parquet', partitioning=PARTITIONING) if os.path.exists(base) else None
+        names = set(dataset.schema.names) if dataset is not None else set()
+        if 'pdb_id' not in names:
+            # No target has rows of this type yet
+            return pd.DataFrame(columns=(columns or []) + ['pdb_id'])
+        if columns is not None:
+            columns = [column for column in columns if column in names] + ['pdb_id']
+        filter = ds.field('pdb_id').isin([str(pdb_id) for pdb_id in pdb_ids]) if pdb_ids is not None else None
+        return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+    def recurring_residues(self, interaction_type=None, top=20):
+        """Residue types ranked by the number of targets whose pockets they contact."""
+        types = [interaction_type] if interaction_type else INTERACTION_TYPES
+        frames = [self.scan(t, columns=['RESTYPE', 'RESNR', 'RESCHAIN']) for t in types]
+        df = pd.concat(frames, ignore_index=True)
+        if len(df) == 0:
+            return pd.DataFrame(columns=['RESTYPE', 'targets', 'contacts'])
+        grouped = df.groupby('RESTYPE').agg(targets=('pdb_id', 'nunique'), contacts=('pdb_id', 'size'))
+        return grouped.sort_values(['targets', 'contacts'], ascending=False).head(top).reset_index()
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_interaction_store():
+    """The process-wide interaction store."""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = InteractionStore()
+        return _shared_store
+
+
+# Example: residue types that recur across all stored targets
+if __name__ == '__main__':
+    print(get_interaction_store().recurring_residues())
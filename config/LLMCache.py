@@ -0,0 +1,79 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class LLMCacheMiss(KeyError):
+    pass
+
+
+class LLMCache:
+    """Persistent LLM response cache keyed by (model, normalised prompt, sampling params).
+
+    Prompts are normalised by collapsing whitespace, so the newline flattening
+    in the main scripts does not change the key. Entries older than ``ttl``
+    seconds are ignored. In ``replay_only`` mode a miss raises LLMCacheMiss
+    instead of reaching the API, so reruns never spend tokens.
+    """
+
+    def __init__(self, db_path='./data/llm_cache.sqlite', ttl=None, replay_only=False):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.replay_only = replay_only
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                              'key TEXT PRIMARY KEY, model TEXT, prompt_hash TEXT, params TEXT, '
+                              'answer TEXT NOT NULL, created REAL NOT NULL)')
+
+    @staticmethod
+    def normalize_prompt(prompt):
+        return re.sub(r'\s+', ' ', prompt).strip()
+
+    @classmethod
+    def prompt_hash(cls, prompt):
+        return hashlib.sha256(cls.normalize_prompt(prompt).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def make_key(cls, model, prompt, params=None):
+        payload = json.dumps([model, cls.prompt_hash(prompt), params or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, model, prompt, params=None):
+        key = self.make_key(model, prompt, params)
+        with self.lock:
+            row = self.conn.execute('SELECT answer, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row and (self.ttl is None or time.time() - row[1] <= self.ttl):
+                self.stats['hits'] += 1
+                return row[0]
+            self.stats['misses'] += 1
+        if self.replay_only:
+            raise LLMCacheMiss(f"No cached answer for {model} prompt {self.prompt_hash(prompt)[:12]}")
+        return None
+
+    def put(self, model, prompt, answer, params=None):
+        key = self.make_key(model, prompt, params)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, model, self.prompt_hash(prompt), json.dumps(params or {}, sort_keys=True),
+                               answer, time.time()))
+            self.stats['stores'] += 1
+
+    def invalidate(self, model, prompt, params=None):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (self.make_key(model, prompt, params),))
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,167 @@
+import re
+import json
+import random
+import asyncio
+import threading
+import openai
+from openai import AsyncOpenAI
+from config.Tracer import count, counted, current_counters
+
+
+def contains_chinese(s):
+    return re.search("[\u4e00-\u9fff]", s)
+
+
+def parse_drug_answer(content):
+    """Validate an LLM answer and return (True, drugs) or (False, reason)."""
+    try:
+        json_start = content.find('{')
+        json_end = content.rfind('}') + 1
+        data = json.loads(content[json_start:json_end])
+        if 'drug' in data['drugs'][0]['name'] or 'Drug' in data['drugs'][0]['name']:
+            return False, "Invalid drug name"
+        if contains_chinese(data['drugs'][0]['name']):
+            return False, "Drug name contains Chinese characters"
+        if len(data['drugs']) < 5:
+            return False, "Fewer than 5 drugs"
+        return True, data['drugs']
+    except Exception as e:
+        return False, str(e)
+
+
+class LLMStage:
+    """Ask many filled questions concurrently through an OpenAI-compatible API.
+
+    At most ``max_concurrency`` requests are in flight. Rate limits, timeouts,
+    connection errors and 5xx responses are retried with exponential backoff
+    and full jitter, honouring ``Retry-After`` when the server sends one. An
+    answer rejected by ``validate`` only repeats the chat call, never the
+    upstream download/PLIP/template work. With a ``cache`` (LLMCache), valid
+    answers are stored and identical prompts are answered without an API call.
+
+    One event loop, client and concurrency limit live on a background thread
+    for the lifetime of the stage; ``submit`` hands it a question from any
+    thread and ``close`` stops it.
+    """
+
+    RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+    def __init__(self, api_key=None, base_url=None, model="gpt-4o", max_concurrency=8, max_retries=6,
+                 max_invalid_answers=5, base_delay=1.0, max_delay=60.0, timeout=600, validate=parse_drug_answer,
+                 params=None, cache=None):
+        self.api_key = api_key or None
+        self.base_url = base_url or None
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_invalid_answers = max_invalid_answers
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.validate = validate
+        self.params = params or {}
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.client = None
+        self.semaphore = None
+
+    def backoff(self, attempt, error=None):
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def complete(self, client, question):
+        for attempt in range(self.max_retries + 1):
+            try:
+                completion = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "user", "content": question}
+                    ],
+                    **self.params
+                )
+                count('llm_calls')
+                if completion.usage is not None:
+                    count('prompt_tokens', completion.usage.prompt_tokens)
+                    count('completion_tokens', completion.usage.completion_tokens)
+                return completion.choices[0].message.content
+            except self.RETRYABLE as e:
+                count('llm_retries')
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff(attempt, e))
+
+    async def ask(self, client, semaphore, question):
+        # Returns (answer, drugs); drugs is None when no valid answer came back
+        if self.cache is not None:
+            answer = self.cache.get(self.model, question, self.params)
+            if answer is not None:
+                if self.validate is None:
+                    return answer, None
+                is_correct, result = self.validate(answer)
+                if is_correct:
+                    count('llm_cache_hits')
+                    return answer, result
+        answer = None
+        for _ in range(self.max_invalid_answers):
+            async with semaphore:
+                answer = await self.complete(client, question)
+            is_correct, result = (True, None) if self.validate is None else self.validate(answer)
+            if not is_correct:
+                count('llm_invalid_answers')
+            if is_correct:
+                if self.cache is not None:
+                    self.cache.put(self.model, question, answer, self.params)
+                return answer, result
+        return answer, None
+
+    def start(self):
+        # The client and semaphore are bound to the loop, so they are created on it and kept with it
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='llm-loop', daemon=True)
+                self.thread.start()
+                asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+            return self.loop
+
+    async def _open(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout)
+
+    def submit(self, question):
+        """Ask one question on the stage's loop. Returns a concurrent.futures.Future of (answer, drugs)."""
+        loop = self.start()
+        # Counters go to the span of the calling thread
+        coroutine = counted(self.ask(self.client, self.semaphore, question), current_counters())
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def run(self, questions):
+        """questions: {key: question text}. Returns {key: (answer, drugs)}; failures map to an exception."""
+        futures = {key: self.submit(question) for key, question in questions.items()}
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = e
+        return results
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = self.thread = self.client = self.semaphore = None
@@ -0,0 +1,110 @@
+import os
+import re
+import shutil
+import sqlite3
+import hashlib
+import uuid
+import threading
+from rdkit import Chem
+from rdkit.Chem.MolStandardize import rdMolStandardize
+
+
+def strip_salts(mol):
+    # Keep the largest organic fragment, dropping counter-ions and solvents of salt forms
+    return rdMolStandardize.LargestFragmentChooser(preferOrganic=True).choose(mol)
+
+
+def canonical_smiles(smiles):
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return smiles
+    return Chem.MolToSmiles(mol, isomericSmiles=True)
+
+
+def parent_smiles(smiles):
+    """Canonical SMILES of the parent compound, so "imatinib mesylate" and "imatinib" are one ligand."""
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return smiles
+    return Chem.MolToSmiles(strip_salts(mol), isomericSmiles=True)
+
+
+def ligand_key(smiles):
+    # InChIKey of the parent compound where RDKit can compute one, otherwise a hash of the canonical SMILES
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is not None:
+        inchikey = Chem.MolToInchiKey(strip_salts(mol))
+        if inchikey:
+            return inchikey
+    return 'SMI-' + hashlib.sha1(canonical_smiles(smiles).encode()).hexdigest()[:27]
+
+
+def link_or_copy(source, destination):
+    # Hard links keep synonyms on one inode; fall back to a copy across file systems
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    temp_path = f'{destination}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
+    return destination
+
+
+class LigandStore:
+    """Content-addressed ligand and docking artifacts.
+
+    Ligand PDBQTs live under ``root/pdbqt/<ligand key>.pdbqt`` where the key
+    is the InChIKey of the salt-stripped parent compound. Every drug name the
+    LLM produced is recorded as an alias of its key, so "Imatinib", "IMATINIB"
+    and "imatinib mesylate" share one prepared ligand. Docking poses live under ``root/dock/`` keyed by
+    receptor hash, ligand key, box and exhaustiveness.
+    """
+
+    def __init__(self, root='./data/ligands', db_path='./data/compound_cache.sqlite'):
+        self.root = root
+        self.db_path = db_path
+        os.makedirs(os.path.join(root, 'pdbqt'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'dock'), exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS ligand_aliases ('
+                              'name_key TEXT PRIMARY KEY, name TEXT, ligand_key TEXT NOT NULL, smiles TEXT)')
+
+    @staticmethod
+    def normalize_name(name):
+        return re.sub(r'\s+', ' ', name).strip().lower()
+
+    def register(self, name, smiles):
+        key = ligand_key(smiles)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO ligand_aliases VALUES (?, ?, ?, ?)',
+                              (self.normalize_name(name), name, key, parent_smiles(smiles)))
+        return key
+
+    def key_for(self, name):
+        with self.lock:
+            row = self.conn.execute('SELECT ligand_key FROM ligand_aliases WHERE name_key = ?',
+                                    (self.normalize_name(name),)).fetchone()
+        return row[0] if row else None
+
+    def aliases(self, key):
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT name FROM ligand_aliases WHERE ligand_key = ?', (key,))]
+
+    def ligand_path(self, key):
+        return os.path.join(self.root, 'pdbqt', f'{key}.pdbqt')
+
+    @staticmethod
+    def docking_key(receptor_hash, ligand_key, boxes, exhaustiveness):
+        box = ';'.join(','.join(f'{v:.3f}' for v in list(center) + list(size)) for center, size in boxes)
+        return hashlib.sha1(f'{receptor_hash}|{ligand_key}|{box}|{exhaustiveness}'.encode()).hexdigest()
+
+    def docking_path(self, docking_key):
+        return os.path.join(self.root, 'dock', f'{docking_key}.pdbqt')
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,169 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import threading
+from config.RCSBFetcher import get_fetcher
+from config.StructureSource import get_structure_source, offline_mode
+
+RCSB_GRAPHQL_URL = 'https://data.rcsb.org/graphql'
+
+ENTRY_QUERY = '''query ($ids: [String!]!) {
+  entries(entry_ids: $ids) {
+    rcsb_id
+    struct { title }
+    struct_keywords { pdbx_keywords }
+    polymer_entities {
+      rcsb_entity_source_organism { scientific_name }
+      rcsb_entity_host_organism { scientific_name }
+    }
+  }
+}'''
+
+SUMMARY_FIELDS = ['PDB ID', 'Title', 'Classification', 'Organism(s)', 'Expression System']
+
+
+def summary_from_entry(entry):
+    # One RCSB GraphQL entry -> the summary fields used in the prompt
+    organisms, hosts = [], []
+    for entity in entry.get('polymer_entities') or []:
+        organisms += [o['scientific_name'] for o in entity.get('rcsb_entity_source_organism') or [] if o.get('scientific_name')]
+        hosts += [h['scientific_name'] for h in entity.get('rcsb_entity_host_organism') or [] if h.get('scientific_name')]
+    return {
+        'PDB ID': entry['rcsb_id'].upper(),
+        'Title': (entry.get('struct') or {}).get('title') or 'Not found',
+        'Classification': (entry.get('struct_keywords') or {}).get('pdbx_keywords') or 'Not found',
+        'Organism(s)': ', '.join(dict.fromkeys(organisms)) or 'Not found',
+        'Expression System': ', '.join(dict.fromkeys(hosts)) or 'Not found',
+    }
+
+
+class MetadataIndex:
+    """Local index of PDB entry metadata (title, classification, organism, expression system).
+
+    Missing entries are fetched from the RCSB GraphQL API, ``batch_size`` ids
+    per request. Entries the API does not return, and every entry in offline
+    mode, are filled from the structure header through the structure sources.
+    ``import_dump`` loads an offline dump (GraphQL JSON, JSON lines or CSV).
+    """
+
+    def __init__(self, db_path='./data/pdb_metadata.sqlite', graphql_url=None, batch_size=200, fetcher=None):
+        self.db_path = db_path
+        self.graphql_url = graphql_url or os.environ.get('DRUGREALIGN_RCSB_GRAPHQL_URL') or RCSB_GRAPHQL_URL
+        self.batch_size = batch_size
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                              'pdb_id TEXT PRIMARY KEY, title TEXT, classification TEXT, organisms TEXT, '
+                              'expression TEXT, source TEXT, updated REAL NOT NULL)')
+
+    def get_many(self, pdb_ids):
+        found = {}
+        with self.lock:
+            for pdb_id in pdb_ids:
+                row = self.conn.execute('SELECT pdb_id, title, classification, organisms, expression FROM entries '
+                                        'WHERE pdb_id = ?', (pdb_id.upper(),)).fetchone()
+                if row:
+                    found[pdb_id] = dict(zip(SUMMARY_FIELDS, row))
+        return found
+
+    def get(self, pdb_id):
+        return self.get_many([pdb_id]).get(pdb_id)
+
+    def store(self, summaries, source):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  [(s['PDB ID'].upper(), s['Title'], s['Classification'], s['Organism(s)'],
+                                    s['Expression System'], source, now) for s in summaries])
+
+    def query(self, pdb_ids):
+        fetcher = self.fetcher or get_fetcher()
+        response = fetcher.post(self.graphql_url, json={'query': ENTRY_QUERY, 'variables': {'ids': pdb_ids}})
+        if response is None or response.status_code != 200:
+            print(f"Metadata request failed: {response.status_code if response is not None else 'no response'}")
+            return []
+        return [summary_from_entry(entry) for entry in (response.json().get('data') or {}).get('entries') or [] if entry]
+
+    def fetch(self, pdb_ids):
+        """Make sure all ``pdb_ids`` are indexed. Returns {pdb_id: summary or None}."""
+        pdb_ids = list(dict.fromkeys(pdb_ids))
+        found = self.get_many(pdb_ids)
+        missing = [pdb_id for pdb_id in pdb_ids if pdb_id not in found]
+        if missing and not offline_mode():
+            for start in range(0, len(missing), self.batch_size):
+                self.store(self.query([pdb_id.upper() for pdb_id in missing[start:start + self.batch_size]]), 'rcsb')
+            found.update(self.get_many(missing))
+            missing = [pdb_id for pdb_id in missing if pdb_id not in found]
+        if missing:
+            source = get_structure_source()
+            headers = [summary for summary in (source.read_summary(pdb_id) for pdb_id in missing) if summary]
+            self.store(headers, 'header')
+            found.update(self.get_many(missing))
+        return {pdb_id: found.get(pdb_id) for pdb_id in pdb_ids}
+
+    def summary_text(self, pdb_id):
+        return self.summary_texts([pdb_id]).get(pdb_id)
+
+    def summary_texts(self, pdb_ids):
+        """Prompt summaries of the indexed entries among ``pdb_ids``."""
+        return {pdb_id: ''.join(f'{key}: {value}\n' for key, value in summary.items())
+                for pdb_id, summary in self.get_many(pdb_ids).items()}
+
+    def import_dump(self, path):
+        """Bulk-load a metadata dump. Returns the number of entries stored.
+
+        Accepts a GraphQL response or a list of entries (``.json``), one
+        entry per line (``.jsonl``), or a CSV with the summary field names
+        as columns. Entries may be GraphQL-shaped or flat summaries.
+        """
+        if path.endswith('.csv'):
+            with open(path, 'r', newline='', encoding='utf-8') as f:
+                records = list(csv.DictReader(f))
+        elif path.endswith('.jsonl'):
+            with open(path, 'r', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            if isinstance(records, dict):
+                records = (records.get('data') or {}).get('entries') or []
+        summaries = []
+        for record in records:
+            if record and 'rcsb_id' in record:
+                summaries.append(summary_from_entry(record))
+            elif record and record.get('PDB ID'):
+                summaries.append({key: record.get(key) or 'Not found' for key in SUMMARY_FIELDS})
+        self.store(summaries, 'import')
+        return len(summaries)
+
+    def close(self):
+        self.conn.close()
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_metadata_index():
+    """The process-wide metadata index."""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = MetadataIndex()
+        return _shared_index
+
+
+# Example: index a few entries, or import a dump given on the command line
+if __name__ == '__main__':
+    import sys
+    index = MetadataIndex()
+    if len(sys.argv) > 1:
+        print(f'Imported {index.import_dump(sys.argv[1])} entries')
+    else:
+        print(index.fetch(['4HHB', '1C8K']))
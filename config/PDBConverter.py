@@ -1,6 +1,9 @@
 import os
+import io
+import uuid
 import subprocess
 from Bio import PDB
+from config.AtomicFile import atomic_write
 
 # Please replace the following path
 MGLTOOLS_PYTHON = "/home/wjh/autodocktools/mgltools_x86_64Linux2_1.5.6/bin/MGLpython2.5"
@@ -8,9 +11,16 @@ PREPARE_RECEPTOR_SCRIPT = "/home/wjh/autodocktools/mgltools_x86_64Linux2_1.5.6/M
 
 
 class PDBConverter:
-    def __init__(self, pdbqt_path, pdb_path):
+    # backend: 'openbabel' prepares the receptor in-process, 'mgltools' runs prepare_receptor4.py,
+    # 'auto' uses MGLTools when it is installed and OpenBabel otherwise
+    def __init__(self, pdbqt_path, pdb_path, backend=None):
         self.pdbqt_path = pdbqt_path
         self.pdb_file = pdb_path
+        self.backend = backend or os.environ.get('DRUGREALIGN_RECEPTOR_BACKEND', 'auto')
+        if self.backend == 'auto':
+            self.backend = 'mgltools' if os.path.exists(MGLTOOLS_PYTHON) else 'openbabel'
+        if self.backend not in ('openbabel', 'mgltools'):
+            raise ValueError(f"Unknown receptor preparation backend: {self.backend}")
 
     class NonHetSelect(PDB.Select):
         def accept_residue(self, residue):
@@ -24,26 +34,62 @@ class PDBConverter:
         io.set_structure(structure)
         io.save(output_filename, self.NonHetSelect())
 
-    def convert_pdb_to_pdbqt(self):
-        pdbqt_file = self.pdbqt_path
-        if os.path.exists(pdbqt_file):
-            return pdbqt_file
+    def protein_only_block(self, pdb_filename):
+        # Same filtering as remove_ligands_and_waters, kept in memory instead of a temp file
+        structure = PDB.PDBParser(QUIET=True).get_structure("structure", pdb_filename)
+        pdb_io = PDB.PDBIO()
+        pdb_io.set_structure(structure)
+        buffer = io.StringIO()
+        pdb_io.save(buffer, self.NonHetSelect())
+        return buffer.getvalue()
 
-        temp_pdb_path = self.pdb_file.replace('.pdb', '_temp.pdb')
-        self.remove_ligands_and_waters(self.pdb_file, temp_pdb_path)
+    def convert_with_openbabel(self, pdbqt_file):
+        from openbabel import openbabel as ob
+        from openbabel import pybel
 
+        mol = pybel.readstring("pdb", self.protein_only_block(self.pdb_file))
+        mol.OBMol.AddHydrogens()
+        ob.OBChargeModel.FindType("gasteiger").ComputeCharges(mol.OBMol)
 
-        subprocess.run([MGLTOOLS_PYTHON, 
-                        "-c", f"import sys; sys.path.append('{os.path.dirname(PREPARE_RECEPTOR_SCRIPT)}'); exec(open('{PREPARE_RECEPTOR_SCRIPT}').read())", 
-                        '-r', temp_pdb_path, 
-                        '-o', pdbqt_file,
-                        '-A', 'hydrogens'])
+        conversion = ob.OBConversion()
+        conversion.SetOutFormat("pdbqt")
+        # Rigid receptor without a torsion tree, all chains in one molecule, keep PDB atom names.
+        # The writer merges non-polar hydrogens and assigns AD4 atom types.
+        for option in ("r", "c", "n"):
+            conversion.AddOption(option, ob.OBConversion.OUTOPTIONS)
+        text = conversion.WriteString(mol.OBMol)
+        if not text:
+            raise RuntimeError(f"OpenBabel could not write {pdbqt_file}")
+        # A unique temp file per call, so concurrent receptor workers never share one
+        with atomic_write(pdbqt_file) as file:
+            file.write(text)
+        return pdbqt_file
 
+    def convert_with_mgltools(self, pdbqt_file):
+        temp_pdb_path = self.pdb_file.replace('.pdb', f'_temp_{uuid.uuid4().hex}.pdb')
+        try:
+            self.remove_ligands_and_waters(self.pdb_file, temp_pdb_path)
 
-        os.remove(temp_pdb_path)
+            subprocess.run([MGLTOOLS_PYTHON,
+                            "-c", f"import sys; sys.path.append('{os.path.dirname(PREPARE_RECEPTOR_SCRIPT)}'); exec(open('{PREPARE_RECEPTOR_SCRIPT}').read())",
+                            '-r', temp_pdb_path,
+                            '-o', pdbqt_file,
+                            '-A', 'hydrogens'])
+        finally:
+            if os.path.exists(temp_pdb_path):
+                os.remove(temp_pdb_path)
 
         return pdbqt_file
 
+    def convert_pdb_to_pdbqt(self):
+        pdbqt_file = self.pdbqt_path
+        if os.path.exists(pdbqt_file):
+            return pdbqt_file
+
+        if self.backend == 'openbabel':
+            return self.convert_with_openbabel(pdbqt_file)
+        return self.convert_with_mgltools(pdbqt_file)
+
 
 if __name__ == '__main__':
     for pdb_id in [i for i in os.listdir('./pdb') if i.endswith('pdb')]:
@@ -4,58 +4,119 @@ import os
 import re
 from plip.structure.preparation import PDBComplex
 from plip.exchange.report import BindingSiteReport
+from config.PLIPCache import get_plip_cache
+from config.InteractionStore import INTERACTION_TYPES, PROMPT_COLUMNS, get_interaction_store
+
+
+def ligand_id(ligand):
+    # Untruncated form of the site key PLIP builds from the ligand members
+    return ' + '.join(':'.join(str(x) for x in member) for member in ligand.members)
+
+
+def load_complex(pdb_path):
+    protlig = PDBComplex()
+    protlig.load_pdb(pdb_path)
+    return protlig
+
+
+def characterize_ligands(pdb_path, ligand_ids, protlig=None):
+    """Characterise the given ligands of one complex. Returns {ligand_id: (site key, interactions)}.
+
+    Runs in worker processes: each worker parses the structure once and
+    handles its share of the binding sites. Ligands without a new binding
+    site map to (None, None), so the negative result is cached as well.
+    """
+    protlig = protlig or load_complex(pdb_path)
+    wanted = set(ligand_ids)
+    results = {}
+    for ligand in protlig.ligands:
+        current_id = ligand_id(ligand)
+        if current_id not in wanted:
+            continue
+        before = set(protlig.interaction_sets)
+        protlig.characterize_complex(ligand)
+        for key in set(protlig.interaction_sets) - before:
+            binding_site = BindingSiteReport(protlig.interaction_sets[key])
+            interactions = {k: [getattr(binding_site, f"{k}_features")] + getattr(binding_site, f"{k}_info") for k in INTERACTION_TYPES}
+            results[current_id] = (key, interactions)
+    for current_id in wanted - set(results):
+        results[current_id] = (None, None)
+    return results
+
 
 class PDBInteractionExtractor:
-    def __init__(self, pdb_path, spatial_information_folder='./3D'):
+    def __init__(self, pdb_path, spatial_information_folder='./3D', executor=None, workers=None, cache=None, store=None,
+                 name=None):
         self.pdb_path = pdb_path
+        # Name the tables are stored under; the file name unless the structure stands in for another target
+        self.name = name
         self.spatial_information_folder = spatial_information_folder
+        # Binding sites are characterised on ``executor`` (a process pool), split into ``workers`` chunks
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache or get_plip_cache()
+        self.store = store or get_interaction_store()
         if not os.path.exists(self.spatial_information_folder):
             os.makedirs(self.spatial_information_folder)
-        self.attri_dict = {
-            'hydrophobic': ['RESTYPE', 'RESCHAIN', 'RESCHAIN_LIG', 'DIST', 'LIGCOO', 'PROTCOO'],
-            'hbond': ['RESTYPE', 'RESCHAIN', 'RESTYPE_LIG', 'PROTCOO', 'LIGCOO', 'DIST_H-A', 'DIST_D-A', 'DON_ANGLE', 'DONORTYPE', 'ACCEPTORTYPE'],
-            'pistacking': ['RESTYPE', 'RESCHAIN', 'RESTYPE_LIG', 'CENTDIST', 'ANGLE', 'OFFSET', 'PROTCOO', 'LIGCOO']
-        }
+        self.attri_dict = {key: list(columns) for key, columns in PROMPT_COLUMNS.items()}
 
     @staticmethod
     def remove_consecutive_spaces(s):
         return re.sub(r' +', ' ', s)
 
+    def characterize_missing(self, missing, protlig):
+        chunks = [chunk for chunk in (missing[index::self.workers] for index in range(self.workers)) if chunk]
+        if self.executor is None or len(chunks) < 2:
+            return characterize_ligands(self.pdb_path, missing, protlig)
+        results = {}
+        futures = [self.executor.submit(characterize_ligands, self.pdb_path, chunk) for chunk in chunks]
+        for future in futures:
+            results.update(future.result())
+        return results
+
     def retrieve_plip_interactions(self):
-        protlig = PDBComplex()
-        protlig.load_pdb(self.pdb_path)
-        for ligand in protlig.ligands:
-            protlig.characterize_complex(ligand)
-        sites = {}
-        for key, site in sorted(protlig.interaction_sets.items()):
-            binding_site = BindingSiteReport(site)
-            keys = ("hydrophobic", "hbond", "pistacking")
-            interactions = {k: [getattr(binding_site, f"{k}_features")] + getattr(binding_site, f"{k}_info") for k in keys}
-            sites[key] = interactions
-        return sites
+        structure_hash = self.cache.structure_hash(self.pdb_path)
+        ligand_ids = self.cache.ligand_ids(structure_hash)
+        protlig = None
+        if ligand_ids is None:
+            protlig = load_complex(self.pdb_path)
+            ligand_ids = [ligand_id(ligand) for ligand in protlig.ligands]
+            self.cache.store_ligand_ids(structure_hash, ligand_ids)
+        found = self.cache.get_sites(structure_hash, ligand_ids)
+        missing = [current_id for current_id in ligand_ids if current_id not in found]
+        if missing:
+            if protlig is None and (self.executor is None or len(missing) < 2):
+                protlig = load_complex(self.pdb_path)
+            computed = self.characterize_missing(missing, protlig)
+            self.cache.store_sites(structure_hash, computed)
+            found.update(computed)
+        sites = dict(site for site in found.values() if site[0] is not None)
+        return {key: sites[key] for key in sorted(sites)}
 
     def create_df_from_binding_site(self, selected_site_interactions, interaction_type="hbond"):
         df = pd.DataFrame.from_records(selected_site_interactions[interaction_type][1:], columns=selected_site_interactions[interaction_type][0])
         return df
 
+    def structure_name(self):
+        if self.name is not None:
+            return self.name
+        return os.path.basename(self.pdb_path).replace('.pdb', '')
+
     def process_and_save(self):
+        """Store all interaction tables of the complex; the prompt text is rendered from them by ``render``."""
         interactions_by_site = self.retrieve_plip_interactions()
         result_dict = {}
-        for interaction_type in ["hydrophobic", "hbond", "pistacking"]:
-            for key in interactions_by_site.keys():
-                df = self.create_df_from_binding_site(interactions_by_site[key], interaction_type)
-                if interaction_type not in result_dict:
-                    result_dict[interaction_type] = df
-                else:
-                    result_dict[interaction_type] = pd.concat([result_dict[interaction_type], df])
-
-        spatial_information_filename = os.path.join(self.spatial_information_folder, os.path.basename(self.pdb_path).replace('.pdb', '.txt'))
-        with open(spatial_information_filename, 'w', encoding='utf-8') as f:
-            for key, df in result_dict.items():
-                if len(df) == 0:
-                    continue
-                df = df[self.attri_dict[key]]
-                f.write(self.remove_consecutive_spaces(f'"""{key}""":\n{df.to_string(index=False)}\n'))
+        for interaction_type in INTERACTION_TYPES:
+            frames = [self.create_df_from_binding_site(site, interaction_type).assign(SITE=key)
+                      for key, site in interactions_by_site.items()]
+            if frames:
+                # One concatenation per type instead of growing the frame site by site
+                result_dict[interaction_type] = pd.concat(frames, ignore_index=True)
+        self.store.write(self.structure_name(), result_dict)
+        return result_dict
+
+    def render(self):
+        return self.store.render(self.structure_name(), self.attri_dict)
 
 if __name__ == '__main__':
     pdb_path = 'path_to_your_pdb_file.pdb'  # Update this with your actual PDB file path
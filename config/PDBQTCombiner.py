@@ -1,28 +1,83 @@
-from pymol import cmd
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from config.AtomicFile import atomic_write
+
+# AutoDock atom types that are not plain element symbols
+AD_ELEMENTS = {'A': 'C', 'NA': 'N', 'NS': 'N', 'OA': 'O', 'OS': 'O', 'SA': 'S', 'HD': 'H', 'HS': 'H',
+               'G0': 'C', 'G1': 'C', 'G2': 'C', 'G3': 'C', 'CG0': 'C', 'CG1': 'C', 'CG2': 'C', 'CG3': 'C'}
+
+
+def pdbqt_to_pdb_line(line, serial, record=None):
+    """One PDBQT ATOM/HETATM line as a PDB line: charge and AutoDock type give way to the element."""
+    ad_type = line[77:79].strip() if len(line) > 77 else ''
+    element = AD_ELEMENTS.get(ad_type, ad_type).upper()
+    record = record or line[:6]
+    return f'{record:<6}{serial % 100000:>5}{line[11:66].ljust(55)}          {element:>2}\n'
+
+
+@functools.lru_cache(maxsize=16)
+def _receptor_atoms(pdbqt_path, mtime_ns, size):
+    # Keyed on mtime and size, so a rewritten receptor is converted again
+    with open(pdbqt_path, 'r') as file:
+        return tuple(line.rstrip('\n') for line in file if line.startswith(('ATOM', 'HETATM')))
 
-class PDBQTCombiner:
-    def __init__(self, receptor_pdbqt_path, ligand_pdbqt_path):
-        self.receptor_pdbqt_path = receptor_pdbqt_path
-        self.ligand_pdbqt_path = ligand_pdbqt_path
 
-    def convert_pdbqt_to_pdb(self, pdbqt_path, output_pdb_path):
-        cmd.load(pdbqt_path)
-        cmd.save(output_pdb_path)
-        cmd.delete('all')
+def receptor_atoms(pdbqt_path):
+    stat = os.stat(pdbqt_path)
+    return _receptor_atoms(os.path.abspath(pdbqt_path), stat.st_mtime_ns, stat.st_size)
 
-    def combine_pdb_files(self, receptor_pdb_path, ligand_pdb_path, output_pdb_path):
-        cmd.load(receptor_pdb_path, 'receptor')
-        cmd.load(ligand_pdb_path, 'ligand')
-        cmd.create('combined', 'receptor or ligand')
-        cmd.save(output_pdb_path, 'combined')
-        cmd.delete('all')
 
-    def combine_pdbqt(self, output_pdb_path):
-        receptor_pdb_path = 'receptor.pdb'
-        ligand_pdb_path = 'ligand.pdb'
+def first_model_atoms(pdbqt_path):
+    """Yield the atom lines of the first pose of a docking result, stopping at its ENDMDL."""
+    with open(pdbqt_path, 'r') as file:
+        for line in file:
+            if line.startswith('ENDMDL'):
+                return
+            if line.startswith(('ATOM', 'HETATM')):
+                yield line.rstrip('\n')
+
+
+class PDBQTCombiner:
+    """Write receptor + docked pose complexes as PDB files, without PyMOL.
+
+    The receptor PDBQT is read once and kept in memory (shared by every
+    combiner for the same file); each pose's first MODEL is streamed into
+    the output, written atomically. Ligand atoms become HETATM records so
+    PLIP recognises them. There is no global state, so ``combine_many`` can
+    write many poses in parallel.
+    """
+
+    def __init__(self, receptor_pdbqt_path, ligand_pdbqt_path=None):
+        self.receptor_pdbqt_path = receptor_pdbqt_path
+        self.ligand_pdbqt_path = ligand_pdbqt_path
 
-        self.convert_pdbqt_to_pdb(self.receptor_pdbqt_path, receptor_pdb_path)
-        self.convert_pdbqt_to_pdb(self.ligand_pdbqt_path, ligand_pdb_path)
+    def combine_pdbqt(self, output_pdb_path, ligand_pdbqt_path=None):
+        ligand_pdbqt_path = ligand_pdbqt_path or self.ligand_pdbqt_path
+        receptor = receptor_atoms(self.receptor_pdbqt_path)
+        with atomic_write(output_pdb_path) as output:
+            serial = 0
+            for line in receptor:
+                serial += 1
+                output.write(pdbqt_to_pdb_line(line, serial))
+            output.write('TER\n')
+            for line in first_model_atoms(ligand_pdbqt_path):
+                serial += 1
+                output.write(pdbqt_to_pdb_line(line, serial, 'HETATM'))
+            output.write('END\n')
+        #print(f"Combined PDB file saved at: {output_pdb_path}")
+        return output_pdb_path
 
-        self.combine_pdb_files(receptor_pdb_path, ligand_pdb_path, output_pdb_path)
-        #print(f"Combined PDB file saved at: {output_pdb_path}")
\ No newline at end of file
+    def combine_many(self, jobs, workers=4):
+        """jobs: {ligand_pdbqt_path: output_pdb_path}. Returns {ligand_pdbqt_path: output path or None}."""
+        receptor_atoms(self.receptor_pdbqt_path)
+        results = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {ligand: executor.submit(self.combine_pdbqt, output, ligand) for ligand, output in jobs.items()}
+        for ligand, future in futures.items():
+            try:
+                results[ligand] = future.result()
+            except Exception as e:
+                print(f"Error combining {ligand}: {e}")
+                results[ligand] = None
+        return results
@@ -1,47 +1,34 @@
-import requests
-from bs4 import BeautifulSoup
 import os
+from config.AtomicFile import atomic_write
+from config.MetadataIndex import get_metadata_index
 
 class PDBSummaryExtractor:
-    def __init__(self, summary_folder='./summary'):
+    def __init__(self, summary_folder='./summary', metadata_index=None):
         self.summary_folder = summary_folder
+        self.metadata_index = metadata_index or get_metadata_index()
         if not os.path.exists(self.summary_folder):
             os.makedirs(self.summary_folder)
 
+    def fetch_summaries(self, pdb_ids):
+        # One batched metadata request for all ids not yet in the index
+        return self.metadata_index.fetch(pdb_ids)
+
     def fetch_and_save_summary(self, pdb_id):
         summary_path = os.path.join(self.summary_folder, f'{pdb_id}.txt')
         if not os.path.exists(summary_path):
-            url = f'https://www.rcsb.org/structure/{pdb_id}'
-            response = requests.get(url)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.content, 'html.parser')
-
-                html_ids = {
-                    'PDB ID': 'structureID',
-                    'Title': 'structureTitle',
-                    'Classification': 'header_classification',
-                    'Organism(s)': 'header_organism',
-                    'Expression System': 'header_expression-system'
-                }
-
-                result = {}
-                for key, item_id in html_ids.items():
-                    info_element = soup.find(id=item_id)
-                    if info_element:
-                        result[key] = info_element.text.strip()
-                    else:
-                        result[key] = "Not found"
-
-                with open(summary_path, 'w') as file:
-                    for key, value in result.items():
-                        file.write(f'{key}: {value}\n')
-
-                #print(f'Summary saved for {pdb_id}:', result)
+            self.metadata_index.fetch([pdb_id])
+            summary = self.metadata_index.summary_text(pdb_id)
+            if summary is not None:
+                with atomic_write(summary_path) as file:
+                    file.write(summary)
+                #print(f'Summary saved for {pdb_id}:', summary)
+                return True
             else:
-                print(f'Failed to fetch data for {pdb_id}. HTTP status code: {response.status_code}')
+                print(f'Failed to fetch data for {pdb_id}.')
+                return False
         else:
-            pass
             #print(f'Summary already exists for {pdb_id}.')
+            return True
 
 # Example of how to use the class for a single PDB file
 if __name__ == '__main__':
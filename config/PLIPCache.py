@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from importlib.metadata import version, PackageNotFoundError
+from config.Tracer import count
+
+
+def plip_version():
+    try:
+        return version('plip')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+class PLIPCache:
+    """Persistent PLIP results keyed by (structure hash, ligand id).
+
+    The structure hash covers the file content and the PLIP version. The
+    full interaction tables of each binding site are stored, so a different
+    column selection or template never re-runs PLIP. The ligand ids found
+    in a structure are stored too, so a fully cached structure is not even
+    parsed again. A ligand without a binding site is stored with no site,
+    so it is not characterised again either.
+    """
+
+    def __init__(self, db_path='./data/plip_cache.sqlite'):
+        self.db_path = db_path
+        self.stats = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS structures ('
+                              'structure_hash TEXT PRIMARY KEY, ligand_ids TEXT NOT NULL, created REAL NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS sites ('
+                              'structure_hash TEXT NOT NULL, ligand_id TEXT NOT NULL, site TEXT, interactions BLOB, '
+                              'created REAL NOT NULL, PRIMARY KEY (structure_hash, ligand_id))')
+
+    @staticmethod
+    def structure_hash(pdb_path):
+        digest = hashlib.sha256(plip_version().encode('utf-8'))
+        with open(pdb_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def ligand_ids(self, structure_hash):
+        with self.lock:
+            row = self.conn.execute('SELECT ligand_ids FROM structures WHERE structure_hash = ?',
+                                    (structure_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store_ligand_ids(self, structure_hash, ligand_ids):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO structures VALUES (?, ?, ?)',
+                              (structure_hash, json.dumps(ligand_ids), time.time()))
+
+    def get_sites(self, structure_hash, ligand_ids):
+        """Returns {ligand_id: (site key, interactions)} for the cached ligands."""
+        found = {}
+        with self.lock:
+            for ligand_id in ligand_ids:
+                row = self.conn.execute('SELECT site, interactions FROM sites WHERE structure_hash = ? AND ligand_id = ?',
+                                        (structure_hash, ligand_id)).fetchone()
+                if row:
+                    found[ligand_id] = (row[0], pickle.loads(row[1]))
+            self.stats['hits'] += len(found)
+            self.stats['misses'] += len(ligand_ids) - len(found)
+        count('plip_cache_hits', len(found))
+        count('plip_cache_misses', len(ligand_ids) - len(found))
+        return found
+
+    def store_sites(self, structure_hash, sites):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?, ?)',
+                                  [(structure_hash, ligand_id, site, pickle.dumps(interactions), now)
+                                   for ligand_id, (site, interactions) in sites.items()])
+
+    def close(self):
+        self.conn.close()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_plip_cache():
+    """The process-wide PLIP cache."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = PLIPCache()
+        return _shared_cache
@@ -1,66 +1,159 @@
 import os
-import subprocess
 import shutil
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from plip.basic import config as plip_config
+from plip.basic.remote import VisualizerData
+from plip.structure.preparation import PDBComplex
+
+# PLIP settings and the PyMOL scene are module globals: one complex per process at a time
+_plip_lock = threading.Lock()
+
+
+def visualize_complex(pdb_path, output_dir, temp_root='./temp_plip_files'):
+    """Run PLIP on one complex and move its PyMOL sessions to ``output_dir``. Returns the session paths.
+
+    Every call works in a fresh directory under ``temp_root`` and never
+    changes the working directory. Threads of one process take turns, since
+    PLIP and PyMOL keep their state in module globals; ``PLIPPool`` runs
+    complexes in parallel in separate processes.
+    """
+    # Imported here so PyMOL only starts in the processes that render
+    from plip.visualization.visualize import visualize_in_pymol
+
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(temp_root, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix='plip_', dir=temp_root)
+    try:
+        with _plip_lock:
+            plip_config.PYMOL = True
+            plip_config.OUTPATH = temp_dir
+            mol = PDBComplex()
+            mol.output_path = temp_dir
+            mol.load_pdb(os.path.abspath(pdb_path))
+            for ligand in mol.ligands:
+                mol.characterize_complex(ligand)
+            for site in sorted(mol.interaction_sets):
+                if len(mol.interaction_sets[site].interacting_res) != 0:
+                    visualize_in_pymol(VisualizerData(mol, site))
+        sessions = []
+        for file in sorted(os.listdir(temp_dir)):
+            if file.endswith('.pse'):
+                destination = os.path.join(output_dir, file)
+                shutil.move(os.path.join(temp_dir, file), destination)
+                sessions.append(destination)
+        if not sessions:
+            print(f'PSE file not found for {pdb_path}.')
+        return sessions
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
 
 class PLIPProcessor:
     def __init__(self, pdb_path, output_dir='./data/visualize'):
         self.pdb_path = pdb_path
         self.output_dir = output_dir
+        # Parent of the per-job working directories
         self.temp_dir = './temp_plip_files'
-        
+
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        if not os.path.exists(self.temp_dir):
-            os.makedirs(self.temp_dir)
-        
     def run_plip(self):
-        # Change to the temporary directory
-        os.chdir(self.temp_dir)
-        
-        # Execute the PLIP command
-        command = f'plip -f ../{self.pdb_path} -yv'
-        subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        os.chdir('../')
-        # Find the generated PSE file
-        pse_file = None
-        for file in os.listdir(self.temp_dir):
-            if file.endswith('.pse'):
-                pse_file = file
-                break
-        
-        if pse_file:
-            # Move the PSE file to the output directory
-            shutil.move(os.path.join(self.temp_dir,pse_file), os.path.join(self.output_dir, pse_file))
-            #print(f'Moved PSE file to {self.output_dir}/{pse_file}')
-        else:
-            print('PSE file not found.')
-
-        # Clean up the temporary directory
-        self.cleanup_temp_files()
-
-    def cleanup_temp_files(self):
-        # Remove all files in the temporary directory
-        for file in os.listdir(self.temp_dir):
-            file_path = os.path.join(self.temp_dir, file)
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
+        return visualize_complex(self.pdb_path, self.output_dir, self.temp_dir)
 
     def process(self):
-        self.run_plip()
+        return self.run_plip()
+
+
+class PLIPPool:
+    """Worker processes that render PLIP PyMOL sessions for many complexes in parallel.
+
+    Each worker handles one complex at a time in its own working directory.
+    A crash (PyMOL can segfault) breaks the pool; it is then replaced and the
+    unfinished complexes are retried one per process, so only the offending
+    complex is reported as failed. Several stage threads may share one pool.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Spawned, since the pipeline forks from a process that already runs threads
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def recycle(self, executor):
+        # Only the broken executor is replaced; another thread may already have recycled it
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def run_isolated(pdb_path, output_dir):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            try:
+                return executor.submit(visualize_complex, pdb_path, output_dir).result()
+            except BrokenProcessPool:
+                logging.error(f"PLIP worker crashed on {pdb_path}")
+            except Exception as e:
+                logging.error(f"Error visualizing {pdb_path}: {e}")
+        return []
+
+    def run(self, pdb_paths, output_dir='./data/visualize'):
+        """Visualise every complex; returns {pdb_path: [session paths]}, an empty list on failure."""
+        results = {pdb_path: [] for pdb_path in pdb_paths}
+        if not pdb_paths:
+            return results
+        executor = self.get_executor()
+        futures, crashed = {}, []
+        for pdb_path in pdb_paths:
+            try:
+                futures[executor.submit(visualize_complex, pdb_path, output_dir)] = pdb_path
+            except (BrokenProcessPool, RuntimeError):
+                # Broken by another complex, or shut down by another thread's recycle
+                crashed.append(pdb_path)
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (BrokenProcessPool, CancelledError):
+                # Cancelled when another thread recycled the shared executor
+                crashed.append(futures[future])
+            except Exception as e:
+                logging.error(f"Error visualizing {futures[future]}: {e}")
+        if crashed:
+            self.recycle(executor)
+            for pdb_path in crashed:
+                results[pdb_path] = self.run_isolated(pdb_path, output_dir)
+        return results
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
 
 if __name__ == "__main__":
     # Example usage
     pdb_id = input("Please enter the PDB ID: ")
     pdb_path = f'./data/pdb/{pdb_id}.pdb'
-    
+
     # Ensure the PDB file exists
     if not os.path.exists(pdb_path):
         print(f'PDB file {pdb_path} does not exist.')
         exit(1)
-    
+
     # Initialize and run the PLIP processor
     plip_processor = PLIPProcessor(pdb_path=pdb_path)
     plip_processor.process()
@@ -0,0 +1,180 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config.Tracer import Span
+
+
+class Stage:
+    """One step of the pipeline with its own worker pool.
+
+    ``kind`` names the bottleneck the pool is sized for:
+    ``network`` - threads waiting on remote services (default 8 workers),
+    ``cpu`` - pure-Python work run in worker processes (default one per core),
+    ``subprocess`` - threads driving work that already runs in child processes
+    or native code (default one per core),
+    ``serial`` - a single thread for steps that touch process-global state.
+    ``func`` takes a target and returns it (a copy, for ``cpu`` stages); it
+    must be picklable for ``cpu`` stages. ``outputs(target)`` lists the files
+    the stage produced, for the state ledger. ``fingerprint`` describes the
+    stage's own settings (budget, template, model, ...); the ledger folds it
+    into the input hash, so changing it reruns the stage.
+    """
+
+    DEFAULT_WORKERS = {
+        'network': lambda: 8,
+        'cpu': lambda: os.cpu_count() or 1,
+        'subprocess': lambda: os.cpu_count() or 1,
+        'serial': lambda: 1,
+    }
+
+    def __init__(self, name, func, kind='subprocess', workers=None, outputs=None, fingerprint=None):
+        if kind not in self.DEFAULT_WORKERS:
+            raise ValueError(f"Unknown stage kind: {kind}")
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.workers = workers or self.DEFAULT_WORKERS[kind]()
+        self.outputs = outputs
+        self.fingerprint = fingerprint
+
+    def make_executor(self):
+        if self.kind == 'cpu':
+            # Spawned workers, since forking a process that already runs stage threads is unsafe
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+
+
+def run_stage(func, target, name=None, kind=None):
+    # Measured inside the worker, so queueing time is not counted as stage time;
+    # a failure is returned on the span, together with its timing and counters
+    span = Span(target.pdb_id, name, kind)
+    try:
+        with span:
+            target = func(target)
+    except Exception:
+        pass
+    return target, span
+
+
+class Pipeline:
+    """Stream targets through a linear chain of stages inside one process.
+
+    A target moves to the next stage as soon as it leaves the previous one,
+    so the LLM call of one target overlaps with docking of an earlier one.
+    A stage that raises stops that target only; the error is kept on
+    ``target.error`` and the others continue. ``on_event(target, stage, status)``
+    is called with status ``start``, ``done``, ``skipped`` or ``failed``.
+    With a ``ledger`` (StateLedger) every stage run is recorded, and stages
+    already finished for the same input are skipped by restoring their state.
+    With a ``tracer`` (Tracer) the span of every stage run is collected.
+    ``resources`` are pools and stores the stages share across runs; ``close``
+    (or leaving a ``with`` block) shuts them down.
+    """
+
+    def __init__(self, stages, on_event=None, ledger=None, tracer=None, resources=None):
+        self.stages = stages
+        self.on_event = on_event
+        self.ledger = ledger
+        self.tracer = tracer
+        self.resources = list(resources or [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        # Executors are shut down, pools and stores closed; one failure does not keep the others open
+        resources, self.resources = self.resources, []
+        for resource in reversed(resources):
+            try:
+                if hasattr(resource, 'close'):
+                    resource.close()
+                else:
+                    resource.shutdown()
+            except Exception as e:
+                print(f'Failed to close {type(resource).__name__}: {e}')
+
+    def emit(self, target, stage, status):
+        if self.on_event is not None:
+            self.on_event(target, stage, status)
+
+    def run(self, targets):
+        targets = list(targets)
+        results = {}
+        remaining = [len(targets)]
+        finished = threading.Condition()
+        executors = {stage.name: stage.make_executor() for stage in self.stages}
+
+        def finish(target):
+            with finished:
+                results[target.pdb_id] = target
+                remaining[0] -= 1
+                finished.notify_all()
+
+        def submit(target, index):
+            while index < len(self.stages) and self.ledger is not None:
+                # Resume: skip every leading stage that already finished for this input
+                stage = self.stages[index]
+                state = self.ledger.finished_state(target.pdb_id, stage.name,
+                                                   self.ledger.input_hash(target, stage.fingerprint))
+                if state is None:
+                    break
+                vars(target).update(state)
+                if self.tracer is not None:
+                    self.tracer.record(target.pdb_id, stage.name, {}, kind=stage.kind, status='skipped')
+                self.emit(target, stage.name, 'skipped')
+                index += 1
+            if index == len(self.stages):
+                finish(target)
+                return
+            stage = self.stages[index]
+            input_hash = self.ledger.input_hash(target, stage.fingerprint) if self.ledger is not None else None
+            self.emit(target, stage.name, 'start')
+            try:
+                future = executors[stage.name].submit(run_stage, stage.func, target, stage.name, stage.kind)
+            except Exception as e:
+                fail(target, stage, input_hash, e, None)
+                return
+            future.add_done_callback(lambda f: advance(f, target, index, input_hash))
+
+        def fail(target, stage, input_hash, error, duration):
+            target.error = f'{stage.name}: {error}'
+            if self.ledger is not None:
+                self.ledger.record(target.pdb_id, stage.name, 'failed', input_hash, duration=duration, error=str(error))
+            self.emit(target, stage.name, 'failed')
+            finish(target)
+
+        def advance(future, target, index, input_hash):
+            stage = self.stages[index]
+            try:
+                target, span = future.result()
+            except Exception as e:
+                # The worker itself failed, e.g. a crashed process pool
+                fail(target, stage, input_hash, e, None)
+                return
+            if self.tracer is not None:
+                self.tracer.add(span)
+            duration = span.wall
+            if span.error is not None:
+                fail(target, stage, input_hash, span.error, duration)
+                return
+            if self.ledger is not None:
+                outputs = stage.outputs(target) if stage.outputs is not None else ()
+                self.ledger.record(target.pdb_id, stage.name, 'done', input_hash, outputs, duration,
+                                   state=self.ledger.state_of(target))
+            self.emit(target, stage.name, 'done')
+            submit(target, index + 1)
+
+        try:
+            for target in targets:
+                submit(target, 0)
+            with finished:
+                finished.wait_for(lambda: remaining[0] == 0)
+        finally:
+            for executor in executors.values():
+                executor.shutdown()
+        return results
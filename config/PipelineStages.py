@@ -0,0 +1,304 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config.PLIPProcessor import PLIPPool
+from config.PDBInteractionExtractor import PDBInteractionExtractor
+from config.PDBSummaryExtractor import PDBSummaryExtractor
+from config.TemplateFiller import TemplateFiller
+from config.CompoundConverter import CompoundConverter
+from config.CompoundCache import CompoundCache
+from config.LigandStore import LigandStore
+from config.ConformerPool import ConformerPool
+from config.PDBConverter import PDBConverter
+from config.PDBQTCombiner import PDBQTCombiner
+from config.Docking import DockingSession
+from config.DockingExecutor import DockingExecutor
+from config.Pipeline import Pipeline, Stage
+from config.AtomicFile import atomic_write
+from config.RCSBFetcher import get_fetcher
+from config.StructureSource import get_structure_source
+from config.MetadataIndex import get_metadata_index
+from config.InteractionStore import get_interaction_store
+from config.Tracer import count
+
+# Define paths for other resources
+template_path = './config/template.txt'
+summary_save_path = './data/summary/'
+spatial_information_save_path = './data/spatial_information/'
+fasta_save_path = './data/fasta/'
+question_save_path = './data/question/'
+
+
+class Target:
+    """State of one target as it moves through the pipeline stages."""
+
+    def __init__(self, pdb_id, box_mode='protein', pockets=1, docking_timeout=None, exhaustiveness=1):
+        self.pdb_id = pdb_id
+        self.box_mode = box_mode
+        self.pockets = pockets
+        self.docking_timeout = docking_timeout
+        self.exhaustiveness = exhaustiveness
+        self.pdb_path = f'./data/pdb/{pdb_id}.pdb'
+        self.fasta_path = f'./data/fasta/{pdb_id}.fasta'
+        self.question = None
+        self.answer = None
+        self.drugs = None
+        self.ligands = {}
+        self.receptor_pdbqt = None
+        self.docking = []
+        self.combined = {}
+        self.error = None
+        # Summary text for the prompt when not taken from the metadata index (custom targets)
+        self.summary = None
+        # Complex analysed by PLIP when it differs from the receptor (custom targets docked with a reference ligand)
+        self.interaction_path = None
+        # (tokens before, tokens after) when the prompt was compacted
+        self.prompt_tokens = None
+        # Digest of the target's summary row in the shared metadata index
+        self.summary_digest = None
+
+
+# Function to fetch PDB and FASTA files from the configured structure sources
+def download_files(pdb_id, save_root='./data/'):
+    pdb_path = f'{save_root}/pdb/{pdb_id}.pdb'
+    fasta_path = f'{save_root}/fasta/{pdb_id}.fasta'
+    source = get_structure_source()
+
+    if not os.path.exists(pdb_path):
+        text = source.read(pdb_id)
+        if text is not None:
+            with atomic_write(pdb_path) as file:
+                file.write(text)
+        else:
+            print(f'Failed to retrieve PDB file for {pdb_id}')
+
+    if not os.path.exists(fasta_path):
+        text = source.read_fasta(pdb_id)
+        if text is not None:
+            with atomic_write(fasta_path) as file:
+                file.write(text)
+        else:
+            print(f'Failed to retrieve FASTA file for {pdb_id}')
+
+    return pdb_path, fasta_path
+
+
+def prefetch_targets(pdb_ids, workers=None, tracer=None):
+    # Fetch structures, FASTA and summaries of a whole batch concurrently before compute starts
+    fetcher = get_fetcher()
+    before, started = dict(fetcher.stats), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or get_fetcher().workers, thread_name_prefix='prefetch') as executor:
+        jobs = [executor.submit(download_files, pdb_id) for pdb_id in pdb_ids]
+        # Metadata for the whole batch in a few structured requests
+        jobs.append(executor.submit(get_metadata_index().fetch, pdb_ids))
+    for job in jobs:
+        if job.exception() is not None:
+            print(f'Prefetch failed: {job.exception()}')
+    if tracer is not None:
+        # Pool threads run outside any stage span, so the fetcher's own totals are recorded
+        tracer.record('*', 'prefetch', {'http_requests': fetcher.stats['requests'] - before['requests'],
+                                        'bytes_fetched': fetcher.stats['bytes'] - before['bytes'],
+                                        'failed': sum(job.exception() is not None for job in jobs)},
+                      wall=time.perf_counter() - started, kind='network')
+
+
+# Function to save formatted data to CSV
+def save_data_to_csv(data, file_name, energy=False):
+    csv_columns = ['ranking', 'name', 'explanation']
+    if energy:
+        csv_columns = ['ranking', 'name', 'explanation', 'energy']
+    with atomic_write(file_name, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=csv_columns, extrasaction='ignore')
+        writer.writeheader()
+        for item in data:
+            writer.writerow(item)
+
+
+def stage_download(target):
+    target.pdb_path, target.fasta_path = download_files(target.pdb_id)
+    if not os.path.exists(target.pdb_path):
+        raise RuntimeError(f"PDB file for {target.pdb_id} could not be downloaded")
+    return target
+
+
+def stage_summary(target):
+    summary_extractor = PDBSummaryExtractor(summary_folder=summary_save_path)
+    summary = summary_extractor.fetch_summaries([target.pdb_id])[target.pdb_id]
+    if summary is None:
+        print(f'No summary metadata for {target.pdb_id}')
+    else:
+        # Kept in the target state instead of the shared index file, which every other target also writes
+        payload = json.dumps(summary, sort_keys=True, default=str)
+        target.summary_digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return target
+
+
+def stage_interaction(target, site_executor=None):
+    interaction_extractor = PDBInteractionExtractor(pdb_path=target.interaction_path or target.pdb_path,
+                                                    spatial_information_folder=spatial_information_save_path,
+                                                    executor=site_executor, name=target.pdb_id)
+    interaction_extractor.process_and_save()
+    return target
+
+
+def make_template_filler(token_budget=None, save_prompts=False):
+    # One filler per run, shared by every target; data/question/ copies are written for audit only
+    return TemplateFiller(template_path, summary_save_path, spatial_information_save_path, fasta_save_path,
+                          question_save_path, metadata_index=get_metadata_index(), token_budget=token_budget,
+                          save=save_prompts)
+
+
+def stage_template(target, filler=None):
+    # Prompts go to the LLM stage in memory
+    filler = filler or make_template_filler()
+    summaries = {target.pdb_id: target.summary} if target.summary is not None else None
+    prompt, target.prompt_tokens = filler.render_many([target.pdb_id], summaries)[target.pdb_id]
+    if target.prompt_tokens:
+        count('tokens_before_compaction', target.prompt_tokens[0])
+        count('tokens_after_compaction', target.prompt_tokens[1])
+    target.question = prompt.replace("\n", " ")
+    return target
+
+
+def stage_llm(target, llm_stage):
+    # Invalid answers are re-asked inside the LLM stage, without redoing the stages above
+    # Every target's question goes to the one event loop and client of the LLM stage
+    answer, drugs = llm_stage.submit(target.question).result()
+    with atomic_write(f'./data/answer/{target.pdb_id}.txt', 'w', encoding='utf-8') as f:
+        f.write(answer)
+    if drugs is None:
+        raise RuntimeError(f"No valid answer for {target.pdb_id}")
+    target.answer = answer
+    target.drugs = drugs
+    save_data_to_csv(drugs, f'./data/answer/{target.pdb_id}.csv')
+    return target
+
+
+def stage_ligands(target, conformer_pool=None, compound_cache=None, ligand_store=None):
+    converter = CompoundConverter(output_dir='./data/drug_pdbqt', compound_cache=compound_cache,
+                                  conformer_pool=conformer_pool, ligand_store=ligand_store)
+    try:
+        target.ligands = converter.process_many([drug['name'] for drug in target.drugs])
+    finally:
+        # What was opened just for this call is closed with it; shared ones belong to the pipeline
+        if compound_cache is None:
+            converter.compound_cache.close()
+        if ligand_store is None:
+            converter.ligand_store.close()
+        if conformer_pool is None:
+            converter.conformer_pool.close()
+    count('ligands_failed', sum(not sign for sign in target.ligands.values()))
+    return target
+
+
+def stage_receptor(target):
+    converter = PDBConverter(pdb_path=target.pdb_path, pdbqt_path=f'./data/rec_pdbqt/{target.pdb_id}.pdbqt')
+    target.receptor_pdbqt = converter.convert_pdb_to_pdbqt()
+    return target
+
+
+def stage_docking(target, cpu_budget=None, ligand_store=None):
+    docking_session = DockingSession(protein=target.pdb_id, exhaustiveness=target.exhaustiveness,
+                                     box_mode=target.box_mode, top_n=target.pockets, pdb_path=target.pdb_path,
+                                     ligand_store=ligand_store)
+    executor = DockingExecutor(cpu_budget=cpu_budget, timeout=target.docking_timeout)
+    try:
+        target.docking = executor.run(docking_session, [drug['name'] for drug in target.drugs])
+    finally:
+        if ligand_store is None and docking_session.ligand_store is not None:
+            docking_session.ligand_store.close()
+    for drug, result in zip(target.drugs, target.docking):
+        drug['energy'] = result['score']
+    return target
+
+
+def stage_combine(target):
+    # The receptor is converted once per target; the poses are combined in parallel
+    jobs = {}
+    for drug in target.drugs:
+        score = drug.get('energy')
+        if score is not None and float(score) < 0:
+            drugname = drug['name']
+            jobs[f'./data/dock_result/{target.pdb_id}_{drugname}.pdbqt'] = (drugname, f'./data/combined_result/{target.pdb_id}_{drugname}.pdb')
+    combiner = PDBQTCombiner(f'./data/rec_pdbqt/{target.pdb_id}.pdbqt')
+    combined = combiner.combine_many({ligand: output for ligand, (_, output) in jobs.items()})
+    for ligand, (drugname, _) in jobs.items():
+        if combined[ligand] is not None:
+            target.combined[drugname] = combined[ligand]
+        else:
+            count('combine_failed')
+    return target
+
+
+def stage_visualize(target, plip_pool):
+    # All docked complexes of the target are visualised in parallel, one process each
+    sessions = plip_pool.run(list(target.combined.values()), output_dir='./result/visualize')
+    count('pymol_sessions', sum(len(paths) for paths in sessions.values()))
+    count('visualize_failed', sum(not paths for paths in sessions.values()))
+    save_data_to_csv(target.drugs, f'./result/csv/{target.pdb_id}.csv', energy=True)
+    return target
+
+
+# Files each stage leaves behind, recorded in the state ledger
+STAGE_OUTPUTS = {
+    'download': lambda t: [t.pdb_path, t.fasta_path],
+    # The summary row lives in the shared metadata index; its digest is part of the target state
+    'summary': lambda t: [],
+    'plip': lambda t: get_interaction_store().paths(t.pdb_id),
+    # The prompt itself is kept in the ledger state; the audit copy is added with save_prompts
+    'template': lambda t: [],
+    'llm': lambda t: [f'./data/answer/{t.pdb_id}.txt', f'./data/answer/{t.pdb_id}.csv'],
+    'ligands': lambda t: [f'./data/drug_pdbqt/{name}.pdbqt' for name, sign in t.ligands.items() if sign],
+    'receptor': lambda t: [t.receptor_pdbqt],
+    'dock': lambda t: [f'./data/dock_result/{t.pdb_id}_{drug["name"]}.pdbqt' for drug in t.drugs
+                       if drug.get('energy') is not None],
+    'combine': lambda t: list(t.combined.values()),
+    'visualize': lambda t: [f'./result/csv/{t.pdb_id}.csv'],
+}
+
+
+def build_pipeline(llm_stage, workers=None, cpu_budget=None, on_event=None, ledger=None, token_budget=None,
+                   save_prompts=False, tracer=None):
+    """The DrugReAlign stage chain; ``workers`` overrides pool sizes by stage name."""
+    workers = workers or {}
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    docking_workers = workers.get('dock', 2)
+    conformer_pool = ConformerPool()
+    # One compound cache and ligand store for all targets, instead of a connection per target
+    compound_cache = CompoundCache()
+    ligand_store = LigandStore()
+    plip_pool = PLIPPool(workers.get('plip_visualize'))
+    # Binding sites of all targets are characterised on one pool of spawned processes
+    site_executor = ProcessPoolExecutor(max_workers=workers.get('plip_sites', os.cpu_count() or 1),
+                                        mp_context=multiprocessing.get_context('spawn'))
+    filler = make_template_filler(token_budget, save_prompts)
+    stages = [
+        Stage('download', stage_download, 'network', workers.get('download')),
+        Stage('summary', stage_summary, 'network', workers.get('summary')),
+        Stage('plip', functools.partial(stage_interaction, site_executor=site_executor), 'subprocess', workers.get('plip', 2)),
+        # A changed budget or template.txt reruns the template stage, and the new prompt the LLM stage
+        Stage('template', functools.partial(stage_template, filler=filler), 'serial', workers.get('template'),
+              fingerprint=filler.fingerprint()),
+        Stage('llm', functools.partial(stage_llm, llm_stage=llm_stage), 'network', workers.get('llm'),
+              fingerprint={'model': llm_stage.model, 'params': llm_stage.params}),
+        Stage('ligands', functools.partial(stage_ligands, conformer_pool=conformer_pool, compound_cache=compound_cache,
+                                           ligand_store=ligand_store), 'subprocess', workers.get('ligands', 2)),
+        Stage('receptor', stage_receptor, 'cpu', workers.get('receptor')),
+        # Concurrent targets share the core budget for their docking workers
+        Stage('dock', functools.partial(stage_docking, cpu_budget=max(1, cpu_budget // docking_workers),
+                                        ligand_store=ligand_store), 'subprocess', docking_workers),
+        Stage('combine', stage_combine, 'subprocess', workers.get('combine', 2)),
+        Stage('visualize', functools.partial(stage_visualize, plip_pool=plip_pool), 'subprocess', workers.get('visualize', 2)),
+    ]
+    for stage in stages:
+        stage.outputs = STAGE_OUTPUTS[stage.name]
+        if stage.name == 'template' and save_prompts:
+            stage.outputs = lambda t: [os.path.join(question_save_path, f'{t.pdb_id}.txt')]
+    # The pools live as long as the pipeline and are shut down by Pipeline.close
+    return Pipeline(stages, on_event=on_event, ledger=ledger, tracer=tracer,
+                    resources=[conformer_pool, compound_cache, ligand_store, plip_pool, site_executor])
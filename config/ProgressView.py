@@ -0,0 +1,157 @@
+import sys
+import json
+import time
+import threading
+import collections
+from rich.console import Console, Group
+from rich.live import Live
+from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
+from rich.table import Table
+
+STAGE_LABELS = {
+    'prepare': 'Preparing custom structures',
+    'download': 'Downloading PDB and FASTA files',
+    'summary': 'Fetching PDB summary',
+    'plip': 'Processing spatial interaction data',
+    'template': 'Filling question template',
+    'llm': 'Interacting with ChatGPT',
+    'ligands': 'Converting drug data format',
+    'receptor': 'Converting PDB to PDBQT',
+    'dock': 'Executing docking',
+    'combine': 'Combining docked complexes',
+    'visualize': 'Rendering PLIP sessions',
+}
+
+
+class LiveProgress:
+    """One ``rich`` display, redrawn in place by ``Live`` at a fixed rate.
+
+    There is a bar per stage, counting targets over the whole batch with
+    the number running and failed, and below it the latest log lines.
+    Events and log calls only update state; drawing happens on Live's
+    refresh thread, so a burst of messages costs no extra redraws.
+    Use it as the pipeline's ``on_event`` callback inside ``with``.
+    """
+
+    def __init__(self, stages, total=1, console=None, log_lines=4, refresh_per_second=4):
+        self.console = console or Console()
+        self.progress = Progress(
+            SpinnerColumn(),
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+            console=self.console,
+        )
+        self.tasks = {stage: self.progress.add_task(self.describe(stage, 0, 0), total=total) for stage in stages}
+        self.running = collections.Counter()
+        self.failed = collections.Counter()
+        self.logs = collections.deque(maxlen=log_lines)
+        self.lock = threading.Lock()
+        self.live = Live(get_renderable=self.render, console=self.console, refresh_per_second=refresh_per_second)
+
+    @staticmethod
+    def describe(stage, running, failed):
+        text = f"[#00A6ED]{STAGE_LABELS.get(stage, stage)}"
+        if running:
+            text += f" [white]({running} running)"
+        if failed:
+            text += f" [red]({failed} failed)"
+        return text
+
+    def render(self):
+        table = Table.grid()
+        table.add_column("Log", style="#f69b7e")
+        with self.lock:
+            for message in self.logs:
+                table.add_row(message)
+        return Group(self.progress, table)
+
+    def __call__(self, target, stage, status):
+        if stage not in self.tasks:
+            return
+        with self.lock:
+            if status == 'start':
+                self.running[stage] += 1
+            elif status == 'done':
+                self.running[stage] -= 1
+            elif status == 'failed':
+                self.running[stage] -= 1
+                self.failed[stage] += 1
+                self.logs.append(f"{target.pdb_id}: {target.error}")
+            running, failed = self.running[stage], self.failed[stage]
+        advance = 1 if status in ('done', 'skipped', 'failed') else 0
+        self.progress.update(self.tasks[stage], advance=advance, description=self.describe(stage, running, failed))
+
+    def log(self, message):
+        with self.lock:
+            self.logs.append(message)
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.live.stop()
+        return False
+
+
+class LineLog:
+    """One line per event for runs without a terminal: batch subprocesses, CI, log files.
+
+    ``text`` lines read ``time target stage status``; ``json`` writes one
+    object per line for log collectors.
+    """
+
+    def __init__(self, stream=None, format='text'):
+        self.stream = stream or sys.stdout
+        self.format = format
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **record}
+        if self.format == 'json':
+            line = json.dumps(record, default=str)
+        else:
+            line = ' '.join(str(value) for value in record.values() if value is not None)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def __call__(self, target, stage, status):
+        self.write({'target': target.pdb_id, 'stage': stage, 'status': status,
+                    'error': target.error if status == 'failed' else None})
+
+    def log(self, message):
+        self.write({'message': message})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def make_progress(stages, total=1, mode=None, console=None):
+    """``live``, ``lines`` or ``json``; by default live on a terminal and lines otherwise."""
+    console = console or Console()
+    mode = mode or ('live' if console.is_terminal else 'lines')
+    if mode == 'live':
+        return LiveProgress(stages, total, console=console)
+    return LineLog(format='json' if mode == 'json' else 'text')
+
+
+# Example: three targets moving through two stages
+if __name__ == '__main__':
+    class Example:
+        def __init__(self, pdb_id):
+            self.pdb_id = pdb_id
+            self.error = None
+
+    with make_progress(['download', 'plip'], total=3) as view:
+        for pdb_id in ('1A0I', '1B7F', '1C8K'):
+            for stage in ('download', 'plip'):
+                view(Example(pdb_id), stage, 'start')
+                time.sleep(0.3)
+                view(Example(pdb_id), stage, 'done')
+            view.log(f"Finished {pdb_id}")
@@ -0,0 +1,157 @@
+import re
+import math
+import logging
+import functools
+from config.InteractionStore import INTERACTION_TYPES, PROMPT_COLUMNS, COORD_COLUMNS, render_tables
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Distance each interaction type is ranked by: closest contacts are kept first
+RANK_COLUMNS = {'hydrophobic': 'DIST', 'hbond': 'DIST_D-A', 'pistacking': 'CENTDIST'}
+# One row per residue and interaction type
+RESIDUE_KEY = ['RESCHAIN', 'RESNR', 'RESTYPE']
+# Explains the count column the compacted tables add
+COUNT_NOTE = 'N = number of contacts of the residue; only the closest is listed.\n'
+
+
+@functools.lru_cache(maxsize=4)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+@functools.lru_cache(maxsize=1)
+def _warn_estimate():
+    logging.warning("tiktoken is not installed: token counts and --token_budget use an estimate "
+                    "(words and punctuation), not the model's tokens")
+
+
+def count_tokens(text, model='gpt-4o'):
+    """Tokens of ``text`` for ``model``; without tiktoken, words and punctuation marks are counted."""
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    _warn_estimate()
+    return len(re.findall(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]", text))
+
+
+def dedupe_fasta(text):
+    """Merge FASTA records with identical sequences: the first header lists the chains that repeat it."""
+    records = []
+    for block in text.split('>')[1:]:
+        header, _, sequence = block.partition('\n')
+        records.append((header.strip(), sequence))
+    by_sequence = {}
+    for header, sequence in records:
+        key = re.sub(r'\s+', '', sequence)
+        by_sequence.setdefault(key, []).append((header, sequence))
+    output = ''
+    for group in by_sequence.values():
+        header, sequence = group[0]
+        if len(group) > 1:
+            header += ' (identical: ' + ', '.join(other.split('|')[0] for other, _ in group[1:]) + ')'
+        output += f'>{header}\n{sequence.strip()}\n'
+    return output
+
+
+class PromptCompactor:
+    """Fit a filled template into a token budget.
+
+    Identical chains are listed once in the sequence section. Each residue
+    keeps only its closest contact per interaction type (with the number of
+    collapsed contacts in ``N``, explained by ``COUNT_NOTE`` above the
+    tables), coordinates are rounded, and rows are
+    ranked by distance. If the prompt is still over budget, the most distant
+    rows of every type are dropped, the same share from each type, but at
+    least ``min_rows`` of each type are kept even if the budget is exceeded.
+    """
+
+    def __init__(self, token_budget=None, model='gpt-4o', decimals=1, columns=None, min_rows=3):
+        self.token_budget = token_budget
+        self.model = model
+        self.decimals = decimals
+        self.columns = columns or PROMPT_COLUMNS
+        self.min_rows = min_rows
+
+    def count(self, text):
+        return count_tokens(text, self.model)
+
+    def compact_table(self, interaction_type, df):
+        df = df.copy()
+        for column in COORD_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].map(lambda coords: tuple(round(float(x), self.decimals) for x in coords))
+        rank = RANK_COLUMNS.get(interaction_type)
+        if rank in df.columns:
+            df = df.sort_values(rank, kind='stable')
+        key = [column for column in RESIDUE_KEY if column in df.columns]
+        if key:
+            counts = df.groupby(key, sort=False)[key[0]].transform('size')
+            df = df.assign(N=counts).drop_duplicates(key, keep='first')
+        return df.reset_index(drop=True)
+
+    def compact_tables(self, tables):
+        return {key: self.compact_table(key, df) for key, df in tables.items() if df is not None and len(df) > 0}
+
+    def columns_with_count(self):
+        return {key: list(columns) + ['N'] for key, columns in self.columns.items()}
+
+    def render_compacted(self, tables):
+        text = render_tables(tables, self.columns_with_count())
+        return COUNT_NOTE + text if text else text
+
+    def trim(self, tables, available):
+        """Keep the closest rows of every type that fit into ``available`` tokens (at least ``min_rows`` each)."""
+        text = self.render_compacted(tables)
+        if self.count(text) <= available:
+            return text
+        low, high = 0.0, 1.0
+        best = self.render_compacted({key: df.head(self.min_rows) for key, df in tables.items()})
+        # Binary search on the share of rows kept per type
+        for _ in range(12):
+            share = (low + high) / 2
+            kept = {key: df.head(max(self.min_rows, math.ceil(len(df) * share))) for key, df in tables.items()}
+            candidate = self.render_compacted(kept)
+            if self.count(candidate) <= available:
+                low, best = share, candidate
+            else:
+                high = share
+        return best
+
+    def build(self, template, summary, sequence, tables=None, atom_text=''):
+        """Returns (prompt, tokens before compaction, tokens after).
+
+        ``template`` is a CompiledTemplate; ``tables`` are the stored interaction tables; without them the
+        interaction text ``atom_text`` is used as it is.
+        """
+        full_atom = render_tables(tables, self.columns) if tables else atom_text
+        original = template.render(summary, sequence, full_atom)
+        before = self.count(original)
+        sequence = dedupe_fasta(sequence) if sequence.lstrip().startswith('>') else sequence
+        if tables:
+            compacted = self.compact_tables(tables)
+            if self.token_budget is None:
+                atom = self.render_compacted(compacted)
+            else:
+                available = self.token_budget - self.count(template.render(summary, sequence, ''))
+                atom = self.trim(compacted, max(0, available))
+        else:
+            atom = atom_text
+        prompt = template.render(summary, sequence, atom)
+        return prompt, before, self.count(prompt)
+
+
+# Example: compact the prompt of a stored target to 4000 tokens
+if __name__ == '__main__':
+    from config.InteractionStore import get_interaction_store
+    from config.TemplateFiller import load_template
+    store = get_interaction_store()
+    pdb_id = '5HXB'
+    tables = {key: store.read(pdb_id, key) for key in INTERACTION_TYPES}
+    template = load_template('./config/template.txt')
+    prompt, before, after = PromptCompactor(token_budget=4000).build(template, '', '', tables)
+    print(f'{pdb_id}: {before} -> {after} tokens')
@@ -0,0 +1,137 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config.AtomicFile import atomic_write
+from config.Tracer import count
+
+RCSB_FILES_URL = 'https://files.rcsb.org'
+RCSB_URL = 'https://www.rcsb.org'
+RCSB_SEARCH_URL = 'https://search.rcsb.org'
+
+
+class RCSBFetcher:
+    """Pooled HTTP access to RCSB PDB files, FASTA, metadata and search.
+
+    One keep-alive ``requests.Session`` is shared by all threads, with a
+    connection pool sized to ``workers``, a ``timeout`` on every call and
+    retries with backoff on connection errors, 429 and 5xx responses.
+    Responses are requested gzip-compressed. The base URLs can be pointed at
+    a local stand-in (see benchmark/fixture_server.py) through
+    DRUGREALIGN_RCSB_FILES_URL, DRUGREALIGN_RCSB_URL, DRUGREALIGN_RCSB_SEARCH_URL
+    and DRUGREALIGN_RCSB_GRAPHQL_URL.
+    """
+
+    def __init__(self, files_url=None, www_url=None, search_url=None, workers=8, timeout=30, retries=4):
+        self.files_url = (files_url or os.environ.get('DRUGREALIGN_RCSB_FILES_URL') or RCSB_FILES_URL).rstrip('/')
+        self.www_url = (www_url or os.environ.get('DRUGREALIGN_RCSB_URL') or RCSB_URL).rstrip('/')
+        self.search_url = (search_url or os.environ.get('DRUGREALIGN_RCSB_SEARCH_URL') or RCSB_SEARCH_URL).rstrip('/')
+        self.workers = workers
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None, respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        # Requests and response bytes (decompressed) since creation
+        self.stats = {'requests': 0, 'bytes': 0}
+        self.stats_lock = threading.Lock()
+
+    def account(self, response):
+        size = len(response.content)
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+        count('http_requests')
+        count('bytes_fetched', size)
+
+    def pdb_url(self, pdb_id):
+        return f'{self.files_url}/download/{pdb_id}.pdb'
+
+    def fasta_url(self, pdb_id):
+        return f'{self.www_url}/fasta/entry/{pdb_id}'
+
+    def get(self, url):
+        # Returns the response, or None after printing the failure like the callers used to
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f'Failed to retrieve {url}: {e}')
+            return None
+        self.account(response)
+        if response.status_code != 200:
+            print(f'Failed to retrieve {url}: {response.status_code}')
+            return None
+        return response
+
+    def post(self, url, json):
+        try:
+            response = self.session.post(url, json=json, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f'Failed to post to {url}: {e}')
+            return None
+        self.account(response)
+        return response
+
+    def download(self, url, path):
+        """Save ``url`` to ``path`` unless it already exists. Returns True if the file is there."""
+        if os.path.exists(path):
+            return True
+        response = self.get(url)
+        if response is None:
+            return False
+        with atomic_write(path) as file:
+            file.write(response.text)
+        return True
+
+    def download_pdb(self, pdb_id, path):
+        return self.download(self.pdb_url(pdb_id), path)
+
+    def download_fasta(self, pdb_id, path):
+        return self.download(self.fasta_url(pdb_id), path)
+
+    def prefetch(self, pdb_ids, save_root='./data/', metadata_index=None):
+        """Download PDB and FASTA files for all ``pdb_ids`` concurrently and index their metadata.
+
+        At most ``workers`` requests are in flight. Files already on disk are
+        skipped. Returns {pdb_id: True if structure, FASTA and metadata are present}.
+        """
+        from config.MetadataIndex import MetadataIndex
+        metadata_index = metadata_index or MetadataIndex(db_path=os.path.join(save_root, 'pdb_metadata.sqlite'), fetcher=self)
+        pdb_ids = list(dict.fromkeys(pdb_ids))
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch') as executor:
+            metadata = executor.submit(metadata_index.fetch, pdb_ids)
+            files = [(pdb_id, executor.submit(self.download_pdb, pdb_id, f'{save_root}/pdb/{pdb_id}.pdb'),
+                      executor.submit(self.download_fasta, pdb_id, f'{save_root}/fasta/{pdb_id}.fasta'))
+                     for pdb_id in pdb_ids]
+        summaries = metadata.result()
+        return {pdb_id: pdb_job.result() and fasta_job.result() and summaries.get(pdb_id) is not None
+                for pdb_id, pdb_job, fasta_job in files}
+
+    def close(self):
+        self.session.close()
+
+
+_shared_fetcher = None
+_shared_lock = threading.Lock()
+
+
+def get_fetcher():
+    """The process-wide fetcher, so every caller shares one connection pool."""
+    global _shared_fetcher
+    with _shared_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = RCSBFetcher()
+        return _shared_fetcher
+
+
+# Example: prefetch everything for a batch input file
+if __name__ == '__main__':
+    import csv
+    with open('./batch_input/DrugReAlign/input.csv') as f:
+        pdb_ids = [row[0].strip() for row in csv.reader(f) if row]
+    print(get_fetcher().prefetch(pdb_ids))
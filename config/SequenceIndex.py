@@ -0,0 +1,343 @@
+import os
+import gzip
+import json
+import shutil
+import threading
+import numpy as np
+from config.Tracer import count
+
+ALPHABET = 'ARNDCQEGHILKMFPSTWYVBZX'
+# BLOSUM62 in ALPHABET order
+BLOSUM62 = """
+ 4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0 -2 -1  0
+-1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3 -1  0 -1
+-2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3  3  0 -1
+-2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3  4  1 -1
+ 0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1 -3 -3 -2
+-1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2  0  3 -1
+-1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2  1  4 -1
+ 0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3 -1 -2 -1
+-2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3  0  0 -1
+-1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3 -3 -3 -1
+-1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1 -4 -3 -1
+-1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2  0  1 -1
+-1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1 -3 -1 -1
+-2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1 -3 -3 -1
+-1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2 -2 -1 -2
+ 1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2  0  0  0
+ 0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0 -1 -1  0
+-3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3 -4 -3 -2
+-2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1 -3 -2 -1
+ 0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4 -3 -2 -1
+-2 -1  3  4 -3  0  1 -1  0 -3 -4  0 -3 -3 -2  0 -1 -4 -3 -3  4  1 -1
+-1  0  0  1 -3  3  4 -2  0 -3 -3  1 -1 -3 -1  0 -1 -3 -2 -2  1  4 -1
+ 0 -1 -1 -1 -2 -1 -1 -1 -1 -1 -1 -1 -1 -1 -2  0  0 -2 -1 -1 -1 -1 -1
+"""
+PAD = len(ALPHABET)
+# One extra row/column for padding, scoring low enough that no alignment runs into it
+SCORES = np.full((PAD + 1, PAD + 1), -1000, dtype=np.int32)
+SCORES[:PAD, :PAD] = np.array(BLOSUM62.split(), dtype=np.int32).reshape(PAD, PAD)
+# Byte -> residue code; unknown letters (U, O, *, ...) count as X
+ENCODE = np.full(256, ALPHABET.index('X'), dtype=np.uint8)
+for _code, _letter in enumerate(ALPHABET):
+    ENCODE[ord(_letter)] = ENCODE[ord(_letter.lower())] = _code
+# Odd multiplier that scrambles k-mer codes, so minimisers are not biased towards A-rich k-mers
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+SEQRES_URL = '/pub/pdb/derived_data/pdb_seqres.txt'
+
+
+def encode(sequence):
+    return ENCODE[np.frombuffer(''.join(sequence.split()).encode('ascii', 'replace'), dtype=np.uint8)]
+
+
+def kmer_codes(codes, k):
+    """Code of the k-mer starting at every position (len(codes) - k + 1 of them)."""
+    codes = codes.astype(np.int64)
+    size = len(codes) - k + 1
+    if size <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kmers = np.zeros(size, dtype=np.int64)
+    for offset in range(k):
+        kmers = kmers * PAD + codes[offset:offset + size]
+    return kmers
+
+
+def minimiser_positions(kmers, w):
+    """Position of the k-mer of lowest hash in every window of ``w`` consecutive k-mers."""
+    if len(kmers) < w:
+        return np.zeros(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(kmers.astype(np.uint64) * HASH_MULTIPLIER, w)
+    return np.argmin(windows, axis=1) + np.arange(len(windows))
+
+
+def read_fasta(path, proteins_only=True):
+    """(id, sequence) records of a FASTA file (plain or .gz), e.g. the wwPDB ``pdb_seqres.txt``.
+
+    With ``proteins_only``, seqres records other than ``mol:protein`` are skipped.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    name, keep, lines = None, False, []
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith('>'):
+                if name is not None and keep:
+                    yield name, ''.join(lines)
+                fields = line[1:].split()
+                name = fields[0].upper() if fields else ''
+                keep = not proteins_only or 'mol:' not in line or 'mol:protein' in line
+                lines = []
+            else:
+                lines.append(line.strip())
+    if name is not None and keep:
+        yield name, ''.join(lines)
+
+
+def smith_waterman_scores(query, targets, gap=5):
+    """Best local alignment score of ``query`` against every row of ``targets`` (padded with PAD).
+
+    The rows are scored together, one query residue at a time. With a linear
+    gap penalty the horizontal dependency within a row is a running maximum:
+    H[j] = max_k (T[k] - gap * (j - k)) = cummax(T + gap * j) - gap * j.
+    """
+    profile = SCORES[query]
+    columns = np.arange(1, targets.shape[1] + 1, dtype=np.int32) * gap
+    previous = np.zeros((targets.shape[0], targets.shape[1] + 1), dtype=np.int32)
+    current = np.zeros_like(previous)
+    best = np.zeros(targets.shape[0], dtype=np.int32)
+    for i in range(len(query)):
+        cells = np.maximum(previous[:, :-1] + profile[i][targets], previous[:, 1:] - gap)
+        np.maximum(cells, 0, out=cells)
+        current[:, 1:] = np.maximum.accumulate(cells + columns, axis=1) - columns
+        np.maximum(best, current.max(axis=1), out=best)
+        previous, current = current, previous
+    return best
+
+
+def smith_waterman_alignment(query, target, gap=5):
+    """Full Smith-Waterman matrix and traceback of one pair: score, identity and the aligned ranges."""
+    columns = np.arange(1, len(target) + 1, dtype=np.int32) * gap
+    matrix = np.zeros((len(query) + 1, len(target) + 1), dtype=np.int32)
+    profile = SCORES[query]
+    for i in range(len(query)):
+        cells = np.maximum(matrix[i, :-1] + profile[i][target], matrix[i, 1:] - gap)
+        np.maximum(cells, 0, out=cells)
+        matrix[i + 1, 1:] = np.maximum.accumulate(cells + columns) - columns
+    i, j = np.unravel_index(matrix.argmax(), matrix.shape)
+    score = int(matrix[i, j])
+    query_end, target_end = int(i), int(j)
+    matches = length = 0
+    while i > 0 and j > 0 and matrix[i, j] > 0:
+        if matrix[i, j] == matrix[i - 1, j - 1] + SCORES[query[i - 1], target[j - 1]]:
+            matches += int(query[i - 1] == target[j - 1])
+            i, j = i - 1, j - 1
+        elif matrix[i, j] == matrix[i - 1, j] - gap:
+            i -= 1
+        else:
+            j -= 1
+        length += 1
+    return {'score': score, 'matches': matches, 'alignment_length': length,
+            'query_range': (int(i) + 1, query_end), 'target_range': (int(j) + 1, target_end)}
+
+
+class SequenceIndex:
+    """Local similarity search over a protein sequence set, e.g. all PDB chains (``pdb_seqres.txt``).
+
+    Identical chains are stored once. ``build`` writes a folder of NumPy
+    arrays: the encoded sequences and an inverted index of their (k, w)
+    minimisers, which are memory-mapped when the index is opened. A query
+    counts shared minimisers to pick ``candidates`` sequences, scores them
+    all with a vectorised Smith-Waterman (BLOSUM62, linear gap) and runs
+    the traceback only for the best hits, to report identity and coverage.
+    """
+
+    def __init__(self, path='./data/seq_index'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.k, self.w = self.meta['k'], self.meta['w']
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+        self.sequences = load('sequences.npy')
+        self.offsets = load('offsets.npy')
+        self.kmers = load('kmers.npy')
+        self.kmer_starts = load('kmer_starts.npy')
+        self.postings = load('postings.npy')
+        with open(os.path.join(path, 'ids.txt'), 'r', encoding='utf-8') as f:
+            self.ids = [line.split() for line in f]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, fasta_path, path='./data/seq_index', k=5, w=4, proteins_only=True, chunk_residues=4000000):
+        """Index every sequence of ``fasta_path``; the folder is replaced only once the new index is complete."""
+        unique = {}
+        for name, sequence in read_fasta(fasta_path, proteins_only):
+            sequence = sequence.upper()
+            if len(sequence) >= k:
+                unique.setdefault(sequence, []).append(name)
+        sequences = list(unique)
+        lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        encoded = encode(''.join(sequences))
+
+        # Minimisers of all sequences, a few million residues at a time, as unique (k-mer, sequence) keys
+        keys, start = [], 0
+        while start < len(sequences):
+            stop = int(np.searchsorted(offsets, offsets[start] + chunk_residues, side='right'))
+            stop = min(max(stop - 1, start + 1), len(sequences))
+            kmers = kmer_codes(encoded[offsets[start]:offsets[stop]], k)
+            owner = np.repeat(np.arange(start, stop), lengths[start:stop])[:len(kmers)]
+            position = np.arange(len(kmers)) + offsets[start]
+            # A window is used only if all its k-mers lie inside one sequence
+            valid = position + k + w - 1 <= offsets[owner + 1]
+            short = np.flatnonzero(lengths[start:stop] < k + w - 1) + start
+            positions = minimiser_positions(kmers, w)
+            chosen = positions[valid[:len(positions)]]
+            keys.append(kmers[chosen] * len(sequences) + owner[chosen])
+            for index in short:
+                # Too short for a full window: every k-mer is indexed
+                own = kmer_codes(encoded[offsets[index]:offsets[index + 1]], k)
+                keys.append(own * len(sequences) + index)
+            start = stop
+        keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
+        kmers, first = np.unique(keys // max(len(sequences), 1), return_index=True)
+
+        tmp_path = path.rstrip('/\\') + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'sequences.npy'), encoded)
+        np.save(os.path.join(tmp_path, 'offsets.npy'), offsets)
+        np.save(os.path.join(tmp_path, 'kmers.npy'), kmers.astype(np.int64))
+        np.save(os.path.join(tmp_path, 'kmer_starts.npy'), np.append(first, len(keys)).astype(np.int64))
+        np.save(os.path.join(tmp_path, 'postings.npy'), (keys % max(len(sequences), 1)).astype(np.int32))
+        with open(os.path.join(tmp_path, 'ids.txt'), 'w', encoding='utf-8') as f:
+            for sequence in sequences:
+                f.write(' '.join(unique[sequence]) + '\n')
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'k': k, 'w': w, 'sequences': len(sequences), 'chains': sum(map(len, unique.values())),
+                       'residues': int(offsets[-1]), 'source': os.path.basename(fasta_path)}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def target(self, index):
+        return np.asarray(self.sequences[self.offsets[index]:self.offsets[index + 1]])
+
+    def candidates(self, query, limit, ratio=0.1):
+        """Sequences sharing the most minimisers with ``query``, best first.
+
+        Sequences sharing fewer than ``ratio`` times the best count are chance hits and dropped.
+        """
+        kmers = kmer_codes(query, self.k)
+        if len(kmers) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if len(query) >= self.k + self.w - 1:
+            kmers = kmers[minimiser_positions(kmers, self.w)]
+        kmers = np.unique(kmers)
+        slots = np.searchsorted(self.kmers, kmers)
+        inside = slots < len(self.kmers)
+        slots, kmers = slots[inside], kmers[inside]
+        slots = slots[np.asarray(self.kmers[slots]) == kmers]
+        if len(slots) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts, stops = np.asarray(self.kmer_starts[slots]), np.asarray(self.kmer_starts[slots + 1])
+        hits = np.concatenate([np.asarray(self.postings[a:b]) for a, b in zip(starts, stops)])
+        counts = np.bincount(hits, minlength=len(self.ids))
+        found = np.flatnonzero(counts >= max(1, ratio * counts.max()))
+        return found[np.argsort(-counts[found], kind='stable')][:limit]
+
+    def search(self, sequence, top_k=5, identity_cutoff=0.0, min_coverage=0.0, candidates=64, prefilter=0.1, gap=5,
+               batch=16):
+        """Best ``top_k`` hits for one sequence, by alignment score.
+
+        Each hit is a dict with ``id`` (first chain, e.g. ``4HHB_A``),
+        ``pdb_id``, ``chains`` (all identical chains), ``score``,
+        ``identity`` (identical / aligned columns), ``query_coverage`` and
+        ``target_coverage`` (aligned share of each sequence) and the ranges.
+        ``candidates`` and ``prefilter`` bound the sequences that are aligned
+        (see ``candidates``); lower ``prefilter`` for remote homologues.
+        """
+        count('sequence_index_queries')
+        query = encode(sequence.upper())
+        selected = self.candidates(query, candidates, prefilter)
+        if len(selected) == 0:
+            return []
+        if len(selected) > top_k:
+            # Candidates of similar length are scored together, to keep the padding small
+            lengths = self.offsets[selected + 1] - self.offsets[selected]
+            selected = selected[np.argsort(lengths, kind='stable')]
+            scores = np.zeros(len(selected), dtype=np.int32)
+            for start in range(0, len(selected), batch):
+                group = selected[start:start + batch]
+                targets = [self.target(index) for index in group]
+                padded = np.full((len(group), max(map(len, targets))), PAD, dtype=np.uint8)
+                for row, target in enumerate(targets):
+                    padded[row, :len(target)] = target
+                scores[start:start + batch] = smith_waterman_scores(query, padded, gap)
+            selected = selected[np.argsort(-scores, kind='stable')]
+
+        hits = []
+        for index in selected:
+            target = self.target(index)
+            alignment = smith_waterman_alignment(query, target, gap)
+            if alignment['alignment_length'] == 0:
+                continue
+            identity = alignment['matches'] / alignment['alignment_length']
+            query_coverage = (alignment['query_range'][1] - alignment['query_range'][0] + 1) / len(query)
+            target_coverage = (alignment['target_range'][1] - alignment['target_range'][0] + 1) / len(target)
+            if identity < identity_cutoff or query_coverage < min_coverage:
+                continue
+            chains = self.ids[index]
+            hits.append({'id': chains[0], 'pdb_id': chains[0].split('_')[0], 'chains': chains,
+                         'score': alignment['score'], 'identity': identity, 'query_coverage': query_coverage,
+                         'target_coverage': target_coverage, 'alignment_length': alignment['alignment_length'],
+                         'query_range': alignment['query_range'], 'target_range': alignment['target_range']})
+            if len(hits) == top_k:
+                break
+        return sorted(hits, key=lambda hit: -hit['score'])
+
+    def search_many(self, sequences, **kwargs):
+        """``search`` for many sequences; identical queries are aligned once. Returns {sequence: hits}."""
+        return {sequence: self.search(sequence, **kwargs) for sequence in dict.fromkeys(sequences)}
+
+
+def sequence_index_path():
+    return os.environ.get('DRUGREALIGN_SEQUENCE_INDEX') or './data/seq_index'
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_sequence_index():
+    """The process-wide sequence index, or None if it has not been built (see ``SequenceIndex.build``)."""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None and os.path.exists(os.path.join(sequence_index_path(), 'meta.json')):
+            _shared_index = SequenceIndex(sequence_index_path())
+        return _shared_index
+
+
+# Example: build the index from pdb_seqres.txt (downloaded when no file is given), then search it
+if __name__ == '__main__':
+    import sys
+    import time
+    path = sequence_index_path()
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        fasta_path = sys.argv[1]
+    else:
+        from config.RCSBFetcher import get_fetcher
+        fasta_path = './data/pdb_seqres.txt'
+        fetcher = get_fetcher()
+        if not fetcher.download(fetcher.files_url + SEQRES_URL, fasta_path):
+            sys.exit(1)
+    start = time.perf_counter()
+    index = SequenceIndex.build(fasta_path, path)
+    print(f"Indexed {index.meta['chains']} chains ({len(index)} unique sequences) in {time.perf_counter() - start:.1f} s")
+    query = 'MEEPQSDPSVEPPLSQETFSDLWKLLPEN'
+    start = time.perf_counter()
+    for hit in index.search(query, top_k=3):
+        print(hit['id'], hit['score'], f"identity {hit['identity']:.2f}", f"coverage {hit['query_coverage']:.2f}")
+    print(f"Search took {(time.perf_counter() - start) * 1000:.1f} ms")
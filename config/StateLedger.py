@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class StateLedger:
+    """Persistent per-target, per-stage run state.
+
+    Every stage run is recorded with the hash of its input state and stage
+    settings, its output paths (with sizes), status, duration and error, plus
+    the target state it produced. A stage counts as finished only if it
+    completed with the same input hash and all of its declared outputs are on
+    disk unchanged in size (an output that was never written counts as
+    missing), so a resumed batch restarts each target at its first incomplete
+    stage.
+    """
+
+    def __init__(self, db_path='./data/state_ledger.sqlite'):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=60)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS stages ('
+                              'target TEXT NOT NULL, stage TEXT NOT NULL, input_hash TEXT, outputs TEXT, '
+                              'status TEXT NOT NULL, duration REAL, error TEXT, state TEXT, updated REAL NOT NULL, '
+                              'PRIMARY KEY (target, stage))')
+
+    @staticmethod
+    def state_of(target):
+        return {key: value for key, value in vars(target).items() if key != 'error'}
+
+    @classmethod
+    def input_hash(cls, target, fingerprint=None):
+        # The target state plus the stage's own settings (Stage.fingerprint)
+        payload = json.dumps({'state': cls.state_of(target), 'stage': fingerprint}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def describe_outputs(paths):
+        # Missing outputs are kept with size None, so the stage never counts as finished
+        return {path: os.path.getsize(path) if os.path.exists(path) else None for path in paths if path}
+
+    def get(self, target_id, stage):
+        with self.lock:
+            row = self.conn.execute('SELECT input_hash, outputs, status, duration, error, state FROM stages '
+                                    'WHERE target = ? AND stage = ?', (target_id, stage)).fetchone()
+        if row is None:
+            return None
+        return {'input_hash': row[0], 'outputs': json.loads(row[1] or '{}'), 'status': row[2],
+                'duration': row[3], 'error': row[4], 'state': json.loads(row[5] or '{}')}
+
+    def finished_state(self, target_id, stage, input_hash):
+        # The state a finished stage produced, or None if the stage has to run (again)
+        entry = self.get(target_id, stage)
+        if entry is None or entry['status'] != 'done' or entry['input_hash'] != input_hash:
+            return None
+        for path, size in entry['outputs'].items():
+            if size is None or not os.path.exists(path) or os.path.getsize(path) != size:
+                return None
+        return entry['state']
+
+    def record(self, target_id, stage, status, input_hash=None, outputs=(), duration=None, error=None, state=None):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (target_id, stage, input_hash, json.dumps(self.describe_outputs(outputs)), status,
+                               duration, error, json.dumps(state, default=str) if state is not None else None,
+                               time.time()))
+
+    def summary(self):
+        with self.lock:
+            return self.conn.execute('SELECT stage, status, COUNT(*), SUM(duration) FROM stages '
+                                     'GROUP BY stage, status ORDER BY stage').fetchall()
+
+    def close(self):
+        self.conn.close()
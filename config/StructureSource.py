@@ -0,0 +1,344 @@
+import io
+import os
+import re
+import abc
+import gzip
+import json
+import mmap
+import zlib
+import struct
+import threading
+from Bio.PDB import MMCIFParser, PDBIO
+from Bio.PDB.MMCIF2Dict import MMCIF2Dict
+from config.AtomicFile import atomic_write
+from config.RCSBFetcher import get_fetcher
+
+THREE_TO_ONE = {
+    'ALA': 'A', 'ARG': 'R', 'ASN': 'N', 'ASP': 'D', 'CYS': 'C', 'GLN': 'Q', 'GLU': 'E', 'GLY': 'G',
+    'HIS': 'H', 'ILE': 'I', 'LEU': 'L', 'LYS': 'K', 'MET': 'M', 'PHE': 'F', 'PRO': 'P', 'SER': 'S',
+    'THR': 'T', 'TRP': 'W', 'TYR': 'Y', 'VAL': 'V', 'MSE': 'M', 'SEP': 'S', 'TPO': 'T', 'PTR': 'Y',
+}
+
+
+def offline_mode():
+    return os.environ.get('DRUGREALIGN_OFFLINE', '') not in ('', '0')
+
+
+def fasta_from_pdb(pdb_id, pdb_text):
+    # RCSB-style FASTA from the SEQRES records, one entry per chain
+    chains = {}
+    for line in pdb_text.splitlines():
+        if line.startswith('SEQRES'):
+            chains.setdefault(line[11], []).extend(THREE_TO_ONE.get(res, 'X') for res in line[19:].split())
+    return ''.join(f'>{pdb_id.upper()}_{index}|Chain {chain}\n{"".join(seq)}\n'
+                   for index, (chain, seq) in enumerate(chains.items(), 1))
+
+
+def summary_from_pdb(pdb_id, pdb_text):
+    # The fields PDBSummaryExtractor scrapes from the RCSB page, taken from the PDB header instead
+    title, classification, organisms, expression = [], '', [], []
+    for line in pdb_text.splitlines():
+        if line.startswith('HEADER'):
+            classification = line[10:50].strip()
+        elif line.startswith('TITLE'):
+            title.append(line[10:].strip())
+        elif line.startswith('SOURCE'):
+            match = re.search(r'ORGANISM_SCIENTIFIC: (.+?);', line)
+            if match:
+                organisms.append(match.group(1).title())
+            match = re.search(r'EXPRESSION_SYSTEM: (.+?);', line)
+            if match:
+                expression.append(match.group(1).title())
+        elif line.startswith(('ATOM', 'HETATM')):
+            break
+    return {
+        'PDB ID': pdb_id.upper(),
+        'Title': ' '.join(title) or 'Not found',
+        'Classification': classification or 'Not found',
+        'Organism(s)': ', '.join(dict.fromkeys(organisms)) or 'Not found',
+        'Expression System': ', '.join(dict.fromkeys(expression)) or 'Not found',
+    }
+
+
+def mmcif_to_pdb(pdb_id, cif_text):
+    """Convert mmCIF text to PDB text (header, SEQRES and coordinates) for the PDB-format tools downstream.
+
+    Raises ValueError for entries the PDB format cannot hold (more than 99,999
+    atoms or multi-character chain IDs), instead of writing a corrupt file.
+    """
+    mmcif_dict = MMCIF2Dict(io.StringIO(cif_text))
+    structure = MMCIFParser(QUIET=True).get_structure(pdb_id, io.StringIO(cif_text))
+    atoms = sum(1 for _ in structure.get_atoms())
+    long_chains = sorted({chain.id for chain in structure.get_chains() if len(chain.id) > 1})
+    if atoms > 99999 or long_chains:
+        reason = f'{atoms} atoms' if atoms > 99999 else f'chain IDs {", ".join(long_chains[:5])}'
+        raise ValueError(f'{pdb_id} is only available as mmCIF and does not fit the PDB format ({reason})')
+    lines = []
+    keywords = mmcif_dict.get('_struct_keywords.pdbx_keywords', [''])[0]
+    lines.append(f'HEADER    {keywords[:40]:<40}          {pdb_id.upper():<4}')
+    title = mmcif_dict.get('_struct.title', [''])[0]
+    for index in range(0, len(title), 70):
+        continuation = f'{index // 70 + 1:>2}' if index else '  '
+        lines.append(f'TITLE   {continuation}{title[index:index + 70]}')
+    for organism in mmcif_dict.get('_entity_src_gen.pdbx_gene_src_scientific_name', []):
+        lines.append(f'SOURCE    ORGANISM_SCIENTIFIC: {organism};')
+    for host in mmcif_dict.get('_entity_src_gen.pdbx_host_org_scientific_name', []):
+        lines.append(f'SOURCE    EXPRESSION_SYSTEM: {host};')
+    # SEQRES from the polymer sequences, so FASTA can still be derived offline
+    residues = {}
+    for entity, chain, name in zip(mmcif_dict.get('_pdbx_poly_seq_scheme.entity_id', []),
+                                   mmcif_dict.get('_pdbx_poly_seq_scheme.pdb_strand_id', []),
+                                   mmcif_dict.get('_pdbx_poly_seq_scheme.mon_id', [])):
+        residues.setdefault(chain, []).append(name)
+    for chain, names in residues.items():
+        for serial, index in enumerate(range(0, len(names), 13), 1):
+            lines.append(f'SEQRES {serial:>3} {chain} {len(names):>4}  {" ".join(f"{n:>3}" for n in names[index:index + 13])}')
+    output = io.StringIO()
+    pdbio = PDBIO()
+    pdbio.set_structure(structure)
+    pdbio.save(output)
+    return '\n'.join(lines) + '\n' + output.getvalue()
+
+
+class StructureSource(abc.ABC):
+    """Where structures come from. ``open`` returns a text handle in PDB format, or None if missing."""
+
+    @abc.abstractmethod
+    def open(self, pdb_id):
+        pass
+
+    def read(self, pdb_id):
+        handle = self.open(pdb_id)
+        if handle is None:
+            return None
+        with handle:
+            return handle.read()
+
+    def native_fasta(self, pdb_id):
+        # RCSB FASTA (one record per entity) where the source has it; None otherwise
+        return None
+
+    def read_fasta(self, pdb_id):
+        native = self.native_fasta(pdb_id)
+        if native is not None:
+            return native
+        text = self.read(pdb_id)
+        return fasta_from_pdb(pdb_id, text) if text is not None else None
+
+    def read_summary(self, pdb_id):
+        text = self.read(pdb_id)
+        return summary_from_pdb(pdb_id, text) if text is not None else None
+
+
+class LocalFileSource(StructureSource):
+    """Plain ``{root}/{id}.pdb`` files, e.g. the ./data/pdb working folder."""
+
+    def __init__(self, root='./data/pdb'):
+        self.root = root
+
+    def open(self, pdb_id):
+        for name in (f'{pdb_id}.pdb', f'{pdb_id.upper()}.pdb', f'{pdb_id.lower()}.pdb'):
+            path = os.path.join(self.root, name)
+            if os.path.exists(path):
+                return open(path, 'r')
+        return None
+
+
+class MirrorSource(StructureSource):
+    """A local RCSB-style divided mirror, read in place.
+
+    PDB format is looked up as ``{root}/{xx}/pdb{id}.ent.gz`` and mmCIF as
+    ``{cif_root}/{xx}/{id}.cif.gz``, where ``xx`` are the middle two
+    characters of the id. Files are decompressed while they are read, never
+    unpacked to disk; mmCIF entries are converted to PDB text in memory.
+    """
+
+    def __init__(self, root, cif_root=None):
+        self.root = root
+        self.cif_root = cif_root or root
+
+    def paths(self, pdb_id):
+        pdb_id = pdb_id.lower()
+        middle = pdb_id[1:3]
+        return (os.path.join(self.root, middle, f'pdb{pdb_id}.ent.gz'),
+                os.path.join(self.root, middle, f'pdb{pdb_id}.ent'),
+                os.path.join(self.cif_root, middle, f'{pdb_id}.cif.gz'))
+
+    def open(self, pdb_id):
+        ent_gz, ent, cif_gz = self.paths(pdb_id)
+        if os.path.exists(ent_gz):
+            return gzip.open(ent_gz, 'rt')
+        if os.path.exists(ent):
+            return open(ent, 'r')
+        if os.path.exists(cif_gz):
+            with gzip.open(cif_gz, 'rt') as f:
+                return io.StringIO(mmcif_to_pdb(pdb_id, f.read()))
+        return None
+
+
+class PackedArchive(StructureSource):
+    """Many structures in one file, read at random through mmap.
+
+    Layout: magic, zlib-compressed members back to back, a JSON index
+    ``{key: [offset, length]}`` and a fixed footer with the index position.
+    Members are keyed ``{ID}.pdb`` and, optionally, ``{ID}.fasta``. Build one
+    with ``PackedArchive.pack``.
+    """
+
+    MAGIC = b'DRAPACK1'
+    FOOTER = struct.Struct('<QQ8s')
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, index_length, magic = self.FOOTER.unpack(self.mm[-self.FOOTER.size:])
+        if self.mm[:len(self.MAGIC)] != self.MAGIC or magic != self.MAGIC:
+            raise ValueError(f"{path} is not a structure archive")
+        self.index = json.loads(self.mm[index_offset:index_offset + index_length].decode('utf-8'))
+
+    def member(self, key):
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return zlib.decompress(self.mm[offset:offset + length]).decode('utf-8')
+
+    def keys(self):
+        return [key[:-4] for key in self.index if key.endswith('.pdb')]
+
+    def open(self, pdb_id):
+        text = self.member(f'{pdb_id.upper()}.pdb')
+        return io.StringIO(text) if text is not None else None
+
+    def native_fasta(self, pdb_id):
+        return self.member(f'{pdb_id.upper()}.fasta')
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    @classmethod
+    def pack(cls, path, source, pdb_ids, fasta_folder=None, level=6):
+        """Write ``pdb_ids`` from ``source`` into a new archive at ``path``. Returns the ids packed."""
+        index, packed = {}, []
+        with atomic_write(path, 'wb') as f:
+            f.write(cls.MAGIC)
+            for pdb_id in dict.fromkeys(pdb_id.upper() for pdb_id in pdb_ids):
+                members = {f'{pdb_id}.pdb': source.read(pdb_id)}
+                fasta_path = os.path.join(fasta_folder, f'{pdb_id}.fasta') if fasta_folder else None
+                if fasta_path and os.path.exists(fasta_path):
+                    with open(fasta_path, 'r') as fasta:
+                        members[f'{pdb_id}.fasta'] = fasta.read()
+                if members[f'{pdb_id}.pdb'] is None:
+                    print(f'Skipping {pdb_id}: not found in source')
+                    continue
+                for key, text in members.items():
+                    data = zlib.compress(text.encode('utf-8'), level)
+                    index[key] = [f.tell(), len(data)]
+                    f.write(data)
+                packed.append(pdb_id)
+            index_data = json.dumps(index).encode('utf-8')
+            index_offset = f.tell()
+            f.write(index_data)
+            f.write(cls.FOOTER.pack(index_offset, len(index_data), cls.MAGIC))
+        return packed
+
+
+class RemoteSource(StructureSource):
+    """RCSB over HTTP through the shared pooled fetcher."""
+
+    def __init__(self, fetcher=None):
+        self.fetcher = fetcher or get_fetcher()
+
+    def open(self, pdb_id):
+        response = self.fetcher.get(self.fetcher.pdb_url(pdb_id))
+        return io.StringIO(response.text) if response is not None else None
+
+    def native_fasta(self, pdb_id):
+        response = self.fetcher.get(self.fetcher.fasta_url(pdb_id))
+        return response.text if response is not None else None
+
+    def read_fasta(self, pdb_id):
+        return self.native_fasta(pdb_id)
+
+
+class ChainedSource(StructureSource):
+    """Try several sources in order; the first one holding the structure wins."""
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def first(self, method, pdb_id):
+        for source in self.sources:
+            try:
+                result = getattr(source, method)(pdb_id)
+            except Exception as e:
+                print(f'{type(source).__name__} failed for {pdb_id}: {e}')
+                continue
+            if result is not None:
+                return result
+        return None
+
+    def open(self, pdb_id):
+        return self.first('open', pdb_id)
+
+    def native_fasta(self, pdb_id):
+        return self.first('native_fasta', pdb_id)
+
+    def read_fasta(self, pdb_id):
+        # The RCSB FASTA of any source wins over FASTA derived from SEQRES records, which differs
+        # (per chain, not per entity; non-standard residues become X) even when the working
+        # folder already holds the structure
+        native = self.native_fasta(pdb_id)
+        return native if native is not None else self.first('read_fasta', pdb_id)
+
+    def read_summary(self, pdb_id):
+        return self.first('read_summary', pdb_id)
+
+
+def source_from_spec(spec, local_root='./data/pdb'):
+    """Build a source chain from e.g. ``mirror:/mnt/pdb,archive:/shared/pdb.pack,remote``.
+
+    The working folder ``local_root`` is always tried first; ``remote`` is
+    dropped in offline mode (DRUGREALIGN_OFFLINE).
+    """
+    sources = [LocalFileSource(local_root)]
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        kind, _, location = item.partition(':')
+        if kind == 'remote':
+            if not offline_mode():
+                sources.append(RemoteSource())
+        elif kind == 'local':
+            sources.append(LocalFileSource(location))
+        elif kind == 'mirror':
+            root, _, cif_root = location.partition(';')
+            sources.append(MirrorSource(root, cif_root or None))
+        elif kind == 'archive':
+            sources.append(PackedArchive(location))
+        else:
+            raise ValueError(f"Unknown structure source: {item}")
+    return ChainedSource(sources)
+
+
+_shared_source = None
+_shared_lock = threading.Lock()
+
+
+def get_structure_source():
+    """The process-wide source chain, configured by DRUGREALIGN_STRUCTURE_SOURCES (default ``remote``)."""
+    global _shared_source
+    with _shared_lock:
+        if _shared_source is None:
+            _shared_source = source_from_spec(os.environ.get('DRUGREALIGN_STRUCTURE_SOURCES', 'remote'))
+        return _shared_source
+
+
+# Example: pack the bundled receptors into one archive and read one back
+if __name__ == '__main__':
+    bundled = LocalFileSource('./config/pdb')
+    ids = [name[:-4] for name in sorted(os.listdir('./config/pdb')) if name.endswith('.pdb')]
+    print(PackedArchive.pack('./data/pdb_archive.pack', bundled, ids))
+    archive = PackedArchive('./data/pdb_archive.pack')
+    print(archive.read_summary(ids[0]))
+    archive.close()
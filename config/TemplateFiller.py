@@ -1,49 +1,142 @@
 import os
+import re
+import hashlib
+import functools
+from config.AtomicFile import atomic_write
+from config.InteractionStore import INTERACTION_TYPES, get_interaction_store
+from config.PromptCompactor import PromptCompactor
+
+# Placeholders of config/template.txt and the field each one is filled with
+PLACEHOLDERS = {'__fill sum info__': 'summary', '__fill seq info__': 'sequence', '__fill pdb info__': 'atom'}
+
+
+class CompiledTemplate:
+    """A prompt template split once into literal text and placeholder slots.
+
+    ``render`` joins the pieces in a single pass, instead of copying the
+    whole document once per placeholder.
+    """
+
+    def __init__(self, text):
+        pattern = '|'.join(re.escape(placeholder) for placeholder in PLACEHOLDERS)
+        # Odd positions are placeholders, even positions literal text
+        self.parts = re.split(f'({pattern})', text)
+        self.slots = [(index, PLACEHOLDERS[part]) for index, part in enumerate(self.parts) if index % 2]
+
+    def render(self, summary='', sequence='', atom=''):
+        values = {'summary': summary, 'sequence': sequence, 'atom': atom}
+        parts = list(self.parts)
+        for index, field in self.slots:
+            parts[index] = values[field]
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=8)
+def _compiled_template(template_path, mtime_ns, size):
+    # Keyed on mtime and size, so an edited template is compiled again
+    with open(template_path, 'r', encoding='utf-8') as file:
+        return CompiledTemplate(file.read())
+
+
+def load_template(template_path):
+    stat = os.stat(template_path)
+    return _compiled_template(os.path.abspath(template_path), stat.st_mtime_ns, stat.st_size)
+
 
 class TemplateFiller:
-    def __init__(self, template_path, summary_folder_path, atom_folder_path, sequence_folder_path, output_folder_path):
+    def __init__(self, template_path, summary_folder_path, atom_folder_path, sequence_folder_path, output_folder_path,
+                 metadata_index=None, interaction_store=None, token_budget=None, compactor=None, save=True):
         self.template_path = template_path
         self.summary_folder_path = summary_folder_path
         self.atom_folder_path = atom_folder_path
         self.sequence_folder_path = sequence_folder_path
         self.output_folder_path = output_folder_path
+        # Summaries come from the metadata index; files in summary_folder_path are the fallback (custom data)
+        self.metadata_index = metadata_index
+        # Interaction text is rendered from the Parquet store; text files in atom_folder_path are the fallback
+        self.interaction_store = interaction_store or get_interaction_store()
+        # With a token budget prompts are compacted to fit it
+        if compactor is None and token_budget:
+            compactor = PromptCompactor(token_budget)
+        self.compactor = compactor
+        # Prompts are returned in memory; with ``save`` they are also written to output_folder_path for audit
+        self.save = save
 
-        if not os.path.exists(self.output_folder_path):
+        if self.save and not os.path.exists(self.output_folder_path):
             os.makedirs(self.output_folder_path)
 
-    def fill_template(self, file_base_name):
-        with open(self.template_path, 'r', encoding='utf-8') as file:
-            template = file.read()
+    @staticmethod
+    def read_text(path):
+        if not os.path.exists(path):
+            return ""
+        with open(path, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def fingerprint(self):
+        """Everything besides the target that the prompts depend on: template text and compaction settings."""
+        with open(self.template_path, 'rb') as file:
+            template = hashlib.sha256(file.read()).hexdigest()
+        compactor = None
+        if self.compactor is not None:
+            compactor = {'token_budget': self.compactor.token_budget, 'model': self.compactor.model,
+                         'decimals': self.compactor.decimals, 'columns': list(self.compactor.columns),
+                         'min_rows': self.compactor.min_rows}
+        return {'template': template, 'compactor': compactor, 'save': self.save}
 
-        summary_path = os.path.join(self.summary_folder_path, file_base_name + '.txt')
-        atom_path = os.path.join(self.atom_folder_path, file_base_name + '.txt')
-        sequence_path = os.path.join(self.sequence_folder_path, file_base_name + '.fasta')
+    def render(self, file_base_name, summary=None):
+        """Returns (prompt, tokens), tokens being (before, after) when the prompt was compacted."""
+        template = load_template(self.template_path)
 
-        summary, atom, sequence = "", "", ""
+        if summary is None and self.metadata_index is not None:
+            summary = self.metadata_index.summary_text(file_base_name)
+        if not summary:
+            summary = self.read_text(os.path.join(self.summary_folder_path, file_base_name + '.txt'))
+        atom, tables = "", None
+        if self.interaction_store.has(file_base_name):
+            if self.compactor is not None:
+                tables = {key: self.interaction_store.read(file_base_name, key) for key in INTERACTION_TYPES}
+            else:
+                atom = self.interaction_store.render(file_base_name)
+        else:
+            atom = self.read_text(os.path.join(self.atom_folder_path, file_base_name + '.txt'))
+        sequence = self.read_text(os.path.join(self.sequence_folder_path, file_base_name + '.fasta'))
 
-        if os.path.exists(summary_path):
-            with open(summary_path, 'r', encoding='utf-8') as temp:
-                summary = temp.read()
-        if os.path.exists(atom_path):
-            with open(atom_path, 'r', encoding='utf-8') as temp:
-                atom = temp.read()
-        if os.path.exists(sequence_path):
-            with open(sequence_path, 'r', encoding='utf-8') as temp:
-                sequence = temp.read()
+        if self.compactor is not None:
+            prompt, before, after = self.compactor.build(template, summary, sequence, tables, atom)
+            return prompt, (before, after)
+        return template.render(summary, sequence, atom), None
 
-        filled_template = template.replace('__fill sum info__', summary)
-        filled_template = filled_template.replace('__fill seq info__', sequence)
-        filled_template = filled_template.replace('__fill pdb info__', atom)
+    def render_many(self, pdb_ids, summaries=None):
+        """Render the prompts of many targets in one call. Returns {pdb_id: (prompt, tokens)}.
 
+        ``summaries`` gives the summary text of targets that are not PDB entries (custom data).
+        """
+        summaries = dict(summaries or {})
+        lookup = [pdb_id for pdb_id in pdb_ids if pdb_id not in summaries]
+        if self.metadata_index is not None and lookup:
+            summaries.update(self.metadata_index.summary_texts(lookup))
+        results = {}
+        for pdb_id in pdb_ids:
+            results[pdb_id] = self.render(pdb_id, summaries.get(pdb_id, ""))
+            if self.save:
+                self.write(pdb_id, results[pdb_id][0])
+        return results
+
+    def write(self, file_base_name, prompt):
         save_path = os.path.join(self.output_folder_path, file_base_name + '.txt')
+        os.makedirs(self.output_folder_path, exist_ok=True)
+        with atomic_write(save_path, "w", encoding="utf-8") as f:
+            f.write(prompt)
+        return save_path
 
-        with open(save_path, "w", encoding="utf-8") as f:
-            f.write(filled_template)
+    def fill_template(self, file_base_name):
+        prompt, tokens = self.render(file_base_name)
+        self.write(file_base_name, prompt)
+        return tokens
 
     def process_files(self, pdb_id):
-        
-        self.fill_template(pdb_id)
-        #print(f"Processed: {pdb_id}")
+        """Returns (tokens before, tokens after) when the prompt was compacted."""
+        return self.fill_template(pdb_id)
 
 # Example of how to use the class
 if __name__ == '__main__':
@@ -52,9 +145,10 @@ if __name__ == '__main__':
     atom_folder_path = 'path_to_your_atom_folder'
     sequence_folder_path = 'path_to_your_sequence_folder'
     output_folder_path = 'path_to_your_output_folder'
-    
-    filler = TemplateFiller(template_path, summary_folder_path, atom_folder_path, sequence_folder_path, output_folder_path)
-    
+
+    filler = TemplateFiller(template_path, summary_folder_path, atom_folder_path, sequence_folder_path, output_folder_path,
+                            save=False)
+
     # Suppose your file base names are something like '1A2B', '2B3C', etc.
     file_list = ['1A2B', '2B3C']  # Update this list with actual base names of your files
-    filler.process_files(file_list)
+    prompts = filler.render_many(file_list)
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import contextvars
+
+# Counters of the span running on each thread
+_local = threading.local()
+# Counters handed to an asyncio task that works for a span running on another thread
+_task_counters = contextvars.ContextVar('task_counters', default=None)
+
+
+def count(name, value=1):
+    """Add ``value`` to a counter of the stage running on this thread; a no-op outside traced stages."""
+    counters = _task_counters.get()
+    if counters is None:
+        counters = getattr(_local, 'counters', None)
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + value
+
+
+def current_counters():
+    """Counters of the span running on this thread, or None."""
+    return getattr(_local, 'counters', None)
+
+
+async def counted(coroutine, counters):
+    # Run in its own task, so count() inside ``coroutine`` adds to ``counters``
+    _task_counters.set(counters)
+    return await coroutine
+
+
+class Span:
+    """Wall time, thread CPU time and counters of one stage run for one target.
+
+    Used as a context manager on the thread that does the work, so it also
+    measures stages that run in worker processes; it is picklable and comes
+    back with the result. CPU time of child processes is only included where
+    a component reports it as the ``child_cpu_s`` counter (docking).
+    """
+
+    def __init__(self, target_id, stage, kind=None):
+        self.target_id = target_id
+        self.stage = stage
+        self.kind = kind
+        self.status = None
+        self.error = None
+        self.start = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.counters = {}
+        self.pid = os.getpid()
+        self.thread = None
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'counters', None)
+        _local.counters = self.counters
+        self.pid = os.getpid()
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.thread_time() - self._cpu
+        _local.counters = self.previous
+        del self.previous, self._wall, self._cpu
+        self.status = 'failed' if exc is not None else 'done'
+        if exc is not None and self.error is None:
+            self.error = exc
+        return False
+
+    def as_dict(self):
+        return {'target': self.target_id, 'stage': self.stage, 'kind': self.kind, 'status': self.status,
+                'start': self.start, 'wall_s': round(self.wall, 6), 'cpu_s': round(self.cpu, 6),
+                'pid': self.pid, 'thread': self.thread, 'counters': self.counters,
+                'error': str(self.error) if self.error is not None else None}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class Tracer:
+    """Collect the spans of a batch and export them.
+
+    ``write`` produces one JSON object per span (``.jsonl``) or a Chrome
+    trace (``.json``, open it in chrome://tracing or Perfetto). ``summary``
+    aggregates the spans per stage, including process-wide CPU time (own
+    and reaped child processes) for the whole batch.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.cpu_started = self.process_cpu()
+
+    @staticmethod
+    def process_cpu():
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    @contextlib.contextmanager
+    def span(self, target_id, stage, kind=None):
+        """Trace a stage run on the current thread: ``with tracer.span(pdb_id, 'download'): ...``."""
+        span = Span(target_id, stage, kind)
+        try:
+            with span:
+                yield span
+        finally:
+            self.add(span)
+
+    def record(self, target_id, stage, counters, wall=0.0, kind=None, status='done'):
+        """Add work measured elsewhere, e.g. the prefetch before the pipeline, or a skipped stage."""
+        span = Span(target_id, stage, kind)
+        span.start, span.wall, span.status, span.counters = time.time() - wall, wall, status, dict(counters)
+        self.add(span)
+
+    def write(self, path):
+        with self.lock:
+            spans = [span.as_dict() for span in self.spans]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                for span in spans:
+                    f.write(json.dumps(span, default=str) + '\n')
+                return
+            events = [{'name': span['stage'], 'cat': span['kind'] or 'stage', 'ph': 'X',
+                       'ts': int((span['start'] - self.started) * 1e6), 'dur': int(span['wall_s'] * 1e6),
+                       'pid': span['pid'], 'tid': span['thread'] or 'main',
+                       'args': {'target': span['target'], 'status': span['status'], 'cpu_s': span['cpu_s'],
+                                **span['counters'], **({'error': span['error']} if span['error'] else {})}}
+                      for span in spans]
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        """One row per stage: runs, skips, failures, wall total/p50/p95/max, CPU and summed counters."""
+        with self.lock:
+            spans = list(self.spans)
+        rows = []
+        for stage in dict.fromkeys(span.stage for span in spans):
+            current = [span for span in spans if span.stage == stage and span.status != 'skipped']
+            skipped = sum(span.stage == stage and span.status == 'skipped' for span in spans)
+            walls = [span.wall for span in current]
+            counters = {}
+            for span in current:
+                for name, value in span.counters.items():
+                    counters[name] = counters.get(name, 0) + value
+            rows.append({'stage': stage, 'runs': len(current), 'skipped': skipped,
+                         'failed': sum(span.status == 'failed' for span in current),
+                         'wall_s': sum(walls), 'p50_s': percentile(walls, 50), 'p95_s': percentile(walls, 95),
+                         'max_s': max(walls, default=0.0), 'cpu_s': sum(span.cpu for span in current) + counters.get('child_cpu_s', 0),
+                         'counters': counters})
+        return rows
+
+    def format_summary(self):
+        lines = [f"{'stage':<10} {'runs':>5} {'skipped':>7} {'failed':>6} {'wall s':>10} {'p50 s':>8} {'p95 s':>8} {'cpu s':>10}  counters"]
+        for row in self.summary():
+            counters = ', '.join(f'{name}={value:g}' for name, value in sorted(row['counters'].items()))
+            lines.append(f"{row['stage']:<10} {row['runs']:>5} {row['skipped']:>7} {row['failed']:>6} {row['wall_s']:>10.1f} "
+                         f"{row['p50_s']:>8.2f} {row['p95_s']:>8.2f} {row['cpu_s']:>10.1f}  {counters}")
+        lines.append(f"batch: {time.time() - self.started:.1f} s wall, "
+                     f"{self.process_cpu() - self.cpu_started:.1f} s CPU (incl. finished child processes)")
+        return '\n'.join(lines)
+
+
+# Example: trace two steps and print the summary
+if __name__ == '__main__':
+    tracer = Tracer()
+    with tracer.span('1ABC', 'sleep'):
+        time.sleep(0.1)
+    with tracer.span('1ABC', 'busy'):
+        count('items', sum(range(1000000)) and 1)
+    print(tracer.format_summary())
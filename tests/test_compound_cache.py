@@ -0,0 +1,115 @@
+# Unit tests of config/CompoundCache.py against the PubChem stand-in of benchmark/fixture_server.py.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import json
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+for module in ('requests', 'Bio'):
+    pytest.importorskip(module)
+
+from benchmark.fixture_server import FixtureHandler, FIXTURE_COMPOUNDS, pubchem_response
+from config.CompoundCache import CompoundCache
+
+# Names the stand-in answers with a server error
+BROKEN_NAMES = {'brokenamide'}
+
+
+class RecordingHandler(FixtureHandler):
+    paths = []
+    fail_properties = False
+
+    def do_POST(self):
+        self.paths.append(self.path)
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        broken_name = form.get('name', [''])[0].strip().lower() in BROKEN_NAMES
+        if broken_name or (self.fail_properties and self.path.endswith('/property/IsomericSMILES/JSON')):
+            self.send_body(500, 'Internal error')
+            return
+        status, result = pubchem_response(self.path, form)
+        self.send_body(status, json.dumps(result), 'application/json')
+
+
+@pytest.fixture
+def pubchem():
+    handler = type('Handler', (RecordingHandler,), {'paths': [], 'fail_properties': False,
+                                                    'counter': {'requests': 0}})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f'http://127.0.0.1:{server.server_address[1]}/rest/pug'
+    server.shutdown()
+
+
+def make_cache(tmp_path, url, **kwargs):
+    return CompoundCache(str(tmp_path / 'compounds.sqlite'), base_url=url, offline=False, **kwargs)
+
+
+def test_names_resolve_in_batched_property_requests(pubchem, tmp_path):
+    handler, url = pubchem
+    cache = make_cache(tmp_path, url, batch_size=2)
+    names = ['Aspirin', 'Ibuprofen', 'Caffeine', 'Metformin', 'Imatinib']
+    assert cache.resolve(names) == {name: FIXTURE_COMPOUNDS[name][1] for name in names}
+    property_requests = [path for path in handler.paths if path.endswith('/property/IsomericSMILES/JSON')]
+    assert len(property_requests) == 3
+    assert len(handler.paths) == len(names) + 3
+    cache.close()
+
+
+def test_spellings_share_one_entry_and_hits_skip_the_server(pubchem, tmp_path):
+    handler, url = pubchem
+    cache = make_cache(tmp_path, url)
+    result = cache.resolve(['Aspirin', ' ASPIRIN ', 'aspirin'])
+    assert set(result.values()) == {FIXTURE_COMPOUNDS['Aspirin'][1]}
+    assert len(handler.paths) == 2
+    assert cache.resolve(['Aspirin'])['Aspirin'] == FIXTURE_COMPOUNDS['Aspirin'][1]
+    assert len(handler.paths) == 2
+    cache.close()
+
+
+def test_unknown_names_are_cached_as_not_found(pubchem, tmp_path):
+    handler, url = pubchem
+    cache = make_cache(tmp_path, url)
+    assert cache.resolve(['not a real drug', 'Caffeine']) == {'not a real drug': 'Not Found',
+                                                             'Caffeine': FIXTURE_COMPOUNDS['Caffeine'][1]}
+    requests_made = len(handler.paths)
+    assert cache.resolve(['Not  a real drug'])['Not  a real drug'] == 'Not Found'
+    assert len(handler.paths) == requests_made
+    cache.close()
+
+
+def test_failed_lookups_are_errors_for_every_spelling_and_not_cached(pubchem, tmp_path):
+    handler, url = pubchem
+    cache = make_cache(tmp_path, url)
+    result = cache.resolve(['Brokenamide', 'BROKENAMIDE', 'Aspirin'])
+    assert result == {'Brokenamide': 'Error', 'BROKENAMIDE': 'Error', 'Aspirin': FIXTURE_COMPOUNDS['Aspirin'][1]}
+    assert cache.normalize_name('Brokenamide') not in cache.lookup(['Brokenamide'])
+    cache.close()
+
+
+def test_failed_property_request_reports_errors(pubchem, tmp_path):
+    handler, url = pubchem
+    handler.fail_properties = True
+    cache = make_cache(tmp_path, url)
+    assert cache.resolve(['Aspirin', 'not a real drug']) == {'Aspirin': 'Error', 'not a real drug': 'Not Found'}
+    handler.fail_properties = False
+    assert cache.resolve(['Aspirin'])['Aspirin'] == FIXTURE_COMPOUNDS['Aspirin'][1]
+    cache.close()
+
+
+def test_offline_mode_only_reads_the_cache(pubchem, tmp_path):
+    handler, url = pubchem
+    make_cache(tmp_path, url).resolve(['Aspirin'])
+    requests_made = len(handler.paths)
+    cache = CompoundCache(str(tmp_path / 'compounds.sqlite'), base_url=url, offline=True)
+    assert cache.resolve(['aspirin', 'Ibuprofen']) == {'aspirin': FIXTURE_COMPOUNDS['Aspirin'][1],
+                                                       'Ibuprofen': 'Not Found'}
+    assert len(handler.paths) == requests_made
+    cache.close()
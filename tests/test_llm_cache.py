@@ -0,0 +1,69 @@
+# Unit tests of config/LLMCache.py: keys, TTL and replay-only mode.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import time
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from config.LLMCache import LLMCache, LLMCacheMiss
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'llm_cache.sqlite')
+
+
+def test_hit_ignores_whitespace_but_not_model_or_params(db_path):
+    cache = LLMCache(db_path)
+    cache.put('gpt-4o', 'Which drugs\nbind  this pocket?', 'answer', {'temperature': 0})
+    assert cache.get('gpt-4o', ' Which drugs bind this\tpocket? ', {'temperature': 0}) == 'answer'
+    assert cache.get('gpt-4o-mini', 'Which drugs bind this pocket?', {'temperature': 0}) is None
+    assert cache.get('gpt-4o', 'Which drugs bind this pocket?', {'temperature': 1}) is None
+    assert cache.stats == {'hits': 1, 'misses': 2, 'stores': 1}
+    assert cache.hit_rate() == pytest.approx(1 / 3)
+    cache.close()
+
+
+def test_answers_persist_across_instances(db_path):
+    cache = LLMCache(db_path)
+    cache.put('gpt-4o', 'prompt', 'answer')
+    cache.close()
+    cache = LLMCache(db_path)
+    assert cache.get('gpt-4o', 'prompt') == 'answer'
+    cache.invalidate('gpt-4o', 'prompt')
+    assert cache.get('gpt-4o', 'prompt') is None
+    cache.close()
+
+
+def test_expired_entries_are_misses(db_path):
+    cache = LLMCache(db_path, ttl=60)
+    cache.put('gpt-4o', 'prompt', 'answer')
+    assert cache.get('gpt-4o', 'prompt') == 'answer'
+    with cache.lock, cache.conn:
+        cache.conn.execute('UPDATE responses SET created = ?', (time.time() - 120,))
+    assert cache.get('gpt-4o', 'prompt') is None
+    cache.close()
+
+
+def test_replay_only_miss_raises(db_path):
+    cache = LLMCache(db_path, replay_only=True)
+    cache.put('gpt-4o', 'known', 'answer')
+    assert cache.get('gpt-4o', 'known') == 'answer'
+    with pytest.raises(LLMCacheMiss):
+        cache.get('gpt-4o', 'unknown')
+    assert cache.stats['misses'] == 1
+    cache.close()
+
+
+def test_replay_only_treats_expired_entries_as_misses(db_path):
+    cache = LLMCache(db_path, ttl=60, replay_only=True)
+    cache.put('gpt-4o', 'prompt', 'answer')
+    with cache.lock, cache.conn:
+        cache.conn.execute('UPDATE responses SET created = ?', (time.time() - 120,))
+    with pytest.raises(LLMCacheMiss):
+        cache.get('gpt-4o', 'prompt')
+    cache.close()
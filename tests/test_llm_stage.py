@@ -0,0 +1,142 @@
+# Unit tests of config/LLMClient.py's LLMStage against the OpenAI stand-in of benchmark/mock_llm.py,
+# with a handler that fails or answers badly a given number of times first.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import json
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+pytest.importorskip('openai')
+
+from benchmark.mock_llm import MockLLMHandler, canned_answer
+from config.LLMClient import LLMStage, parse_drug_answer
+from config.LLMCache import LLMCache, LLMCacheMiss
+
+
+class FlakyHandler(MockLLMHandler):
+    # Responses served before the canned answers: an HTTP status, or 'invalid' for an unusable answer
+    script = []
+
+    def do_POST(self):
+        with self.counter_lock:
+            step = self.script.pop(0) if self.script else None
+        if step is None:
+            super().do_POST()
+            return
+        with self.counter_lock:
+            self.counter['requests'] += 1
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if step == 'invalid':
+            self.send_json(200, {'id': 'chatcmpl-flaky', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4o',
+                                 'choices': [{'index': 0, 'finish_reason': 'stop',
+                                              'message': {'role': 'assistant', 'content': 'I cannot answer that.'}}]})
+            return
+        data = json.dumps({'error': {'message': 'try again', 'type': 'server_error'}}).encode('utf-8')
+        self.send_response(step)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def llm_server():
+    handler = type('Handler', (FlakyHandler,), {'script': [], 'counter': {'requests': 0}})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+
+
+def make_stage(url, **kwargs):
+    kwargs.setdefault('base_delay', 0.01)
+    return LLMStage(api_key='test', base_url=url, timeout=30, **kwargs)
+
+
+def test_answers_are_validated_and_returned(llm_server):
+    handler, url = llm_server
+    stage = make_stage(url)
+    results = stage.run({'a': 'first pocket', 'b': 'second pocket'})
+    stage.close()
+    for key, question in (('a', 'first pocket'), ('b', 'second pocket')):
+        answer, drugs = results[key]
+        assert answer == canned_answer(question)
+        assert len(drugs) == 5
+    assert handler.counter['requests'] == 2
+
+
+def test_rate_limits_and_server_errors_are_retried(llm_server):
+    handler, url = llm_server
+    handler.script.extend([429, 503, 500])
+    stage = make_stage(url, max_retries=3)
+    answer, drugs = stage.submit('pocket').result(timeout=30)
+    stage.close()
+    assert drugs is not None
+    assert handler.counter['requests'] == 4
+
+
+def test_retries_give_up_with_the_error(llm_server):
+    handler, url = llm_server
+    handler.script.extend([429] * 3)
+    stage = make_stage(url, max_retries=2)
+    result = stage.run({'a': 'pocket'})['a']
+    stage.close()
+    assert isinstance(result, Exception)
+    assert handler.counter['requests'] == 3
+
+
+def test_invalid_answers_repeat_only_the_chat_call(llm_server):
+    handler, url = llm_server
+    handler.script.extend(['invalid', 'invalid'])
+    stage = make_stage(url, max_invalid_answers=3)
+    answer, drugs = stage.submit('pocket').result(timeout=30)
+    stage.close()
+    assert parse_drug_answer(answer) == (True, drugs)
+    assert handler.counter['requests'] == 3
+
+
+def test_persistently_invalid_answers_return_no_drugs(llm_server):
+    handler, url = llm_server
+    handler.script.extend(['invalid'] * 5)
+    stage = make_stage(url, max_invalid_answers=2)
+    answer, drugs = stage.submit('pocket').result(timeout=30)
+    stage.close()
+    assert answer == 'I cannot answer that.'
+    assert drugs is None
+    assert handler.counter['requests'] == 2
+
+
+def test_cached_answers_skip_the_api_and_replay_misses_fail(llm_server, tmp_path):
+    handler, url = llm_server
+    cache = LLMCache(str(tmp_path / 'llm_cache.sqlite'))
+    stage = make_stage(url, cache=cache)
+    first = stage.submit('pocket').result(timeout=30)
+    assert stage.submit(' pocket\n').result(timeout=30) == first
+    stage.close()
+    assert handler.counter['requests'] == 1
+    cache.replay_only = True
+    stage = make_stage(url, cache=cache)
+    assert stage.submit('pocket').result(timeout=30) == first
+    with pytest.raises(LLMCacheMiss):
+        stage.submit('another pocket').result(timeout=30)
+    stage.close()
+    cache.close()
+    assert handler.counter['requests'] == 1
+
+
+def test_backoff_honours_retry_after_and_caps_the_delay():
+    stage = LLMStage(base_delay=1.0, max_delay=8.0)
+    error = SimpleNamespace(response=SimpleNamespace(headers={'retry-after': '2.5'}))
+    assert stage.backoff(0, error) == 2.5
+    error.response.headers['retry-after'] = '120'
+    assert stage.backoff(0, error) == 8.0
+    assert all(0 <= stage.backoff(attempt) <= min(8.0, 2 ** attempt) for attempt in range(10))
@@ -0,0 +1,87 @@
+# End-to-end smoke test of the in-process pipeline against the local RCSB/PubChem and OpenAI
+# stand-ins of benchmark/. One bundled receptor goes through every stage three times: a cold run
+# with a token budget, a rerun resumed from the state ledger, and a replay-only rerun without the
+# ledger that must be answered from the LLM cache.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# The stages need the full scientific stack; without it the test is skipped
+for module in ('Bio', 'rdkit', 'openbabel', 'vina', 'plip', 'pymol', 'openai', 'requests', 'pandas', 'pyarrow', 'rich'):
+    pytest.importorskip(module)
+
+from benchmark.fixture_server import start_server as start_fixture_server
+from benchmark.mock_llm import start_server as start_llm_server
+
+TOKEN_BUDGET = 1000
+
+
+def smallest_receptor():
+    pdb_dir = os.path.join(REPO_ROOT, 'config', 'pdb')
+    paths = [os.path.join(pdb_dir, name) for name in os.listdir(pdb_dir) if name.endswith('.pdb')]
+    return os.path.basename(min(paths, key=os.path.getsize))[:-4].upper()
+
+
+def read_trace(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture
+def stand_ins():
+    fixture_server, fixture_url = start_fixture_server(pdb_dir=os.path.join(REPO_ROOT, 'config', 'pdb'))
+    llm_server, llm_url = start_llm_server()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])),
+               DRUGREALIGN_RCSB_FILES_URL=fixture_url, DRUGREALIGN_RCSB_URL=fixture_url,
+               DRUGREALIGN_RCSB_SEARCH_URL=fixture_url, DRUGREALIGN_RCSB_GRAPHQL_URL=f'{fixture_url}/graphql',
+               DRUGREALIGN_PUBCHEM_URL=f'{fixture_url}/rest/pug', DRUGREALIGN_STRUCTURE_SOURCES='remote',
+               OPENAI_BASE_URL=llm_url, OPENAI_API_KEY='smoke-test')
+    for name in ('DRUGREALIGN_OFFLINE', 'DRUGREALIGN_CPU_BUDGET'):
+        env.pop(name, None)
+    yield env, llm_server.RequestHandlerClass.counter
+    fixture_server.shutdown()
+    llm_server.shutdown()
+
+
+def test_pipeline_resume_cache_and_compaction(stand_ins, tmp_path):
+    env, llm_requests = stand_ins
+    pdb_id = smallest_receptor()
+    # Relative paths (./config/template.txt, ./data, ./result) resolve inside the scratch directory
+    os.symlink(os.path.join(REPO_ROOT, 'config'), tmp_path / 'config')
+    (tmp_path / 'input.csv').write_text(f'{pdb_id}\n')
+
+    def run(name, *extra):
+        trace_path = str(tmp_path / f'{name}.jsonl')
+        process = subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'batch_process.py'), '--csv', 'input.csv',
+                                  '--threads', '1', '--progress', 'lines', '--token_budget', str(TOKEN_BUDGET),
+                                  '--trace', trace_path, *extra],
+                                 cwd=tmp_path, env=env, capture_output=True, text=True, timeout=1800)
+        assert process.returncode == 0, process.stderr
+        assert f'Successfully processed {pdb_id}' in process.stdout, process.stdout
+        return {span['stage']: span for span in read_trace(trace_path) if span['target'] == pdb_id}
+
+    # Cold run: every stage runs, the prompt is compacted and the LLM is asked once
+    spans = run('cold')
+    assert all(span['status'] == 'done' for span in spans.values())
+    counters = spans['template']['counters']
+    assert counters['tokens_after_compaction'] < counters['tokens_before_compaction']
+    assert llm_requests['requests'] == 1
+    assert (tmp_path / 'result' / 'csv' / f'{pdb_id}.csv').exists()
+
+    # Resumed run: the ledger skips every finished stage
+    spans = run('resumed')
+    assert all(span['status'] == 'skipped' for span in spans.values())
+    assert llm_requests['requests'] == 1
+
+    # Replay without the ledger: every stage runs again, the answer comes from the LLM cache
+    spans = run('replay', '--no_resume', '--llm_replay')
+    assert spans['llm']['status'] == 'done'
+    assert spans['llm']['counters'].get('llm_cache_hits') == 1
+    assert llm_requests['requests'] == 1
@@ -0,0 +1,73 @@
+# Unit tests of config/PromptCompactor.py: residue collapsing and token budgets.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+from config.PromptCompactor import PromptCompactor, COUNT_NOTE, dedupe_fasta
+from config.TemplateFiller import CompiledTemplate
+
+TEMPLATE = CompiledTemplate('Summary: __fill sum info__\nSequence:\n__fill seq info__\nContacts:\n__fill pdb info__\n')
+
+
+def hydrophobic_table(residues, contacts_per_residue=3):
+    rows = []
+    for number in range(1, residues + 1):
+        for contact in range(contacts_per_residue):
+            rows.append({'RESNR': number, 'RESTYPE': 'LEU', 'RESCHAIN': 'A', 'RESCHAIN_LIG': 'B',
+                         'DIST': 3.0 + number * 0.1 + contact * 0.01,
+                         'LIGCOO': (1.234, 2.345, 3.456), 'PROTCOO': (4.567, 5.678, 6.789)})
+    return pd.DataFrame(rows)
+
+
+def test_compact_table_keeps_closest_contact_per_residue():
+    compactor = PromptCompactor()
+    df = hydrophobic_table(4).sample(frac=1, random_state=0)
+    compacted = compactor.compact_table('hydrophobic', df)
+    assert len(compacted) == 4
+    assert list(compacted['RESNR']) == [1, 2, 3, 4]
+    assert list(compacted['N']) == [3, 3, 3, 3]
+    assert compacted['DIST'].tolist() == pytest.approx([3.1, 3.2, 3.3, 3.4])
+    assert compacted['LIGCOO'][0] == (1.2, 2.3, 3.5)
+
+
+def test_compacted_tables_explain_the_count_column():
+    compactor = PromptCompactor()
+    prompt, before, after = compactor.build(TEMPLATE, '', '', {'hydrophobic': hydrophobic_table(4)})
+    assert COUNT_NOTE in prompt
+    assert after < before
+
+
+def test_budget_is_met_by_dropping_distant_rows():
+    compactor = PromptCompactor(token_budget=None, min_rows=3)
+    tables = {'hydrophobic': hydrophobic_table(60)}
+    _, _, unlimited = compactor.build(TEMPLATE, 'summary', '', tables)
+    budget = unlimited // 2
+    compactor.token_budget = budget
+    prompt, _, after = compactor.build(TEMPLATE, 'summary', '', tables)
+    assert after <= budget
+    # The closest residue survives, the most distant one is dropped
+    assert ' 3.10 ' in prompt
+    assert ' 9.00 ' not in prompt
+
+
+def test_min_rows_are_kept_over_budget():
+    compactor = PromptCompactor(token_budget=10, min_rows=3)
+    prompt, _, after = compactor.build(TEMPLATE, '', '', {'hydrophobic': hydrophobic_table(20)})
+    assert after > 10
+    assert prompt.count(' LEU ') == 3
+
+
+def test_identical_chains_are_listed_once():
+    fasta = '>1ABC_1|Chain A|Kinase\nMKTAYIAK\n>1ABC_2|Chain B|Kinase\nMKTAYIAK\n>1ABC_3|Chain C|Other\nGGSG\n'
+    deduped = dedupe_fasta(fasta)
+    assert deduped.count('MKTAYIAK') == 1
+    assert '(identical: 1ABC_2)' in deduped
+    assert 'GGSG' in deduped
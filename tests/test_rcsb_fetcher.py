@@ -0,0 +1,79 @@
+# Unit tests of config/RCSBFetcher.py against the RCSB stand-in of benchmark/fixture_server.py.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+for module in ('requests', 'Bio'):
+    pytest.importorskip(module)
+
+from benchmark.fixture_server import start_server
+from config.RCSBFetcher import RCSBFetcher
+from config.MetadataIndex import MetadataIndex
+
+PDB_DIR = os.path.join(REPO_ROOT, 'config', 'pdb')
+PDB_IDS = sorted(name[:-4].upper() for name in os.listdir(PDB_DIR) if name.endswith('.pdb'))[:2]
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    monkeypatch.delenv('DRUGREALIGN_OFFLINE', raising=False)
+    server, url = start_server(pdb_dir=PDB_DIR)
+    fetcher = RCSBFetcher(files_url=url, www_url=url, search_url=url, workers=4, retries=0)
+    yield fetcher, server.RequestHandlerClass.counter, url
+    fetcher.close()
+    server.shutdown()
+
+
+def test_download_writes_once_and_counts_bytes(fetcher, tmp_path):
+    fetcher, counter, _ = fetcher
+    path = tmp_path / f'{PDB_IDS[0]}.pdb'
+    assert fetcher.download_pdb(PDB_IDS[0], str(path))
+    with open(os.path.join(PDB_DIR, f'{PDB_IDS[0].lower()}.pdb'), 'r') as f:
+        assert path.read_text() == f.read()
+    assert fetcher.stats == {'requests': 1, 'bytes': path.stat().st_size}
+    # Already on disk: no second request
+    assert fetcher.download_pdb(PDB_IDS[0], str(path))
+    assert counter['requests'] == 1
+
+
+def test_fasta_is_derived_from_the_structure(fetcher, tmp_path):
+    fetcher, _, _ = fetcher
+    path = tmp_path / f'{PDB_IDS[0]}.fasta'
+    assert fetcher.download_fasta(PDB_IDS[0], str(path))
+    assert path.read_text().startswith(f'>{PDB_IDS[0]}')
+
+
+def test_missing_entry_leaves_no_file(fetcher, tmp_path, capsys):
+    fetcher, _, _ = fetcher
+    path = tmp_path / '0XXX.pdb'
+    assert not fetcher.download_pdb('0XXX', str(path))
+    assert not path.exists()
+    assert '404' in capsys.readouterr().out
+
+
+def test_unreachable_server_is_reported(tmp_path, capsys):
+    fetcher = RCSBFetcher(files_url='http://127.0.0.1:9', retries=0, timeout=5)
+    assert not fetcher.download_pdb(PDB_IDS[0], str(tmp_path / 'x.pdb'))
+    assert 'Failed to retrieve' in capsys.readouterr().out
+    fetcher.close()
+
+
+def test_prefetch_gets_structure_fasta_and_metadata(fetcher, tmp_path):
+    fetcher, counter, url = fetcher
+    index = MetadataIndex(str(tmp_path / 'metadata.sqlite'), graphql_url=f'{url}/graphql', fetcher=fetcher)
+    result = fetcher.prefetch(PDB_IDS + PDB_IDS[:1], save_root=str(tmp_path), metadata_index=index)
+    assert result == {pdb_id: True for pdb_id in PDB_IDS}
+    for pdb_id in PDB_IDS:
+        assert (tmp_path / 'pdb' / f'{pdb_id}.pdb').exists()
+        assert (tmp_path / 'fasta' / f'{pdb_id}.fasta').exists()
+        assert index.get(pdb_id)['PDB ID'] == pdb_id
+    # Two files per entry and one metadata query for all of them
+    assert counter['requests'] == 2 * len(PDB_IDS) + 1
+    assert fetcher.prefetch(PDB_IDS, save_root=str(tmp_path), metadata_index=index) == {pdb_id: True for pdb_id in PDB_IDS}
+    assert counter['requests'] == 2 * len(PDB_IDS) + 1
+    index.close()
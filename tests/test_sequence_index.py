@@ -0,0 +1,102 @@
+# Unit tests of config/SequenceIndex.py: the indexed, vectorised search must find the hits a plain
+# Smith-Waterman over every sequence finds.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import random
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+np = pytest.importorskip('numpy')
+
+from config.SequenceIndex import SequenceIndex, SCORES, encode
+
+RESIDUES = 'ACDEFGHIKLMNPQRSTVWY'
+GAP = 5
+
+
+def brute_force_score(query, target, gap=GAP):
+    # Textbook Smith-Waterman with a linear gap penalty, one cell at a time
+    a, b = encode(query), encode(target)
+    previous = [0] * (len(b) + 1)
+    best = 0
+    for i in range(len(a)):
+        current = [0] * (len(b) + 1)
+        for j in range(len(b)):
+            current[j + 1] = max(0, previous[j] + int(SCORES[a[i], b[j]]), previous[j + 1] - gap, current[j] - gap)
+        best = max(best, max(current))
+        previous = current
+    return best
+
+
+def mutate(sequence, rng, rate=0.15):
+    residues = [rng.choice(RESIDUES) if rng.random() < rate else residue for residue in sequence]
+    return ''.join(residues)
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    rng = random.Random(7)
+    return {f'{index + 1}AB{index % 10}_A': ''.join(rng.choice(RESIDUES) for _ in range(rng.randint(40, 120)))
+            for index in range(40)}
+
+
+@pytest.fixture(scope='module')
+def index(sequences, tmp_path_factory):
+    root = tmp_path_factory.mktemp('seq_index')
+    fasta = root / 'seqres.txt'
+    with open(fasta, 'w') as f:
+        for name, sequence in sequences.items():
+            f.write(f'>{name.lower()} mol:protein length:{len(sequence)}  TEST\n{sequence}\n')
+        # A duplicate chain and a nucleic acid, which is skipped
+        first = next(iter(sequences))
+        f.write(f'>{first[:4].lower()}_b mol:protein length:0  TEST\n{sequences[first]}\n')
+        f.write('>9XYZ_A mol:na length:12  DNA\nACGTACGTACGT\n')
+    return SequenceIndex.build(str(fasta), str(root / 'index'))
+
+
+def test_identical_chains_are_stored_once(index, sequences):
+    assert len(index) == len(sequences)
+    assert index.meta['chains'] == len(sequences) + 1
+    first = next(iter(sequences))
+    assert [first, f'{first[:4]}_B'] in index.ids
+
+
+def test_search_many_matches_brute_force(index, sequences):
+    rng = random.Random(11)
+    names = list(sequences)
+    queries = []
+    for name in rng.sample(names, 6):
+        start = rng.randint(0, 10)
+        queries.append((name, mutate(sequences[name][start:start + 30], rng)))
+    results = index.search_many([query for _, query in queries] + [queries[0][1]], top_k=3, candidates=len(index),
+                                prefilter=0.0, gap=GAP)
+    assert len(results) == len(queries)
+    for name, query in queries:
+        hits = results[query]
+        expected = {other: brute_force_score(query, sequence) for other, sequence in sequences.items()}
+        assert hits[0]['score'] == max(expected.values())
+        assert hits[0]['id'] == name
+        for hit in hits:
+            assert hit['score'] == expected[hit['id']]
+        assert [hit['score'] for hit in hits] == sorted((hit['score'] for hit in hits), reverse=True)
+
+
+def test_exact_match_has_full_identity_and_coverage(index, sequences):
+    name, sequence = list(sequences.items())[3]
+    hit = index.search(sequence, top_k=1)[0]
+    assert hit['id'] == name
+    assert hit['pdb_id'] == name.split('_')[0]
+    assert hit['identity'] == 1.0
+    assert hit['query_coverage'] == 1.0
+    assert hit['target_coverage'] == 1.0
+    assert hit['score'] == brute_force_score(sequence, sequence)
+
+
+def test_identity_cutoff_filters_hits(index, sequences):
+    rng = random.Random(3)
+    query = mutate(list(sequences.values())[5], rng, rate=0.5)
+    assert all(hit['identity'] >= 0.9 for hit in index.search(query, identity_cutoff=0.9, prefilter=0.0))
@@ -0,0 +1,76 @@
+# Unit tests of config/StateLedger.py: when a recorded stage counts as finished on resume.
+#
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+from types import SimpleNamespace
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from config.StateLedger import StateLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = StateLedger(str(tmp_path / 'ledger.sqlite'))
+    yield ledger
+    ledger.close()
+
+
+def finish(ledger, target, output, fingerprint=None, status='done'):
+    input_hash = StateLedger.input_hash(target, fingerprint)
+    ledger.record('1ABC', 'fetch', status, input_hash, [str(output)], duration=0.1, state={'pdb_path': str(output)})
+    return input_hash
+
+
+def test_finished_stage_is_resumed(ledger, tmp_path):
+    output = tmp_path / '1ABC.pdb'
+    output.write_text('ATOM\n')
+    target = SimpleNamespace(pdb_id='1ABC', pdb_path=None)
+    input_hash = finish(ledger, target, output)
+    assert ledger.finished_state('1ABC', 'fetch', input_hash) == {'pdb_path': str(output)}
+
+
+def test_error_is_not_part_of_the_input_hash():
+    assert (StateLedger.input_hash(SimpleNamespace(pdb_id='1ABC', error=None))
+            == StateLedger.input_hash(SimpleNamespace(pdb_id='1ABC', error='boom')))
+
+
+def test_changed_input_or_settings_invalidate(ledger, tmp_path):
+    output = tmp_path / '1ABC.pdb'
+    output.write_text('ATOM\n')
+    target = SimpleNamespace(pdb_id='1ABC', pdb_path=None)
+    finish(ledger, target, output, fingerprint={'model': 'gpt-4o'})
+    changed_target = SimpleNamespace(pdb_id='1ABC', pdb_path='other.pdb')
+    assert ledger.finished_state('1ABC', 'fetch', StateLedger.input_hash(changed_target, {'model': 'gpt-4o'})) is None
+    assert ledger.finished_state('1ABC', 'fetch', StateLedger.input_hash(target, {'model': 'gpt-4o-mini'})) is None
+    assert ledger.finished_state('1ABC', 'fetch', StateLedger.input_hash(target, {'model': 'gpt-4o'})) is not None
+
+
+def test_changed_or_removed_output_invalidates(ledger, tmp_path):
+    output = tmp_path / '1ABC.pdb'
+    output.write_text('ATOM\n')
+    input_hash = finish(ledger, SimpleNamespace(pdb_id='1ABC'), output)
+    output.write_text('ATOM\nATOM\n')
+    assert ledger.finished_state('1ABC', 'fetch', input_hash) is None
+    output.unlink()
+    assert ledger.finished_state('1ABC', 'fetch', input_hash) is None
+
+
+def test_output_missing_when_recorded_is_never_finished(ledger, tmp_path):
+    output = tmp_path / '1ABC.pdb'
+    input_hash = finish(ledger, SimpleNamespace(pdb_id='1ABC'), output)
+    assert ledger.get('1ABC', 'fetch')['outputs'] == {str(output): None}
+    # Written later by someone else: still not trusted, since the stage never saw it
+    output.write_text('ATOM\n')
+    assert ledger.finished_state('1ABC', 'fetch', input_hash) is None
+
+
+def test_failed_stage_runs_again(ledger, tmp_path):
+    output = tmp_path / '1ABC.pdb'
+    output.write_text('ATOM\n')
+    input_hash = finish(ledger, SimpleNamespace(pdb_id='1ABC'), output, status='failed')
+    assert ledger.finished_state('1ABC', 'fetch', input_hash) is None
+    assert ledger.summary() == [('fetch', 'failed', 1, 0.1)]